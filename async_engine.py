@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+from client import get_token_cache, reddit_settings
+from metrics import async_tracing_requestor
+from retry import guard_client_retries
+
+logger = logging.getLogger(__name__)
+
+class AsyncEngine:
+    """
+    asyncpraw backend for the posting pipeline
+
+    Runs an AsyncPipeline in its own event loop with one asyncpraw client, so media
+    uploads, submissions, comment replies and submission URL lookups for different
+    subreddits overlap instead of running one request at a time. The jobs reach the
+    client through `reddit` while run() is running (see engine.AsyncExecutor).
+    """
+
+    def __init__(self, media_cache, settings=None):
+        """
+        Args:
+            media_cache (MediaCache): Cache of uploaded media, shared with the sync backend
+            settings (dict): asyncpraw.Reddit keyword arguments (default: from the environment)
+        """
+        self.media_cache = media_cache
+        self.settings = settings or reddit_settings()
+        self.reddit = None
+
+    def submission(self, submission_id):
+        """Return a lazy submission by id, e.g. to comment on it when resuming a run"""
+        from asyncpraw.models import Submission
+        return Submission(self.reddit, id=submission_id)
+
+    def run(self, pipeline):
+        """Run an AsyncPipeline to completion"""
+        asyncio.run(self._run(pipeline))
+
+    async def _run(self, pipeline):
+        # asyncpraw is optional; only the async backend needs it
+        import asyncpraw
+
+        from http_session import create_async_session, session_settings
+
+        http_settings = session_settings()
+        # The session is closed along with the client
+        session = create_async_session(http_settings)
+        async with asyncpraw.Reddit(**self.settings, timeout=http_settings['read_timeout'],
+                                    requestor_class=async_tracing_requestor(),
+                                    requestor_kwargs={'session': session}) as reddit:
+            self.reddit = reddit
+            guard_client_retries(reddit._core)
+            # Get the OAuth token once up front, otherwise every job in the first batch requests its own
+            if not get_token_cache().attach(reddit._core._authorizer, self.settings):
+                await reddit._core._authorizer.refresh()
+            # Budget the run on the headers seen by this client
+            sync_reddit, pipeline.scheduler.reddit = pipeline.scheduler.reddit, reddit
+            try:
+                await pipeline.run()
+            finally:
+                pipeline.scheduler.reddit = sync_reddit
+                self.reddit = None
@@ -0,0 +1,55 @@
+"""
+Compare wall time of the sync, threaded and async backends against the local mock Reddit server
+
+Each run makes image posts to N subreddits and comments on every post, so it covers
+the media upload, submission, websocket, URL lookup and comment requests.
+
+    python -m benchmarks.async_vs_sync --sizes 10 100 500 --latency 0.02
+"""
+import argparse
+import os
+import time
+
+from benchmarks.common import IMAGE_PATH, start_mock
+
+def run_benchmark(sizes, latency, image_path):
+    # The budget is set high so the comparison measures request overlap, not rate limiting
+    server, state_dir = start_mock(latency=latency, ratelimit=10 ** 9)
+
+    import main as red_post
+    from media_cache import MediaCache
+
+    print(f"Mock server latency: {latency * 1000:.0f} ms per request")
+    print(f"{'targets':>8} {'backend':>8} {'wall (s)':>9} {'requests':>9} {'posts/s':>8} {'speedup':>8}")
+    for size in sizes:
+        subreddits = [f"bench{i}" for i in range(size)]
+        wall_times = {}
+        for backend in ("sync", "threaded", "async"):
+            red_post.backend = backend
+            red_post.get_engine().media_cache = MediaCache(os.path.join(state_dir, f"media_{backend}_{size}.json"))
+            server.reset_stats()
+
+            # A title of its own per run, or the repost index would skip every post after the first backend's
+            title = f"benchmark post {backend} {size} {time.time()}"
+            start = time.perf_counter()
+            (successful, failed, _), _ = red_post.post_and_comment(
+                title=title, content="", subreddit_list=subreddits, comment_text="benchmark comment",
+                post_type="image", image_path=image_path)
+            wall_times[backend] = elapsed = time.perf_counter() - start
+
+            if failed:
+                print(f"warning: {len(failed)} {backend} posts failed")
+            speedup = wall_times["sync"] / elapsed
+            print(f"{size:>8} {backend:>8} {elapsed:>9.2f} {server.stats['requests']:>9} "
+                  f"{len(successful) / elapsed:>8.1f} {speedup:>7.1f}x")
+
+    red_post.close_run_journal()
+    server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sync, threaded and async posting backends")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500], help="Numbers of target subreddits")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the mock server adds per request")
+    parser.add_argument('--image', default=IMAGE_PATH, help="Image to post")
+    args = parser.parse_args()
+    run_benchmark(args.sizes, args.latency, args.image)
@@ -0,0 +1,34 @@
+"""Shared setup for the benchmarks: a mock Reddit server and the posting code pointed at it"""
+import logging
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import percentile
+from mock_reddit import MockReddit
+
+IMAGE_PATH = os.path.join(ROOT, 'testimage.jpg')
+
+def start_mock(**options):
+    """
+    Start a mock Reddit server and point the environment at it
+
+    Must be called before main is imported, since the state directory is read when storage is imported.
+    The journal and media cache go to a fresh temporary state directory.
+
+    Args:
+        **options: MockReddit keyword arguments
+
+    Returns:
+        tuple: (server, state_dir)
+    """
+    state_dir = tempfile.mkdtemp(prefix='red_post_bench_')
+    os.environ['RED_POST_STATE_DIR'] = state_dir
+    server = MockReddit(**options).start()
+    os.environ.update(server.env())
+    # Failures show up in the results; keep the log output out of the tables
+    logging.disable(logging.CRITICAL)
+    return server, state_dir
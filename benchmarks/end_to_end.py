@@ -0,0 +1,87 @@
+"""
+End-to-end benchmark of text, link and image runs against the local mock Reddit server
+
+Reports throughput, p50/p99 per-post latency (from dispatch to the finished submission)
+and bytes uploaded, so performance changes can be checked against numbers. Use the
+--error-rate and --api-error-rate options to measure the failure paths as well.
+
+    python -m benchmarks.end_to_end --posts 50 --latency 0.02 --backend sync
+"""
+import argparse
+import os
+import time
+
+from benchmarks.common import IMAGE_PATH, percentile, start_mock
+
+POST_TYPES = ("text", "link", "image")
+
+class LatencyRecorder:
+    """Stands in for the Journal and keeps the time of every job state change in memory"""
+
+    def __init__(self):
+        self.started = {}
+        self.latencies = {}
+
+    def start_run(self, params, run_id=None):
+        return run_id or "benchmark"
+
+    def record(self, run_id, kind, name, state, **fields):
+        if kind != "submit":
+            return
+        if state == "in_flight":
+            self.started[name] = time.perf_counter()
+        elif state == "succeeded":
+            self.latencies[name] = time.perf_counter() - self.started[name]
+
+def run_benchmark(post_types, posts, backend, comment, image_path, **mock_options):
+    server, state_dir = start_mock(**mock_options)
+
+    import main as red_post
+    from media_cache import MediaCache
+    red_post.backend = backend
+
+    print(f"backend={backend} posts={posts} latency={mock_options['latency'] * 1000:.0f}ms "
+          f"error_rate={mock_options['error_rate']} api_error_rate={mock_options['api_error_rate']}")
+    print(f"{'type':>6} {'ok':>5} {'failed':>6} {'wall (s)':>9} {'posts/s':>8} {'p50 (ms)':>9} "
+          f"{'p99 (ms)':>9} {'requests':>9} {'errors':>7} {'uploaded':>10}")
+    for post_type in post_types:
+        red_post.get_engine().media_cache = MediaCache(os.path.join(state_dir, f"media_{post_type}.json"))
+        recorder = LatencyRecorder()
+        server.reset_stats()
+
+        start = time.perf_counter()
+        (successful, failed, _), _ = red_post.post_and_comment(
+            title=f"benchmark {post_type} post", content="benchmark body",
+            subreddit_list=[f"bench{i}" for i in range(posts)],
+            comment_text="benchmark comment" if comment else None, post_type=post_type,
+            url="https://example.com/benchmark", image_path=image_path, journal=recorder)
+        elapsed = time.perf_counter() - start
+
+        latencies = list(recorder.latencies.values())
+        print(f"{post_type:>6} {len(successful):>5} {len(failed):>6} {elapsed:>9.2f} "
+              f"{len(successful) / elapsed:>8.1f} {percentile(latencies, 50) * 1000:>9.1f} "
+              f"{percentile(latencies, 99) * 1000:>9.1f} {server.stats['requests']:>9} "
+              f"{server.stats['errors']:>7} {server.stats['bytes_uploaded']:>10}")
+
+    red_post.close_run_journal()
+    server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark text, link and image runs against a mock Reddit API")
+    parser.add_argument('--types', nargs='+', choices=POST_TYPES, default=list(POST_TYPES), help="Post types to run")
+    parser.add_argument('--posts', type=int, default=50, help="Target subreddits per run")
+    parser.add_argument('--backend', choices=["sync", "threaded", "async"], default="sync")
+    parser.add_argument('--no-comments', action='store_true', help="Only post, don't comment on the posts")
+    parser.add_argument('--image', default=IMAGE_PATH, help="Image to post")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds the mock server adds per request")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra seconds per request")
+    parser.add_argument('--ratelimit', type=int, default=10 ** 9, help="Requests per rate limit window")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument('--error-status', type=int, default=503, help="HTTP status of injected errors")
+    parser.add_argument('--api-error-rate', type=float, default=0.0,
+                        help="Fraction of submits and comments that get a RATELIMIT error")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the injected latency and errors")
+    args = parser.parse_args()
+    run_benchmark(args.types, args.posts, args.backend, not args.no_comments, args.image,
+                  latency=args.latency, jitter=args.jitter, ratelimit=args.ratelimit, error_rate=args.error_rate,
+                  error_status=args.error_status, api_error_rate=args.api_error_rate, seed=args.seed)
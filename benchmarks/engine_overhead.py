@@ -0,0 +1,145 @@
+"""
+Measure the posting engine's own cost per job, without any network time
+
+Two layers, each for every executor that can run it:
+
+- pipeline: no-op jobs through the pipeline alone (scheduling, retry bookkeeping, event
+  publishing and, with --journal, journal records)
+- engine: a full post_and_comment run against an in-process fake client whose submits
+  and replies return at once, so what is left is validation, rule checks, the repost
+  index, job building, the pipeline and logging
+
+The async executor only runs the pipeline layer, since its client is a real asyncpraw one.
+
+    python -m benchmarks.engine_overhead --jobs 2000 --repeat 5 --journal
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.common import ROOT  # noqa: F401, puts the repository on sys.path
+
+from engine import PostingEngine
+from events import EventBus
+from image_prep import ImagePreparer
+from journal import Journal
+from media_cache import MediaCache
+from metrics import percentile
+from pipeline import AsyncPipeline, Job, Pipeline, ThreadedPipeline
+from post_index import PostIndex
+from scheduler import RateLimitScheduler
+from subreddit_rules import SubredditRulesCache
+
+_ids = itertools.count()
+
+class FakeComment:
+    permalink = "/r/bench/comments/fake/"
+
+    def __init__(self):
+        self.id = f"c{next(_ids)}"
+
+class FakeSubmission:
+    def __init__(self, subreddit_name):
+        self.id = f"s{next(_ids)}"
+        self.url = f"https://www.reddit.com/r/{subreddit_name}/comments/{self.id}/"
+
+    def reply(self, text):
+        return FakeComment()
+
+class FakeSubreddit:
+    def __init__(self, name):
+        self.name = name
+
+    def submit(self, title, selftext=None, url=None, flair_id=None, flair_text=None):
+        return FakeSubmission(self.name)
+
+class FakeReddit:
+    """Answers the calls the engine makes for text and link posts, without any I/O"""
+
+    def subreddit(self, name):
+        return FakeSubreddit(name)
+
+    def submission(self, id):
+        return FakeSubmission("bench")
+
+class Result:
+    id = "fake"
+
+async def _async_noop():
+    return Result
+
+def pipeline_run(executor, jobs, journal, event_bus):
+    """Return seconds to run `jobs` no-op jobs through the pipeline of an executor"""
+    scheduler = RateLimitScheduler()
+    run_id = journal.start_run({"benchmark": executor}) if journal else None
+    options = dict(journal=journal, run_id=run_id, event_bus=event_bus)
+    if executor == "async":
+        pipeline = AsyncPipeline(scheduler, **options)
+        action = _async_noop
+    else:
+        pipeline = ThreadedPipeline(scheduler, concurrency=4, **options) if executor == "threaded" else \
+            Pipeline(scheduler, **options)
+        action = lambda: Result
+    for i in range(jobs):
+        pipeline.add(Job("submit", f"bench{i}", action))
+    start = time.perf_counter()
+    if executor == "async":
+        asyncio.run(pipeline.run())
+    else:
+        pipeline.run()
+    return time.perf_counter() - start
+
+def engine_run(executor, posts, state_dir, journal, event_bus):
+    """Return seconds for post_and_comment of a text post to `posts` subreddits on the fake client"""
+    subreddits = [f"bench{i}" for i in range(posts)]
+    rules = SubredditRulesCache(os.path.join(state_dir, f"rules_{next(_ids)}.json"))
+    for name in subreddits:
+        rules.put(name, {"submission_type": "any", "allow_images": True, "allow_videos": True,
+                         "subreddit_type": "public"}, {})
+    reddit = FakeReddit()
+    engine = PostingEngine(lambda: reddit, MediaCache(os.path.join(state_dir, "media.json")), rules,
+                           ImagePreparer(state_dir), PostIndex(os.path.join(state_dir, f"index_{next(_ids)}.json")),
+                           journal, event_bus=event_bus)
+    start = time.perf_counter()
+    (successful, failed, _), (commented, _) = engine.post_and_comment(
+        "benchmark post", "body", subreddits, comment_text="benchmark comment", scheduler=RateLimitScheduler(),
+        executor=executor)
+    elapsed = time.perf_counter() - start
+    if failed or len(commented) != posts:
+        print(f"warning: {len(failed)} {executor} posts failed")
+    return elapsed
+
+def run_benchmark(jobs, repeat, with_journal):
+    state_dir = tempfile.mkdtemp(prefix='red_post_bench_')
+    # The engine logs every post; only its cost is measured, not that of printing it
+    logging.disable(logging.CRITICAL)
+    journal = Journal(os.path.join(state_dir, "journal.jsonl")) if with_journal else None
+    event_bus = EventBus()
+    event_bus.subscribe(lambda event: None)
+
+    print(f"{jobs} jobs per run, median of {repeat} runs, journal {'on' if with_journal else 'off'}\n")
+    print(f"{'layer':<9} {'executor':<9} {'jobs':>6} {'ms':>9} {'us/job':>8}")
+    for executor in ("sync", "threaded", "async"):
+        times = sorted(pipeline_run(executor, jobs, journal, event_bus) for _ in range(repeat))
+        elapsed = percentile(times, 50)
+        print(f"{'pipeline':<9} {executor:<9} {jobs:>6} {elapsed * 1000:>9.1f} {elapsed / jobs * 1e6:>8.1f}")
+    # A post and its comment are two jobs
+    posts = jobs // 2
+    for executor in ("sync", "threaded"):
+        times = sorted(engine_run(executor, posts, state_dir, journal, event_bus) for _ in range(repeat))
+        elapsed = percentile(times, 50)
+        print(f"{'engine':<9} {executor:<9} {posts * 2:>6} {elapsed * 1000:>9.1f} {elapsed / (posts * 2) * 1e6:>8.1f}")
+    if journal:
+        journal.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the posting engine's per-job overhead")
+    parser.add_argument('--jobs', type=int, default=2000, help="Jobs per run")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement")
+    parser.add_argument('--journal', action='store_true', help="Record the runs in a journal like real runs")
+    args = parser.parse_args()
+    run_benchmark(args.jobs, args.repeat, args.journal)
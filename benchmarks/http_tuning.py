@@ -0,0 +1,140 @@
+"""
+Measure the HTTP session tuning against the local mock Reddit server
+
+The mock adds a fixed cost to every new connection (--handshake), standing in for the
+TCP and TLS setup against the real hosts. Three measurements:
+
+- first request: time from creating the client to the answer of its first API call,
+  with startup work (image preprocessing) in between, with and without pre-warming
+- parallel requests: wall time and new connections when bursts of more requests than
+  requests' default pool keeps share one session, default session vs the tuned one
+- upload memory: peak Python memory while uploading a large file, praw's upload (the
+  whole file read into memory) vs the streamed one; each upload runs in a forked child
+  so the mock server's own buffering is not counted
+
+    python -m benchmarks.http_tuning --handshake 0.15 --threads 16 --upload-mb 32
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.common import IMAGE_PATH, start_mock
+
+def first_request(prewarm, state_dir):
+    """
+    Return seconds from client creation to its first answer, with image preprocessing in between
+
+    The OAuth token comes from the token cache (filled by a warm-up run), as on every start
+    after the first; prawcore fetches new tokens on a connection it then closes.
+    """
+    os.environ['RED_POST_PREWARM'] = '1' if prewarm else '0'
+    from client import create_reddit
+    from image_prep import ImagePreparer
+
+    start = time.perf_counter()
+    reddit = create_reddit()
+    ImagePreparer(tempfile.mkdtemp(dir=state_dir)).prepare(IMAGE_PATH)
+    reddit.user.me()
+    elapsed = time.perf_counter() - start
+    reddit._core._requestor.close()
+    return elapsed
+
+def parallel_requests(session, url, threads, rounds):
+    """
+    Return wall seconds for `threads` threads making `rounds` bursts of one request each on one session
+
+    Each burst starts when the whole previous one is done, the way pipeline jobs go out
+    together after a rate limit wait, so every connection is idle in the pool in between.
+    """
+    barrier = threading.Barrier(threads)
+
+    def work():
+        for _ in range(rounds):
+            barrier.wait()
+            session.get(f"{url}/api/v1/me", timeout=10).content
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+def upload_peak(upload, path):
+    """Return (seconds, peak traced bytes) of one upload, made in a forked child process"""
+    def child(results):
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = upload(path)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        response.raise_for_status()
+        results.put((elapsed, peak))
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=child, args=(results,))
+    process.start()
+    result = results.get(timeout=120)
+    process.join()
+    return result
+
+def run_benchmark(handshake, latency, threads, rounds, upload_mb, repeat):
+    server, state_dir = start_mock(latency=latency, handshake=handshake, ratelimit=10 ** 9)
+    os.environ['RED_POST_POOL_SIZE'] = str(threads)
+
+    import requests
+    from http_session import create_session, session_settings, stream_upload
+
+    print(f"Mock server: {handshake * 1000:.0f} ms per new connection, {latency * 1000:.0f} ms per request\n")
+
+    first_request(False, state_dir)
+    print(f"{'first request':<16} {'ms':>8}")
+    for prewarm in (False, True):
+        times = sorted(first_request(prewarm, state_dir) for _ in range(repeat))
+        print(f"{'pre-warmed' if prewarm else 'cold':<16} {times[len(times) // 2] * 1000:>8.1f}")
+
+    print(f"\n{'session':<16} {'threads':>8} {'requests':>9} {'wall s':>8} {'connections':>12}")
+    for label, session in (("default", requests.Session()), ("tuned", create_session(session_settings(),
+                                                                                      [server.url]))):
+        server.reset_stats()
+        elapsed = parallel_requests(session, server.url, threads, rounds)
+        print(f"{label:<16} {threads:>8} {threads * rounds:>9} {elapsed:>8.2f} "
+              f"{server.stats['connections']:>12}")
+        session.close()
+
+    path = os.path.join(state_dir, 'upload.bin')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(upload_mb * 1024 * 1024))
+    fields = {'key': 'bench/upload.bin', 'Content-Type': 'application/octet-stream'}
+    session = requests.Session()
+
+    def files_upload(path):
+        # What praw's _read_and_post_media does
+        with Path(path).open('rb') as media:
+            return session.post(f"{server.url}/upload", data=fields, files={'file': media})
+
+    print(f"\n{'upload':<16} {'MB':>8} {'seconds':>8} {'peak MB':>8}")
+    for label, upload in (("files=", files_upload),
+                          ("streamed", lambda path: stream_upload(session, f"{server.url}/upload", fields, path))):
+        elapsed, peak = upload_peak(upload, path)
+        print(f"{label:<16} {upload_mb:>8} {elapsed:>8.2f} {peak / 1024 / 1024:>8.1f}")
+
+    server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the HTTP session tuning")
+    parser.add_argument('--handshake', type=float, default=0.15, help="Seconds the mock adds per new connection")
+    parser.add_argument('--latency', type=float, default=0.005, help="Seconds the mock adds per request")
+    parser.add_argument('--threads', type=int, default=16, help="Threads sharing one session")
+    parser.add_argument('--rounds', type=int, default=20, help="Bursts of parallel requests")
+    parser.add_argument('--upload-mb', type=int, default=32, help="Size of the uploaded file")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs of the first request measurement")
+    args = parser.parse_args()
+    run_benchmark(args.handshake, args.latency, args.threads, args.rounds, args.upload_mb, args.repeat)
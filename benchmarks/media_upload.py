@@ -0,0 +1,80 @@
+"""
+Measure gallery uploads against the local mock Reddit server, one at a time vs in parallel
+
+The mock limits each upload's bandwidth (--bandwidth), standing in for the upload to
+Reddit's media host. The images are prepared (see image_prep) before the runs. Every
+run posts a gallery of --images images to --subreddits subreddits with a fresh media
+cache, so the first post uploads every image and the others reuse them; the uploads
+column counts what actually went to the media host.
+
+    python -m benchmarks.media_upload --images 6 --bandwidth 2000000 --backend sync threaded
+"""
+import argparse
+import os
+import time
+
+from benchmarks.common import IMAGE_PATH, start_mock
+
+def gallery_images(state_dir, count):
+    """Return paths of `count` copies of the test image that differ in one pixel, so none share an upload"""
+    from PIL import Image
+
+    paths = []
+    with Image.open(IMAGE_PATH) as image:
+        image = image.convert('RGB')
+        for i in range(count):
+            path = os.path.join(state_dir, f"gallery{i}.jpg")
+            copy = image.copy()
+            copy.putpixel((i, 0), (i * 40 % 256, 0, 0))
+            copy.save(path, quality=95)
+            paths.append(path)
+    return paths
+
+def gallery_run(red_post, backend, workers, images, subreddits, state_dir):
+    """Return seconds to post a gallery to every subreddit with uploads `workers` at a time"""
+    from media_cache import MediaCache
+
+    red_post.get_engine().media_cache = MediaCache(os.path.join(state_dir, f"media_{backend}_{workers}.json"),
+                                             upload_workers=workers)
+    red_post.backend = backend
+    start = time.perf_counter()
+    successful, failed, _ = red_post.post_to_subreddits(
+        f"gallery {backend} {workers} {time.time()}", "", subreddits, post_type="gallery", image_paths=images)
+    elapsed = time.perf_counter() - start
+    if failed:
+        print(f"warning: {len(failed)} {backend} posts failed")
+    return elapsed
+
+def run_benchmark(backends, images, subreddit_count, bandwidth, latency, workers):
+    server, state_dir = start_mock(latency=latency, upload_bandwidth=bandwidth, ratelimit=10 ** 9)
+
+    import main as red_post
+
+    paths = gallery_images(state_dir, images)
+    subreddits = [f"bench{i}" for i in range(subreddit_count)]
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"Gallery of {images} images ({size / 1024:.0f} KB) to {subreddit_count} subreddits, "
+          f"{bandwidth / 1e6:.1f} MB/s per upload, {latency * 1000:.0f} ms per request\n")
+    # Prepare the images once, so every run measures only the uploads and submits
+    red_post.get_engine().image_preparer.prepare_many(paths)
+    print(f"{'backend':<9} {'workers':>8} {'seconds':>8} {'uploads':>8} {'KB up':>8}")
+    for backend in backends:
+        for count in (1, workers):
+            server.reset_stats()
+            elapsed = gallery_run(red_post, backend, count, paths, subreddits, state_dir)
+            print(f"{backend:<9} {count:>8} {elapsed:>8.2f} {server.stats['endpoints'].get('upload', 0):>8} "
+                  f"{server.stats['bytes_uploaded'] / 1024:>8.0f}")
+    red_post.close_run_journal()
+    server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sequential vs parallel gallery uploads")
+    parser.add_argument('--backend', nargs='+', default=["sync", "threaded", "async"],
+                        choices=["sync", "threaded", "async"], help="Backends to measure")
+    parser.add_argument('--images', type=int, default=6, help="Images in the gallery")
+    parser.add_argument('--subreddits', type=int, default=3, help="Subreddits the gallery is posted to")
+    parser.add_argument('--bandwidth', type=float, default=2e6, help="Upload bytes per second of the mock")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the mock adds per request")
+    parser.add_argument('--workers', type=int, default=4, help="Parallel uploads to compare with one")
+    args = parser.parse_args()
+    run_benchmark(args.backend, args.images, args.subreddits, args.bandwidth, args.latency, args.workers)
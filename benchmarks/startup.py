@@ -0,0 +1,69 @@
+"""
+Measure startup cost: module import time and time to the first authenticated request
+
+Imports are timed in fresh interpreters, so nothing is cached between runs. The first
+request is timed against the local mock Reddit server with an empty and a warm token cache.
+
+    python -m benchmarks.startup --repeat 5 --latency 0.05
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import ROOT, start_mock
+from metrics import percentile
+
+# Modules timed on their own; the heavy dependencies are there for comparison
+MODULES = ("main", "gui_main", "praw", "PIL.ImageTk")
+
+def import_time(module, env):
+    """Return the seconds a fresh interpreter spends importing a module"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.split()[-1])
+
+def first_request_time(server):
+    """Return the seconds from creating a client to the answer of its first request"""
+    from client import create_reddit
+
+    server.reset_stats()
+    start = time.perf_counter()
+    create_reddit().user.me()
+    return time.perf_counter() - start, server.stats['requests']
+
+def run_benchmark(repeat, latency):
+    server, state_dir = start_mock(latency=latency)
+    env = dict(os.environ)
+
+    print(f"{'module':<12} {'p50 ms':>8} {'max ms':>8}")
+    for module in MODULES:
+        times = [import_time(module, env) for _ in range(repeat)]
+        if None in times:
+            print(f"{module:<12} {'n/a':>8} {'n/a':>8}")
+            continue
+        print(f"{module:<12} {percentile(times, 50) * 1000:>8.1f} {max(times) * 1000:>8.1f}")
+
+    from client import get_token_cache
+
+    print(f"\nMock server latency: {latency * 1000:.0f} ms per request")
+    print(f"{'token cache':<12} {'p50 ms':>8} {'requests':>9}")
+    for label in ("cold", "warm"):
+        results = []
+        for _ in range(repeat):
+            if label == "cold" and os.path.exists(get_token_cache().path):
+                os.remove(get_token_cache().path)
+            results.append(first_request_time(server))
+        print(f"{label:<12} {percentile([t for t, _ in results], 50) * 1000:>8.1f} {results[-1][1]:>9}")
+
+    server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark import time and time to the first request")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds the mock server adds per request")
+    args = parser.parse_args()
+    run_benchmark(args.repeat, args.latency)
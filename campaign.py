@@ -0,0 +1,182 @@
+import csv
+import json
+import logging
+import os
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Manifest columns that may hold a list of subreddits as one string, e.g. "test, pics"
+SUBREDDIT_SEPARATORS = (",", ";", " ")
+
+# Separator of the gallery images in one string, e.g. "a.jpg;b.jpg" (paths may contain commas and spaces)
+PATH_SEPARATOR = ";"
+
+def parse_time(value):
+    """
+    Parse the earliest time of a manifest row
+
+    Args:
+        value: Unix timestamp, ISO 8601 string (local time if it has no offset), or empty
+
+    Returns:
+        float: Unix timestamp, or None if the post may go out right away
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value).strip()).timestamp()
+
+def _parse_subreddits(value):
+    if isinstance(value, str):
+        for separator in SUBREDDIT_SEPARATORS:
+            value = value.replace(separator, " ")
+        value = value.split()
+    return [name.strip().removeprefix("r/") for name in value or [] if name.strip()]
+
+def _parse_paths(value):
+    if isinstance(value, str):
+        value = value.split(PATH_SEPARATOR)
+    return [path.strip() for path in value or [] if path.strip()]
+
+def _post_from_row(row, number):
+    """
+    Turn one manifest row into a post dict with the fields post_and_comment uses
+
+    A row that cannot be read gets an "error" instead of failing the whole manifest;
+    PostingEngine.validate reports it.
+    """
+    post_type = (row.get("type") or "text").strip().lower()
+    earliest, error = None, None
+    try:
+        earliest = parse_time(row.get("earliest"))
+    except (ValueError, TypeError, OverflowError):
+        error = f"Invalid earliest time: {row.get('earliest')!r}"
+    return {
+        "row": number,
+        "post_type": post_type,
+        "title": row.get("title") or "",
+        "content": row.get("body") or row.get("content") or "",
+        "url": row.get("url") or None,
+        "image_path": row.get("image") or row.get("image_path") or None,
+        "image_paths": _parse_paths(row.get("images") or row.get("image_paths")) or None,
+        "video_path": row.get("video") or row.get("video_path") or None,
+        "comment_text": row.get("comment") or row.get("comment_text") or None,
+        "subreddits": _parse_subreddits(row.get("subreddits") or row.get("subreddit")),
+        "earliest": earliest,
+        "error": error,
+    }
+
+def _iter_json_values(f, chunk_size=64 * 1024):
+    """
+    Yield the values of a JSON array, or of a JSON Lines file, without loading the whole file
+
+    Objects are decoded one at a time from a sliding buffer.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    eof = False
+    while True:
+        # Skip whitespace and the array punctuation between values
+        stripped = buffer.lstrip()
+        if not started and stripped.startswith("["):
+            started, stripped = True, stripped[1:].lstrip()
+        while stripped[:1] in (",", "]"):
+            stripped = stripped[1:].lstrip()
+        buffer = stripped
+        if buffer:
+            try:
+                value, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(buffer) or eof or not isinstance(value, (int, float)):
+                    yield value
+                    buffer = buffer[end:]
+                    continue
+        elif eof:
+            return
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+def _iter_yaml_values(f):
+    """
+    Yield the posts of a YAML manifest: one document per post, or documents holding lists of posts
+
+    safe_load_all would build a whole document at once, and the usual manifest is one
+    document with a list of all posts; instead the list items are composed and built
+    one at a time from the parser's events.
+    """
+    # PyYAML is only needed for YAML manifests
+    import yaml
+
+    loader = yaml.SafeLoader(f)
+    try:
+        loader.get_event()  # StreamStartEvent
+        while not loader.check_event(yaml.StreamEndEvent):
+            loader.get_event()  # DocumentStartEvent
+            if loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.construct_document(loader.compose_node(None, None))
+                loader.get_event()
+            else:
+                document = loader.construct_document(loader.compose_node(None, None))
+                if document is not None:
+                    yield document
+            loader.get_event()  # DocumentEndEvent
+            loader.anchors = {}
+    finally:
+        loader.dispose()
+
+def read_manifest(path):
+    """
+    Stream the posts of a campaign manifest
+
+    JSON (an array or JSON Lines), YAML and CSV manifests are supported, picked by the
+    file extension. Each row has a type (text, link, image, gallery or video), a title, a
+    body, url, image, images (a list, or paths separated by ";") or video, an optional
+    comment, the target subreddits and an optional earliest time.
+    Rows are read one at a time, so manifests of any length use little memory. A row
+    that cannot be read (e.g. a malformed earliest time) comes with an "error".
+
+    Args:
+        path (str): Path to the manifest file
+
+    Returns:
+        generator: Post dicts, in manifest order
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'r', newline='' if extension == ".csv" else None) as f:
+        if extension == ".csv":
+            rows = csv.DictReader(f)
+        elif extension in (".yaml", ".yml"):
+            rows = _iter_yaml_values(f)
+        elif extension in (".json", ".jsonl", ".ndjson"):
+            rows = _iter_json_values(f)
+        else:
+            raise ValueError(f"Unsupported manifest format: {extension or path}")
+
+        base_dir = os.path.dirname(os.path.abspath(path))
+        for number, row in enumerate(rows, start=1):
+            post = _post_from_row(row, number)
+            # Media paths are relative to the manifest
+            if post["image_path"]:
+                post["image_path"] = os.path.join(base_dir, os.path.expanduser(post["image_path"]))
+            if post["image_paths"]:
+                post["image_paths"] = [os.path.join(base_dir, os.path.expanduser(image_path))
+                                       for image_path in post["image_paths"]]
+            if post["video_path"]:
+                post["video_path"] = os.path.join(base_dir, os.path.expanduser(post["video_path"]))
+            yield post
@@ -0,0 +1,163 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+from storage import state_path
+
+logger = logging.getLogger(__name__)
+
+# Cached tokens this close to expiring are not reused
+TOKEN_EXPIRY_MARGIN = 60
+
+def reddit_settings():
+    """
+    Return the praw/asyncpraw Reddit keyword arguments from the environment (.env)
+
+    REDDIT_OAUTH_URL and REDDIT_URL optionally point the client at another API host,
+    e.g. the local mock server used for benchmarks.
+    """
+    settings = dict(
+        client_id=os.getenv('REDDIT_CLIENT_ID'),
+        client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
+        password=os.getenv('REDDIT_PASSWORD'),
+        user_agent=os.getenv('REDDIT_USER_AGENT'),
+        username=os.getenv('REDDIT_USERNAME'),
+    )
+    if os.getenv('REDDIT_OAUTH_URL'):
+        settings['oauth_url'] = os.getenv('REDDIT_OAUTH_URL')
+    if os.getenv('REDDIT_URL'):
+        settings['reddit_url'] = os.getenv('REDDIT_URL')
+    if os.getenv('praw_check_for_updates') is None:
+        # praw would otherwise ask PyPI for a newer version on startup
+        settings['check_for_updates'] = False
+    return settings
+
+class TokenCache:
+    """
+    OAuth access tokens kept on disk, so a new process can skip the token request
+
+    Tokens are keyed by API host, client id and username and only reused until shortly
+    before they expire. If Reddit rejects a cached token, prawcore drops it and fetches
+    a new one, which then replaces it in the cache. The file is readable by its owner only.
+    """
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path or state_path('tokens.json')
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(settings):
+        identity = f"{settings.get('oauth_url', '')}|{settings.get('client_id')}|{settings.get('username')}"
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        """Return (access_token, expires_at, scopes) of a usable cached token, or None"""
+        entry = self._read().get(key)
+        if entry is None or entry['expires_at'] - TOKEN_EXPIRY_MARGIN <= self.clock():
+            return None
+        return entry['access_token'], entry['expires_at'], entry['scopes']
+
+    def put(self, key, access_token, expires_at, scopes):
+        """Store a token, dropping expired ones, and write the file atomically with owner-only access"""
+        with self._lock:
+            now = self.clock()
+            tokens = {k: entry for k, entry in self._read().items() if entry['expires_at'] > now}
+            tokens[key] = {'access_token': access_token, 'expires_at': expires_at, 'scopes': sorted(scopes or [])}
+            tmp_path = f"{self.path}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tokens, f)
+            os.replace(tmp_path, self.path)
+
+    def attach(self, authorizer, settings):
+        """
+        Load a cached token into a prawcore/asyncprawcore authorizer and save the ones it fetches
+
+        Returns:
+            bool: True if a cached token was loaded
+        """
+        key = self.key(settings)
+        refresh = authorizer.refresh
+
+        def save():
+            if authorizer.access_token is not None:
+                self.put(key, authorizer.access_token, authorizer._expiration_timestamp, authorizer.scopes)
+
+        if inspect.iscoroutinefunction(refresh):
+            # asyncprawcore's refresh is a coroutine function
+            async def refresh_and_save():
+                await refresh()
+                save()
+            authorizer.refresh = refresh_and_save
+        else:
+            lock = threading.Lock()
+
+            def refresh_and_save():
+                # Threads that found no token at the same time share one token request
+                with lock:
+                    if authorizer.is_valid():
+                        return
+                    refresh()
+                    save()
+            authorizer.refresh = refresh_and_save
+
+        cached = self.get(key)
+        if cached is None:
+            return False
+        authorizer.access_token, authorizer._expiration_timestamp, scopes = cached
+        authorizer.scopes = set(scopes)
+        return True
+
+# Shared by the sync and async clients, which use the same credentials; built by get_token_cache()
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+def get_token_cache():
+    """Return the shared TokenCache, creating it on first use"""
+    global _token_cache
+    with _token_cache_lock:
+        if _token_cache is None:
+            _token_cache = TokenCache()
+        return _token_cache
+
+def create_reddit():
+    """
+    Build a praw Reddit client from the environment
+
+    praw is imported here rather than at module level, so programs that never post
+    (or have not posted yet) don't pay for importing it. Requests are traced (see metrics)
+    and go through a tuned session (see http_session), and the OAuth token is reused from
+    the token cache when possible. Connections to the API and upload hosts are opened in
+    the background while the caller gets on with its work.
+    """
+    import praw
+    from http_session import create_session, prewarm, session_settings
+    from metrics import tracing_requestor
+    from retry import guard_client_retries
+
+    settings = reddit_settings()
+    http_settings = session_settings()
+    oauth_url = settings.get('oauth_url', 'https://oauth.reddit.com')
+    reddit_url = settings.get('reddit_url', 'https://www.reddit.com')
+    session = create_session(http_settings, [oauth_url, reddit_url])
+    reddit = praw.Reddit(**settings, timeout=http_settings['read_timeout'], requestor_class=tracing_requestor(),
+                         requestor_kwargs={'session': session})
+    # A submit must not be sent twice behind the pipeline's back, see retry.single_attempt
+    guard_client_retries(reddit._core)
+    cached = get_token_cache().attach(reddit._core._authorizer, settings)
+    if http_settings['prewarm']:
+        # The token host is only needed when there is no cached token
+        prewarm(session, [oauth_url, http_settings['upload_url']] + ([] if cached else [reddit_url]))
+    return reddit
@@ -0,0 +1,516 @@
+"""
+Long-running posting daemon with a local HTTP/JSON API
+
+Keeps one authenticated Reddit client, its connection pool and one rate limit scheduler
+for as long as it runs, and accepts jobs from other programs:
+
+    POST   /jobs            submit a job, answers 202 with the job
+    GET    /jobs            list jobs (?state=queued|running|succeeded|failed|cancelled)
+    GET    /jobs/<id>       status and result of a job
+    GET    /jobs/<id>/events?after=N
+                            job events (see events.py) from number N on
+    DELETE /jobs/<id>       cancel a job; a running job stops before its next API call
+    GET    /health          authentication status and queue length
+
+Job bodies:
+
+    {"type": "post", "title": ..., "subreddits": [...], "post_type": "text|link|image|gallery|video",
+     "content": ..., "url": ..., "image_path": ..., "image_paths": [...], "video_path": ...,
+     "comment_text": ..., "delay": ...}
+    {"type": "comment", "submissions": {subreddit: submission_id, ...}, "comment_text": ..., "delay": ...}
+    {"type": "resume"}
+
+A post job's result has the "submissions" of the posts it made, ready for a comment job.
+Comment jobs may name "submission_ids" instead, at the cost of one lookup per submission.
+
+Jobs run one at a time, in the order they were submitted; each one runs its API calls
+through the pipeline like a CLI run does. The server only listens on localhost by default.
+
+Every request must send the daemon's token as "Authorization: Bearer <token>": the value
+of RED_POST_DAEMON_TOKEN, or else the token generated on first start and kept (mode 0600)
+in daemon_token in the state directory, where DaemonClient reads it. Job submissions
+must be sent as application/json, and requests with an Origin header or for a Host
+other than the one the daemon listens on are refused, so web pages the user visits
+can't reach the daemon through the browser (by a simple form POST or DNS rebinding).
+
+    python daemon.py --port 8770
+"""
+import argparse
+import hmac
+import itertools
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from events import EventBus
+from storage import state_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8770
+
+# Host header names that always reach a daemon listening on this machine
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# File in the state directory holding the generated token
+TOKEN_FILE = 'daemon_token'
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINAL_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+JOB_TYPES = ("post", "comment", "resume")
+
+# Finished jobs kept for status queries; the oldest are forgotten first
+MAX_FINISHED_JOBS = 1000
+
+# Events kept per job for /jobs/<id>/events
+MAX_JOB_EVENTS = 10000
+
+class DaemonError(Exception):
+    """A request the daemon refused, with the HTTP status to answer with"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def load_token(create=False):
+    """
+    Return the daemon's token: RED_POST_DAEMON_TOKEN, or the one kept in the state directory
+
+    Args:
+        create (bool): Generate and store a token if there is none yet
+
+    Returns:
+        str: The token, or None if there is none and create is False
+    """
+    token = os.getenv('RED_POST_DAEMON_TOKEN')
+    if token:
+        return token
+    path = state_path(TOKEN_FILE)
+    try:
+        with open(path, 'r') as f:
+            token = f.read().strip()
+    except FileNotFoundError:
+        token = None
+    if token or not create:
+        return token or None
+    token = secrets.token_urlsafe(32)
+    # Created with mode 0600 from the start, so the token is never readable by other users
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token)
+    logger.info(f"Generated a daemon token in {path}")
+    return token
+
+def validate_job(body):
+    """
+    Check a submitted job body
+
+    Returns:
+        dict: The job parameters
+
+    Raises:
+        DaemonError: If the body is not a valid job
+    """
+    if not isinstance(body, dict):
+        raise DaemonError(400, "Job must be a JSON object")
+    job_type = body.get("type", "post")
+    if job_type not in JOB_TYPES:
+        raise DaemonError(400, f"Unknown job type {job_type!r}, expected one of {', '.join(JOB_TYPES)}")
+    params = dict(body, type=job_type)
+    if job_type == "post":
+        subreddits = params.get("subreddits")
+        if isinstance(subreddits, str):
+            subreddits = [name.strip() for name in subreddits.split(',') if name.strip()]
+        if not subreddits or not params.get("title"):
+            raise DaemonError(400, "Post jobs need a title and at least one subreddit")
+        params["subreddits"] = subreddits
+        params.setdefault("post_type", "text")
+    elif job_type == "comment":
+        if not (params.get("submissions") or params.get("submission_ids")) or not params.get("comment_text"):
+            raise DaemonError(400, "Comment jobs need submissions (or submission_ids) and comment_text")
+    return params
+
+class DaemonJob:
+    """One submitted job: its parameters, state, result and the events of its run"""
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.state = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancel = threading.Event()
+        self.events = deque(maxlen=MAX_JOB_EVENTS)
+        self._event_numbers = itertools.count()
+
+    def add_event(self, event):
+        self.events.append((next(self._event_numbers), event))
+
+    def events_after(self, after):
+        """Return (events numbered `after` and later, the number to ask for next time)"""
+        numbered = list(self.events)
+        events = [event for number, event in numbered if number >= after]
+        return events, max(after, numbered[-1][0] + 1) if numbered else after
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.params['type'],
+            'state': self.state,
+            'params': self.params,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+            'error': self.error,
+        }
+
+class JobRunner:
+    """
+    Runs submitted jobs one at a time on a worker thread, with a shared scheduler
+
+    `red_post` is the main module, whose post_and_comment, comment_on_posts and
+    resume_run do the work. Every job's pipeline publishes on one event bus; its events
+    (and the tracing spans of its requests) are kept with the job that is running.
+    """
+
+    def __init__(self, red_post):
+        self.red_post = red_post
+        self.jobs = OrderedDict()  # id -> DaemonJob, in submission order
+        self.current = None
+        self.event_bus = EventBus()
+        self.event_bus.subscribe(self._on_event)
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._scheduler = None
+        self._thread = None
+
+    def start(self):
+        red_post = self.red_post
+        red_post.get_tracer().add_exporter(self.event_bus)
+        self._scheduler = red_post.RateLimitScheduler(red_post.get_reddit())
+        self._thread = threading.Thread(target=self._work, name="red-post-jobs", daemon=True)
+        self._thread.start()
+
+    def _on_event(self, event):
+        job = self.current
+        if job is not None:
+            job.add_event(event)
+
+    def submit(self, params):
+        job = DaemonJob(params)
+        with self._lock:
+            self.jobs[job.id] = job
+        self._queue.put(job)
+        logger.info(f"Queued {params['type']} job {job.id}")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            raise DaemonError(404, f"No job {job_id}")
+        return job
+
+    def list(self, state=None):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job for job in jobs if state is None or job.state == state]
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or stop a running one before its next API call"""
+        job = self.get(job_id)
+        with self._lock:
+            if job.state in FINAL_STATES:
+                raise DaemonError(409, f"Job {job_id} already {job.state}")
+            job.cancel.set()
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished = time.time()
+        logger.info(f"Cancelled job {job_id}")
+        return job
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in FINAL_STATES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.state == CANCELLED:
+                    continue
+                job.state = RUNNING
+                job.started = time.time()
+                self.current = job
+            try:
+                result = self._run(job)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                state, job.error = FAILED, str(e)
+            else:
+                state, job.result = CANCELLED if job.cancel.is_set() else SUCCEEDED, result
+            with self._lock:
+                self.current = None
+                job.state = state
+                job.finished = time.time()
+                self._forget_finished()
+
+    def _run(self, job):
+        red_post = self.red_post
+        params = job.params
+        common = dict(scheduler=self._scheduler, event_bus=self.event_bus, cancel=job.cancel)
+        if params["type"] == "post":
+            (successful, failed, submissions), (commented, not_commented) = red_post.post_and_comment(
+                title=params["title"], content=params.get("content", ""), subreddit_list=params["subreddits"],
+                comment_text=params.get("comment_text"), post_type=params["post_type"], url=params.get("url"),
+                image_path=params.get("image_path"), image_paths=params.get("image_paths"),
+                video_path=params.get("video_path"), delay=params.get("delay"),
+                comment_delay=params.get("comment_delay"), **common)
+            return {
+                'successful_posts': successful,
+                'failed_posts': failed,
+                # posted() appends to both lists in the same order
+                'submissions': {name: submission.id for name, submission in zip(successful, submissions)},
+                'successful_comments': commented,
+                'failed_comments': not_commented,
+            }
+        if params["type"] == "comment":
+            reddit = red_post.get_reddit()
+            submissions = [reddit.submission(id=submission_id) for submission_id in params.get("submission_ids", [])]
+            for subreddit_name, submission_id in (params.get("submissions") or {}).items():
+                submission = reddit.submission(id=submission_id)
+                # Known already, so comment_on_posts does not fetch the submission to name its job
+                submission.subreddit = subreddit_name
+                submissions.append(submission)
+            commented, not_commented = red_post.comment_on_posts(submissions, params["comment_text"],
+                                                                 delay=params.get("delay"), **common)
+            return {'successful_comments': commented, 'failed_comments': not_commented}
+        result = red_post.resume_run(**common)
+        if result is None:
+            return {'resumed': False}
+        (successful, failed, _), (commented, not_commented) = result
+        return {'resumed': True, 'successful_posts': successful, 'failed_posts': failed,
+                'successful_comments': commented, 'failed_comments': not_commented}
+
+class Daemon:
+    """The job runner plus the authentication status reported by /health"""
+
+    def __init__(self, red_post, token, hosts=LOCAL_HOSTS):
+        """
+        Args:
+            red_post: The main module
+            token (str): Token every request must send
+            hosts (iterable): Host header names requests may use
+        """
+        if not token:
+            raise ValueError("The daemon needs a token, see load_token")
+        self.red_post = red_post
+        self.token = token
+        self.hosts = {host.lower() for host in hosts}
+        self.runner = JobRunner(red_post)
+        self.user = None
+        self.auth_error = None
+        self.started = time.time()
+
+    def start(self):
+        self.runner.start()
+        threading.Thread(target=self._check_auth, daemon=True).start()
+
+    def _check_auth(self):
+        """Authenticate once up front, so the first job finds a warm client and token"""
+        try:
+            self.user = str(self.red_post.get_reddit().user.me())
+            logger.info(f"Authenticated as: {self.user}")
+        except Exception as e:
+            self.auth_error = str(e)
+            logger.error(f"Authentication failed: {e}")
+
+    def health(self):
+        return {
+            'user': self.user,
+            'auth_error': self.auth_error,
+            'uptime': time.time() - self.started,
+            'queued': len(self.runner.list(QUEUED)),
+            'running': self.runner.current.id if self.runner.current else None,
+        }
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    server_version = "red-post-daemon"
+
+    @property
+    def app(self):
+        return self.server.app
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _authorized(self):
+        expected = f"Bearer {self.app.token}"
+        return hmac.compare_digest(self.headers.get('Authorization', ''), expected)
+
+    def _check_origin(self):
+        """Refuse requests a browser makes for a web page: with an Origin, or to another host name"""
+        if self.headers.get('Origin') is not None:
+            raise DaemonError(403, "Cross-origin requests are not allowed")
+        host = urlparse(f"//{self.headers.get('Host', '')}").hostname or ""
+        if host.lower() not in self.app.hosts:
+            raise DaemonError(403, f"Host {host!r} is not allowed")
+
+    def _handle(self, method):
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split('/') if part]
+        query = parse_qs(parsed.query)
+        try:
+            self._check_origin()
+            if not self._authorized():
+                raise DaemonError(401, "Missing or wrong token")
+            runner = self.app.runner
+            if parts == ['health'] and method == 'GET':
+                return self._send(200, self.app.health())
+            if parts == ['jobs'] and method == 'GET':
+                state = query.get('state', [None])[0]
+                return self._send(200, {'jobs': [job.to_dict() for job in runner.list(state)]})
+            if parts == ['jobs'] and method == 'POST':
+                if self.headers.get_content_type() != 'application/json':
+                    raise DaemonError(415, "Jobs must be sent as application/json")
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    raise DaemonError(400, "Body is not valid JSON")
+                return self._send(202, runner.submit(validate_job(body)).to_dict())
+            if len(parts) == 2 and parts[0] == 'jobs' and method == 'GET':
+                return self._send(200, runner.get(parts[1]).to_dict())
+            if len(parts) == 2 and parts[0] == 'jobs' and method == 'DELETE':
+                return self._send(200, runner.cancel(parts[1]).to_dict())
+            if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'events' and method == 'GET':
+                job = runner.get(parts[1])
+                # Read the state first: once it is final, no events are added after the ones returned
+                state = job.state
+                events, next_event = job.events_after(int(query.get('after', ['0'])[0]))
+                return self._send(200, {'state': state, 'events': events, 'next': next_event})
+            raise DaemonError(404, "Not found")
+        except DaemonError as e:
+            self._send(e.status, {'error': str(e)})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, token=None, backend=None):
+    """Run the daemon until interrupted; token defaults to load_token(create=True)"""
+    # main sets up logging, the tracer and the shared caches when it is imported
+    import main as red_post
+
+    if backend:
+        red_post.backend = backend
+
+    hosts = LOCAL_HOSTS if host in ('', '0.0.0.0', '::') else (*LOCAL_HOSTS, host)
+    daemon = Daemon(red_post, token or load_token(create=True), hosts=hosts)
+    server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+    server.app = daemon
+    daemon.start()
+    logger.info(f"Listening on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        red_post.close_run_journal()
+
+class DaemonClient:
+    """
+    Client for the daemon's HTTP API, e.g. for the GUI
+
+    Args:
+        url (str): Base URL of the daemon, e.g. "http://127.0.0.1:8770"
+        token (str): Token the daemon was started with (default: from load_token)
+    """
+
+    def __init__(self, url, token=None, timeout=10):
+        self.url = url.rstrip('/')
+        self.token = token or load_token()
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method)
+        request.add_header('Content-Type', 'application/json')
+        if self.token:
+            request.add_header('Authorization', f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e).get('error', e.reason)
+            except ValueError:
+                message = e.reason
+            raise DaemonError(e.code, message) from None
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def submit(self, job):
+        return self._request('POST', '/jobs', job)
+
+    def status(self, job_id):
+        return self._request('GET', f'/jobs/{job_id}')
+
+    def events(self, job_id, after=0):
+        return self._request('GET', f'/jobs/{job_id}/events?after={after}')
+
+    def cancel(self, job_id):
+        return self._request('DELETE', f'/jobs/{job_id}')
+
+    def list(self, state=None):
+        return self._request('GET', '/jobs' + (f'?state={state}' if state else ''))['jobs']
+
+if __name__ == "__main__":
+    from engine import EXECUTORS
+
+    parser = argparse.ArgumentParser(description="Run posting jobs submitted over a local HTTP API")
+    parser.add_argument('--host', default=os.getenv('RED_POST_DAEMON_HOST', DEFAULT_HOST),
+                        help="Address to listen on (default: localhost only)")
+    parser.add_argument('--port', type=int, default=int(os.getenv('RED_POST_DAEMON_PORT', DEFAULT_PORT)),
+                        help="Port to listen on")
+    parser.add_argument('--backend', choices=sorted(EXECUTORS), help="Posting backend (default: RED_POST_BACKEND)")
+    args = parser.parse_args()
+    serve(args.host, args.port, backend=args.backend)
@@ -0,0 +1,761 @@
+"""
+The posting engine shared by the CLI (main.py), the GUI (gui_main.py) and the daemon
+
+A run is a set of jobs: one submit per target subreddit and one comment per post. How a
+post is checked, prepared and submitted depends on its post type (POST_TYPES), and how
+the jobs are run on the client depends on the executor (EXECUTORS):
+
+    sync      one request at a time with praw
+    threaded  praw jobs on a small thread pool, overlapping uploads and submits
+    async     overlapping requests with asyncpraw
+
+Both are registries, so a new post type or executor is one class plus a register call.
+Progress is reported on the EventBus passed to the engine (see events.py): every job
+publishes its state changes, and a succeeded job carries the id of what it created.
+"""
+import logging
+import os
+import time
+
+from async_engine import AsyncEngine
+from journal import DUPLICATE, FAILED, REJECTED
+from media_cache import (default_thumbnail, submit_gallery, submit_gallery_async, submit_image, submit_image_async,
+                         submit_video, submit_video_async)
+from metrics import tracer
+from pipeline import AsyncPipeline, Job, Pipeline, ThreadedPipeline
+from post_index import PostIndex
+from scheduler import RateLimitScheduler
+from subreddit_rules import prevalidate
+
+logger = logging.getLogger(__name__)
+
+# Jobs the threaded executor runs at once
+THREADS = int(os.getenv('RED_POST_THREADS') or 4)
+
+# Seconds between writes of the repost index while a run records posts; it is written when the run ends too
+INDEX_SAVE_INTERVAL = 5.0
+
+# Campaign jobs waiting in the pipeline at once; the rest of the manifest is read as they finish
+DEFAULT_MAX_PENDING = 200
+
+# Newest submissions of the account looked through to find out whether a failed submit went through
+VERIFY_LIMIT = 25
+
+# Seconds Reddit's created_utc may be behind our clock when matching a submission to a submit attempt
+CLOCK_SKEW = 300
+
+class PostType:
+    """
+    How one kind of post is validated, prepared and submitted
+
+    Posts are dicts with the title, content, url, image_path, image_paths and video_path
+    of post_and_comment (missing keys count as None). `fields` are the per-subreddit
+    title, content and flair from subreddit_rules.prevalidate.
+    """
+
+    name = None
+    # Post type whose subreddit rules apply, see subreddit_rules.check_post
+    rules_type = None
+
+    def cost(self, post):
+        """Return the requests one submit spends from the rate limit budget"""
+        return 1
+
+    def validate(self, post):
+        """Return an error message if the post cannot be made, else None"""
+        return None
+
+    def media_key(self, engine, post):
+        """Return the media part of the repost index key, see PostIndex.media_key"""
+        return engine.post_index.media_key(self.name, post.get("url"), post.get("image_path"))
+
+    def prepare(self, engine, post):
+        """Return the post to submit, e.g. with its images downscaled; called once per run"""
+        return post
+
+    def uploads(self, engine, post):
+        """Return (media_path, upload_type) of every file a submit uploads, as far as known without preparing"""
+        return []
+
+    def submit(self, engine, subreddit, post, fields):
+        """Submit the post to a praw Subreddit and return the submission"""
+        raise NotImplementedError
+
+    async def submit_async(self, engine, subreddit, post, fields):
+        """Submit the post to an asyncpraw Subreddit and return the submission"""
+        raise NotImplementedError
+
+def _missing_file(path, noun):
+    if not path:
+        return f"{noun.capitalize()} path required for {noun} post"
+    if not os.path.exists(path):
+        return f"{noun.capitalize()} file not found: {path}"
+    return None
+
+class TextPost(PostType):
+    name = rules_type = "text"
+
+    def submit(self, engine, subreddit, post, fields):
+        return subreddit.submit(title=fields["title"], selftext=fields["content"], flair_id=fields["flair_id"],
+                                flair_text=fields["flair_text"])
+
+    async def submit_async(self, engine, subreddit, post, fields):
+        return await subreddit.submit(title=fields["title"], selftext=fields["content"], flair_id=fields["flair_id"],
+                                      flair_text=fields["flair_text"])
+
+class LinkPost(PostType):
+    name = rules_type = "link"
+
+    def validate(self, post):
+        return None if post.get("url") else "URL required for link post"
+
+    def submit(self, engine, subreddit, post, fields):
+        return subreddit.submit(title=fields["title"], url=post["url"], flair_id=fields["flair_id"],
+                                flair_text=fields["flair_text"])
+
+    async def submit_async(self, engine, subreddit, post, fields):
+        return await subreddit.submit(title=fields["title"], url=post["url"], flair_id=fields["flair_id"],
+                                      flair_text=fields["flair_text"])
+
+class ImagePost(PostType):
+    name = rules_type = "image"
+
+    def cost(self, post):
+        # One request for the upload lease and one for the submit
+        return 2
+
+    def validate(self, post):
+        return _missing_file(post.get("image_path"), "image")
+
+    def prepare(self, engine, post):
+        return dict(post, image_path=engine.image_preparer.prepare(post["image_path"]))
+
+    def uploads(self, engine, post):
+        return [(engine.image_preparer.prepared_path(post["image_path"]) or post["image_path"], "link")]
+
+    def submit(self, engine, subreddit, post, fields):
+        return submit_image(subreddit, title=fields["title"], image_path=post["image_path"], cache=engine.media_cache,
+                            nsfw=False, flair_id=fields["flair_id"], flair_text=fields["flair_text"])
+
+    async def submit_async(self, engine, subreddit, post, fields):
+        return await submit_image_async(subreddit, title=fields["title"], image_path=post["image_path"],
+                                        cache=engine.media_cache, nsfw=False, flair_id=fields["flair_id"],
+                                        flair_text=fields["flair_text"])
+
+class GalleryPost(PostType):
+    name = rules_type = "gallery"
+
+    def cost(self, post):
+        # One upload lease per image and the submit; cached uploads make it cheaper
+        return len(post["image_paths"]) + 1
+
+    def validate(self, post):
+        image_paths = post.get("image_paths") or []
+        if len(image_paths) < 2:
+            return "Gallery posts need at least two images"
+        for image_path in image_paths:
+            error = _missing_file(image_path, "image")
+            if error:
+                return error
+        return None
+
+    def media_key(self, engine, post):
+        hashes = []
+        for image_path in post["image_paths"]:
+            try:
+                hashes.append(engine.post_index.image_hash(image_path))
+            except Exception:
+                hashes.append(engine.media_cache.digest(image_path))
+        return f"gallery:{','.join(hashes)}"
+
+    def prepare(self, engine, post):
+        prepared = engine.image_preparer.prepare_many(post["image_paths"])
+        return dict(post, image_paths=[prepared[image_path] for image_path in post["image_paths"]])
+
+    def uploads(self, engine, post):
+        return [(engine.image_preparer.prepared_path(image_path) or image_path, "gallery")
+                for image_path in post["image_paths"]]
+
+    def submit(self, engine, subreddit, post, fields):
+        return submit_gallery(subreddit, title=fields["title"], image_paths=post["image_paths"],
+                              cache=engine.media_cache, nsfw=False, flair_id=fields["flair_id"],
+                              flair_text=fields["flair_text"])
+
+    async def submit_async(self, engine, subreddit, post, fields):
+        return await submit_gallery_async(subreddit, title=fields["title"], image_paths=post["image_paths"],
+                                          cache=engine.media_cache, nsfw=False, flair_id=fields["flair_id"],
+                                          flair_text=fields["flair_text"])
+
+class VideoPost(PostType):
+    name = rules_type = "video"
+
+    def cost(self, post):
+        # Upload leases for the video and its thumbnail, and the submit
+        return 3
+
+    def validate(self, post):
+        return _missing_file(post.get("video_path"), "video")
+
+    def media_key(self, engine, post):
+        # The media cache memoizes the hash, so the upload does not hash the video again
+        return f"file:{engine.media_cache.digest(post['video_path'])}"
+
+    def uploads(self, engine, post):
+        return [(post["video_path"], "link"), (default_thumbnail(), "link")]
+
+    def submit(self, engine, subreddit, post, fields):
+        return submit_video(subreddit, title=fields["title"], video_path=post["video_path"], cache=engine.media_cache,
+                            nsfw=False, flair_id=fields["flair_id"], flair_text=fields["flair_text"])
+
+    async def submit_async(self, engine, subreddit, post, fields):
+        return await submit_video_async(subreddit, title=fields["title"], video_path=post["video_path"],
+                                        cache=engine.media_cache, nsfw=False, flair_id=fields["flair_id"],
+                                        flair_text=fields["flair_text"])
+
+# Post type name -> PostType
+POST_TYPES = {}
+
+def register_post_type(post_type):
+    """Make a PostType instance available under its name"""
+    POST_TYPES[post_type.name] = post_type
+    return post_type
+
+for _post_type in (TextPost(), LinkPost(), ImagePost(), GalleryPost(), VideoPost()):
+    register_post_type(_post_type)
+
+def _made_by(submission, subreddit_name, title):
+    """Return True if a submission is the post a submit job to subreddit_name with this title makes"""
+    return submission.subreddit.display_name.lower() == subreddit_name.lower() and submission.title == title
+
+class SyncExecutor:
+    """Runs a run's jobs one at a time on the engine's praw client"""
+
+    name = "sync"
+    # Jobs running at once
+    concurrency = 1
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def pipeline(self, scheduler, **options):
+        return Pipeline(scheduler, **options)
+
+    def submit(self, post_type, subreddit_name, post, fields):
+        """Job action submitting a post to one subreddit"""
+        subreddit = self.engine.get_reddit().subreddit(subreddit_name)
+        return post_type.submit(self.engine, subreddit, post, fields)
+
+    def find_submission(self, subreddit_name, title, since):
+        """Job verify check: the account's post to a subreddit with this title made since `since`, or None"""
+        for submission in self.engine.get_reddit().user.me().submissions.new(limit=VERIFY_LIMIT):
+            if submission.created_utc < since - CLOCK_SKEW:
+                break
+            if _made_by(submission, subreddit_name, title):
+                return submission
+        return None
+
+    def reply(self, submission_id, text):
+        """Job action commenting on a submission by id"""
+        return self.engine.get_reddit().submission(id=submission_id).reply(text)
+
+    def run(self, pipeline):
+        pipeline.run()
+
+class ThreadedExecutor(SyncExecutor):
+    """Runs up to THREADS praw jobs at once, see ThreadedPipeline"""
+
+    name = "threaded"
+    concurrency = THREADS
+
+    def pipeline(self, scheduler, **options):
+        return ThreadedPipeline(scheduler, concurrency=self.concurrency, **options)
+
+class AsyncExecutor:
+    """Runs a run's jobs on an asyncpraw client of its own, see AsyncEngine"""
+
+    name = "async"
+    concurrency = 8
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.client = AsyncEngine(engine.media_cache)
+
+    def pipeline(self, scheduler, **options):
+        return AsyncPipeline(scheduler, concurrency=self.concurrency, **options)
+
+    async def submit(self, post_type, subreddit_name, post, fields):
+        subreddit = await self.client.reddit.subreddit(subreddit_name)
+        return await post_type.submit_async(self.engine, subreddit, post, fields)
+
+    async def find_submission(self, subreddit_name, title, since):
+        me = await self.client.reddit.user.me()
+        async for submission in me.submissions.new(limit=VERIFY_LIMIT):
+            if submission.created_utc < since - CLOCK_SKEW:
+                break
+            if _made_by(submission, subreddit_name, title):
+                return submission
+        return None
+
+    def reply(self, submission_id, text):
+        # Submissions from an earlier run belong to a closed client; comment through this one
+        return self.client.submission(submission_id).reply(text)
+
+    def run(self, pipeline):
+        self.client.run(pipeline)
+
+# Executor name -> executor class, instantiated once per run with the engine
+EXECUTORS = {}
+
+def register_executor(executor_class):
+    """Make an executor class available under its name"""
+    EXECUTORS[executor_class.name] = executor_class
+    return executor_class
+
+for _executor_class in (SyncExecutor, ThreadedExecutor, AsyncExecutor):
+    register_executor(_executor_class)
+
+def _log_wait(job, seconds):
+    noun = "post" if job.kind == "submit" else job.kind
+    logger.info(f"Waiting {seconds:.0f} seconds before next {noun}...")
+
+def _log_post_summary(successful_posts, failed_posts):
+    logger.info(f"\nPosting complete!")
+    logger.info(f"Successful posts: {len(successful_posts)}")
+    logger.info(f"Failed posts: {len(failed_posts)}")
+
+    if successful_posts:
+        logger.info(f"Posted successfully to: {', '.join(successful_posts)}")
+    if failed_posts:
+        logger.info(f"Failed to post to: {', '.join(failed_posts)}")
+
+def _log_comment_summary(successful_comments, failed_comments):
+    logger.info(f"\nCommenting complete!")
+    logger.info(f"Successful comments: {len(successful_comments)}")
+    logger.info(f"Failed comments: {len(failed_comments)}")
+
+    if successful_comments:
+        logger.info(f"Commented successfully on: {', '.join(successful_comments)}")
+    if failed_comments:
+        logger.info(f"Failed to comment on: {', '.join(failed_comments)}")
+
+def _submission_url(submission):
+    """
+    Return the URL of a new submission without fetching it
+
+    praw fetches a text or link submission on first access to an attribute it lacks, which
+    would be a request the scheduler doesn't know about; the id is enough for a link.
+    """
+    return vars(submission).get('url') or f"https://www.reddit.com/comments/{submission.id}/"
+
+def _comment_job(reply, subreddit_name, successful_comments, failed_comments):
+    """Build the pipeline job that comments on one submission; reply() posts the comment"""
+    def succeeded(job, comment):
+        logger.info(f"Successfully commented on post in r/{job.name}: {comment.permalink}")
+        successful_comments.append(job.name)
+
+    def failed(job, e):
+        logger.error(f"Failed to comment on post in r/{job.name}: {str(e)}")
+        failed_comments.append(job.name)
+
+    return Job("comment", subreddit_name, reply, on_success=succeeded, on_failure=failed)
+
+class PostingEngine:
+    """
+    Posts to subreddits and comments on the posts, through one pipeline per run
+
+    Holds the client factory and the shared caches; every method takes the executor
+    to run on and the scheduler, event bus and cancel event of the run, so one engine
+    serves the CLI, the GUI and the daemon alike.
+    """
+
+    def __init__(self, get_reddit, media_cache, subreddit_rules, image_preparer, post_index=None, journal=None,
+                 executor="sync", event_bus=None):
+        """
+        Args:
+            get_reddit (callable): Returns the praw client (created on first use by the caller)
+            media_cache (MediaCache): Uploaded media, reused across subreddits and runs
+            subreddit_rules (SubredditRulesCache): Posting rules, checked before any upload
+            image_preparer (ImagePreparer): Downscales and re-encodes images before upload
+            post_index (PostIndex): Posts made from this account, to skip reposts (default: a new one)
+            journal (Journal): Journal runs are recorded in, for resuming (default: None, not journaled)
+            executor (str): Default executor name, see EXECUTORS
+            event_bus (EventBus): Default bus to publish job state changes on (default: None)
+        """
+        self.get_reddit = get_reddit
+        self.media_cache = media_cache
+        self.subreddit_rules = subreddit_rules
+        self.image_preparer = image_preparer
+        self.post_index = post_index if post_index is not None else PostIndex()
+        self.journal = journal
+        self.executor = executor
+        self.event_bus = event_bus
+        self._index_saved_at = 0
+        self._index_dirty = False
+
+    def post_type(self, name):
+        """Return the registered PostType for a name, or None"""
+        return POST_TYPES.get(name)
+
+    def validate(self, post):
+        """Return an error message if a post dict (with its post_type) cannot be made, else None"""
+        if post.get("error"):
+            return post["error"]
+        post_type = self.post_type(post["post_type"])
+        if post_type is None:
+            return f"Invalid post type: {post['post_type']}"
+        return post_type.validate(post)
+
+    def _executor(self, name):
+        return EXECUTORS[name or self.executor](self)
+
+    def _pipeline(self, executor, scheduler, journal=None, run_id=None, event_bus=None, cancel=None):
+        return executor.pipeline(scheduler, on_wait=_log_wait, journal=journal, run_id=run_id,
+                                 event_bus=event_bus or self.event_bus, cancel=cancel)
+
+    def _skip_duplicates(self, targets, media_key, row=None, journal=None, run_id=None):
+        """Drop the targets that already have this post from targets; returns their names"""
+        duplicates = self.post_index.duplicates(targets, media_key)
+        for subreddit_name, post in duplicates.items():
+            posted_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(post['created']))
+            where = f"row {row} to r/{subreddit_name}" if row is not None else f"to r/{subreddit_name}"
+            logger.warning(f"Not posting {where}: already posted as {post['id']} on {posted_at}")
+            if journal is not None:
+                journal.record(run_id, "submit", subreddit_name, FAILED, error=f"skipped: duplicate of {post['id']}",
+                               error_class=DUPLICATE)
+            del targets[subreddit_name]
+        return list(duplicates)
+
+    def _record_post(self, subreddit_name, title, media_key, submission):
+        # Each save writes the whole index, so saving after every post would make a run quadratic
+        self.post_index.add(subreddit_name, title, media_key, submission.id)
+        self._index_dirty = True
+        if time.monotonic() - self._index_saved_at >= INDEX_SAVE_INTERVAL:
+            self._save_index()
+
+    def _save_index(self):
+        if self._index_dirty:
+            self._index_dirty = False
+            self._index_saved_at = time.monotonic()
+            self.post_index.save()
+
+    def _targets(self, post, subreddit_list, scheduler, row=None, journal=None, run_id=None):
+        """
+        Check a post against the rules and the repost index of its target subreddits
+
+        Rules that are not cached are fetched through the run's scheduler. Subreddits the
+        rules reject and reposts are recorded in the journal as failed for good, so resuming
+        the run does not check them again.
+
+        Returns:
+            tuple: (targets, rejected, media_key) where targets maps subreddit name -> fields
+            to submit and rejected lists the subreddits that are skipped
+        """
+        post_type = self.post_type(post["post_type"])
+        where = f"row {row} to" if row is not None else "to"
+        targets, reasons = prevalidate(self.subreddit_rules, self.get_reddit(), subreddit_list, post_type.rules_type,
+                                       post["title"], post.get("content"), post.get("url"), scheduler=scheduler)
+        for subreddit_name, reason in reasons.items():
+            logger.error(f"Not posting {where} r/{subreddit_name}: {reason}")
+            if journal is not None:
+                journal.record(run_id, "submit", subreddit_name, FAILED, error=reason, error_class=REJECTED)
+        rejected = list(reasons)
+        # Posts the subreddit already has are dropped too; images are looked up before preparation
+        media_key = post_type.media_key(self, post) if targets else None
+        rejected.extend(self._skip_duplicates(targets, media_key, row=row, journal=journal, run_id=run_id))
+        return targets, rejected, media_key
+
+    def post_and_comment(self, title, content, subreddit_list, comment_text=None, post_type="text", url=None,
+                         image_path=None, image_paths=None, video_path=None, delay=None, comment_delay=None,
+                         scheduler=None, journal=None, executor=None, event_bus=None, cancel=None):
+        """
+        Post to multiple subreddits and comment on each post as soon as it is created
+
+        Each successful submission queues its comment right away. Comments are sent whenever
+        the rate limit budget allows, interleaved with the remaining submissions, so the run
+        takes about as long as the longer of the two chains instead of their sum.
+        Subreddits that already have the same post within the repost window (see post_index)
+        are skipped before anything is uploaded, and count as failed.
+
+        Args:
+            title (str): The title of the post
+            content (str): The content/selftext of the post (for text posts)
+            subreddit_list (list): List of subreddit names to post to
+            comment_text (str): Comment to add to each successful post (default: None, no comments)
+            post_type (str): A registered post type: "text", "link", "image", "gallery" or "video"
+            url (str): URL for link posts
+            image_path (str): Path to the image file of image posts
+            image_paths (list): Paths to the image files of gallery posts
+            video_path (str): Path to the video file of video posts
+            delay (int): Optional minimum delay in seconds between posts (default: None, rate limit only)
+            comment_delay (int): Optional minimum delay in seconds between comments (default: None)
+            scheduler (RateLimitScheduler): Scheduler to share with other calls (default: a new one)
+            journal (Journal): Journal to record the run in, for resuming (default: the engine's)
+            executor (str): Executor to run the jobs on (default: the engine's)
+            event_bus (EventBus): Bus to publish job state changes on (default: the engine's)
+            cancel (threading.Event): Stops the run before its next job once set (default: None)
+
+        Returns:
+            tuple: ((successful_posts, failed_posts, submissions), (successful_comments, failed_comments))
+        """
+        params = {
+            "title": title,
+            "content": content,
+            "subreddits": list(subreddit_list),
+            "comment_text": comment_text,
+            "post_type": post_type,
+            "url": url,
+            "image_path": image_path,
+            "image_paths": list(image_paths) if image_paths else None,
+            "video_path": video_path,
+            "delay": delay,
+            "comment_delay": comment_delay,
+        }
+        journal = journal or self.journal
+        run_id = journal.start_run(params) if journal else None
+        return self._run_post_jobs(params, params["subreddits"], [], scheduler, journal, run_id, executor, event_bus,
+                                   cancel)
+
+    def resume_run(self, match=None, scheduler=None, journal=None, executor=None, event_bus=None, cancel=None):
+        """
+        Resume the most recent unfinished run from the journal
+
+        Only the posts that never finished or failed for a reason worth another try (see
+        journal.RESUMABLE_ERRORS) are made again, and comments are added to the posts of
+        that run that are still missing theirs.
+
+        Args:
+            match (callable): Only resume runs whose params match (default: any run)
+            scheduler, journal, executor, event_bus, cancel: As for post_and_comment
+
+        Returns:
+            tuple: Same as post_and_comment, or None if there is nothing to resume
+        """
+        journal = journal or self.journal
+        unfinished = journal.unfinished_run(match=match)
+        if unfinished is None:
+            logger.info("No unfinished run to resume")
+            return None
+
+        run_id, params, pending_posts, pending_comments, unconfirmed = unfinished
+        logger.info(f"Resuming run {run_id}: {len(pending_posts)} posts and {len(pending_comments)} comments left")
+        return self._run_post_jobs(params, pending_posts, pending_comments, scheduler, journal, run_id, executor,
+                                   event_bus, cancel, unconfirmed)
+
+    def _run_post_jobs(self, params, subreddit_list, comment_targets, scheduler, journal, run_id, executor=None,
+                       event_bus=None, cancel=None, unconfirmed=None):
+        """
+        Run the post jobs for subreddit_list and comment jobs for (name, submission_id) pairs
+
+        Posts in `unconfirmed` (name -> time of the first attempt) may exist already; their
+        jobs check the account's submissions before posting.
+        """
+        comment_text = params["comment_text"]
+
+        successful_posts = []
+        failed_posts = []
+        submissions = []
+        successful_comments = []
+        failed_comments = []
+
+        error = self.validate(params) if subreddit_list else None
+        if error:
+            logger.error(error)
+            failed_posts.extend(subreddit_list)
+            _log_post_summary(successful_posts, failed_posts)
+            return (successful_posts, failed_posts, submissions), (successful_comments, failed_comments)
+
+        if scheduler is None:
+            scheduler = RateLimitScheduler(self.get_reddit())
+
+        post_type = self.post_type(params["post_type"])
+        post = params
+        targets, rejected, media_key = {}, [], None
+        if subreddit_list:
+            # Drop or fix posts the subreddit rules would reject, before anything is uploaded
+            targets, rejected, media_key = self._targets(params, subreddit_list, scheduler, journal=journal,
+                                                         run_id=run_id)
+            failed_posts.extend(rejected)
+            if targets:
+                post = post_type.prepare(self, params)
+        executor = self._executor(executor)
+        pipeline = self._pipeline(executor, scheduler, journal, run_id, event_bus, cancel)
+
+        def posted(job, submission):
+            logger.info(f"Successfully posted to r/{job.name}: {_submission_url(submission)}")
+            successful_posts.append(job.name)
+            submissions.append(submission)
+            self._record_post(job.name, targets[job.name]["title"], media_key, submission)
+            if comment_text:
+                pipeline.add(_comment_job(lambda: submission.reply(comment_text), job.name,
+                                          successful_comments, failed_comments))
+
+        def post_failed(job, e):
+            logger.error(f"Failed to post to r/{job.name}: {str(e)}")
+            failed_posts.append(job.name)
+
+        cost = post_type.cost(post)
+        unconfirmed = unconfirmed or {}
+        for subreddit_name, fields in targets.items():
+            job = Job("submit", subreddit_name,
+                      lambda name=subreddit_name, fields=fields: executor.submit(post_type, name, post, fields),
+                      cost=cost, on_success=posted, on_failure=post_failed,
+                      verify=lambda since, name=subreddit_name, fields=fields:
+                          executor.find_submission(name, fields["title"], since))
+            if subreddit_name in unconfirmed:
+                job.unconfirmed = True
+                job.first_attempt = unconfirmed[subreddit_name]
+                job.cost += 1
+            pipeline.add(job)
+        for subreddit_name, submission_id in comment_targets:
+            pipeline.add(_comment_job(lambda sid=submission_id: executor.reply(sid, comment_text), subreddit_name,
+                                      successful_comments, failed_comments))
+        try:
+            with scheduler.intervals(submit=params.get("delay"), comment=params.get("comment_delay")):
+                executor.run(pipeline)
+        finally:
+            self._save_index()
+
+        _log_post_summary(successful_posts, failed_posts)
+        if comment_text and (successful_comments or failed_comments):
+            _log_comment_summary(successful_comments, failed_comments)
+        pipeline.retry_policy.log_counters(logger)
+        tracer.log_summary(logger)
+
+        return (successful_posts, failed_posts, submissions), (successful_comments, failed_comments)
+
+    def run_campaign(self, posts, scheduler=None, max_pending=DEFAULT_MAX_PENDING, executor=None, event_bus=None,
+                     cancel=None):
+        """
+        Run many posts through one shared, rate limit aware pipeline
+
+        Each post becomes one submit job per target subreddit, and each successful post
+        queues its comment. All jobs share the scheduler, so while one post waits for its
+        earliest time or a blocked kind, the budget goes to the jobs of other posts. Posts
+        are read lazily: only while fewer than max_pending jobs are waiting.
+
+        Args:
+            posts (iterable): Post dicts as from campaign.read_manifest (row, post_type, title,
+                              ..., comment_text, subreddits, earliest)
+            scheduler (RateLimitScheduler): Scheduler to share with other calls (default: a new one)
+            max_pending (int): Maximum number of jobs waiting in the pipeline at once
+            executor, event_bus, cancel: As for post_and_comment
+
+        Returns:
+            dict: Counts of successful and failed posts and comments
+        """
+        counts = {"posts": 0, "failed_posts": 0, "comments": 0, "failed_comments": 0}
+
+        if scheduler is None:
+            scheduler = RateLimitScheduler(self.get_reddit())
+        executor = self._executor(executor)
+        pipeline = self._pipeline(executor, scheduler, event_bus=event_bus, cancel=cancel)
+
+        def comment_succeeded(job, comment):
+            logger.info(f"Successfully commented on post in r/{job.name}: {comment.permalink}")
+            counts["comments"] += 1
+
+        def comment_failed(job, e):
+            logger.error(f"Failed to comment on post in r/{job.name}: {str(e)}")
+            counts["failed_comments"] += 1
+
+        def post_failed(job, e):
+            logger.error(f"Failed to post to r/{job.name}: {str(e)}")
+            counts["failed_posts"] += 1
+
+        def posted_callback(comment_text, targets, media_key):
+            def posted(job, submission):
+                logger.info(f"Successfully posted to r/{job.name}: {_submission_url(submission)}")
+                counts["posts"] += 1
+                self._record_post(job.name, targets[job.name]["title"], media_key, submission)
+                if comment_text:
+                    pipeline.add(Job("comment", job.name, lambda: submission.reply(comment_text),
+                                     on_success=comment_succeeded, on_failure=comment_failed))
+            return posted
+
+        def jobs():
+            for post in posts:
+                error = self.validate(post)
+                if error is None and not post["subreddits"]:
+                    error = "No target subreddits"
+                if error:
+                    logger.error(f"Skipping manifest row {post['row']}: {error}")
+                    counts["failed_posts"] += len(post["subreddits"])
+                    continue
+
+                targets, rejected, media_key = self._targets(post, post["subreddits"], scheduler, row=post["row"])
+                counts["failed_posts"] += len(rejected)
+                if not targets:
+                    continue
+
+                post_type = self.post_type(post["post_type"])
+                prepared = post_type.prepare(self, post)
+                posted = posted_callback(post["comment_text"], targets, media_key)
+                cost = post_type.cost(prepared)
+                for subreddit_name, fields in targets.items():
+                    yield Job("submit", subreddit_name,
+                              lambda name=subreddit_name, post_type=post_type, prepared=prepared, fields=fields:
+                                  executor.submit(post_type, name, prepared, fields),
+                              cost=cost, on_success=posted, on_failure=post_failed, not_before=post["earliest"],
+                              verify=lambda since, name=subreddit_name, fields=fields:
+                                  executor.find_submission(name, fields["title"], since))
+
+        pipeline.feed(jobs(), max_pending=max_pending)
+        try:
+            executor.run(pipeline)
+        finally:
+            self._save_index()
+
+        logger.info(f"\nCampaign complete!")
+        logger.info(f"Successful posts: {counts['posts']}, failed posts: {counts['failed_posts']}")
+        logger.info(f"Successful comments: {counts['comments']}, failed comments: {counts['failed_comments']}")
+        pipeline.retry_policy.log_counters(logger)
+        tracer.log_summary(logger)
+        return counts
+
+    def post_to_subreddits(self, title, content, subreddit_list, post_type="text", url=None, image_path=None,
+                           image_paths=None, video_path=None, delay=None, scheduler=None, executor=None):
+        """
+        Post to multiple subreddits without comments, see post_and_comment
+
+        Returns:
+            tuple: (successful_posts, failed_posts, submissions) where submissions is a list of submission objects
+        """
+        post_results, _ = self.post_and_comment(title, content, subreddit_list, post_type=post_type, url=url,
+                                                image_path=image_path, image_paths=image_paths, video_path=video_path,
+                                                delay=delay, scheduler=scheduler, executor=executor)
+        return post_results
+
+    def comment_on_posts(self, submissions, comment_text, delay=None, scheduler=None, executor=None, event_bus=None,
+                         cancel=None):
+        """
+        Comment on a list of submissions
+
+        Args:
+            submissions (list): List of submission objects to comment on
+            comment_text (str): The comment text to post
+            delay (int): Optional minimum delay in seconds between comments (default: None, rate limit only)
+            scheduler, executor, event_bus, cancel: As for post_and_comment
+
+        Returns:
+            tuple: (successful_comments, failed_comments)
+        """
+        successful_comments = []
+        failed_comments = []
+
+        if scheduler is None:
+            scheduler = RateLimitScheduler(self.get_reddit())
+        logger.info(f"\nStarting to comment on {len(submissions)} posts...")
+
+        executor = self._executor(executor)
+        pipeline = self._pipeline(executor, scheduler, event_bus=event_bus, cancel=cancel)
+        for submission in submissions:
+            pipeline.add(_comment_job(lambda sid=submission.id: executor.reply(sid, comment_text),
+                                      submission.subreddit.display_name, successful_comments, failed_comments))
+        with scheduler.intervals(comment=delay):
+            executor.run(pipeline)
+
+        _log_comment_summary(successful_comments, failed_comments)
+        pipeline.retry_policy.log_counters(logger)
+        tracer.log_summary(logger)
+
+        return successful_comments, failed_comments
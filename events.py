@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Job events published by the pipeline
+QUEUED = "queued"
+WAITING = "waiting"
+RUNNING = "running"
+RETRYING = "retrying"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Published for every finished tracing span, when the bus is a tracer exporter
+SPAN = "span"
+
+class EventBus:
+    """
+    Passes events from the worker threads to whoever subscribed
+
+    Events are dicts with an 'event' type and a 'time'; job events also carry the job's
+    'seq', 'kind' and 'name'. Subscribers are called in the publishing thread, so they
+    should only hand the event on, e.g. put it on a queue. The bus can also be added to
+    the tracer as an exporter, which publishes every finished span.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """Call callback(event) for every event published from now on"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def publish(self, event, **fields):
+        fields['event'] = event
+        fields.setdefault('time', time.time())
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(fields)
+            except Exception as e:
+                logger.warning(f"Event subscriber failed on {event}: {e}")
+
+    def publish_job(self, event, job, **fields):
+        """Publish an event about a pipeline job"""
+        self.publish(event, seq=job.seq, kind=job.kind, name=job.name, attempts=job.attempts, **fields)
+
+    # Tracer exporter interface
+    def export(self, span):
+        self.publish(SPAN, span=span.id, parent=span.parent, kind=span.kind, name=span.name,
+                     bytes_sent=span.bytes_sent, retries=span.retries, duration=span.duration)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
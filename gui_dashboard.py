@@ -0,0 +1,195 @@
+import queue
+import time
+import tkinter as tk
+from tkinter import ttk
+
+import events
+
+# Milliseconds between two redraws; events arriving in between are coalesced
+FRAME_INTERVAL = 100
+
+# Job table columns: (id, heading, width)
+COLUMNS = (
+    ("job", "Job", 70),
+    ("subreddit", "Subreddit", 150),
+    ("state", "State", 90),
+    ("elapsed", "Elapsed", 70),
+    ("bytes", "Uploaded", 80),
+    ("retries", "Retries", 60),
+    ("wait", "Next slot", 70),
+)
+
+# Job states that are final
+DONE_STATES = (events.SUCCEEDED, events.FAILED)
+
+def format_seconds(seconds):
+    """Format a duration as "42s" or "3m05s" """
+    seconds = max(0, int(round(seconds)))
+    if seconds < 60:
+        return f"{seconds}s"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+class JobDashboard:
+    """
+    Job table showing the state of every pipeline job while a run is active
+
+    Subscribe handle() to the run's EventBus. Events only go on a queue there; the
+    table is redrawn from it on a Tk timer at a fixed frame rate, updating just the
+    rows that got events and the running or waiting rows whose clock moved, so a frame
+    costs nothing for the jobs that sit queued or are done. The progress bar and the
+    summary label show how many jobs are done and the ETA of the run.
+    """
+
+    def __init__(self, parent, progress, summary_label, interval=FRAME_INTERVAL):
+        self.progress = progress
+        self.summary_label = summary_label
+        self.interval = interval
+        self.queue = queue.SimpleQueue()
+        self.jobs = {}  # job seq -> row dict
+        self.span_jobs = {}  # span id -> job seq
+        self.run_started = None
+        self.done = 0
+        self.failed = 0
+        self._dirty = set()
+        self._ticking = set()  # seqs of running and waiting jobs, whose elapsed time or countdown moves
+        self._shown = {}  # seq -> values the row shows
+
+        frame = ttk.Frame(parent)
+        frame.columnconfigure(0, weight=1)
+        frame.rowconfigure(0, weight=1)
+        self.tree = ttk.Treeview(frame, columns=[column for column, _, _ in COLUMNS], show="headings", height=8)
+        for column, heading, width in COLUMNS:
+            self.tree.heading(column, text=heading)
+            self.tree.column(column, width=width, stretch=column == "subreddit")
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        self.frame = frame
+
+    def handle(self, event):
+        """EventBus subscriber; safe to call from any thread"""
+        self.queue.put(event)
+
+    def start(self):
+        """Start redrawing on the Tk timer"""
+        self.tree.after(self.interval, self.redraw)
+
+    def reset(self):
+        """Clear the table for a new run"""
+        self.jobs.clear()
+        self.span_jobs.clear()
+        self.done = self.failed = 0
+        self._dirty.clear()
+        self._ticking.clear()
+        self._shown.clear()
+        self.tree.delete(*self.tree.get_children())
+        self.run_started = time.time()
+        self.progress.config(value=0, maximum=1)
+        self.summary_label.config(text="")
+
+    def _apply(self, event):
+        """Update the rows from one event"""
+        if event['event'] == events.SPAN:
+            # Requests made inside a job, e.g. its image upload, count towards the job
+            seq = self.span_jobs.get(event['span'], self.span_jobs.get(event['parent']))
+            if seq is None:
+                return
+            self.span_jobs[event['span']] = seq
+            job = self.jobs[seq]
+            job['bytes'] += event['bytes_sent']
+            job['http_retries'] += event['retries']
+            self._dirty.add(seq)
+            return
+
+        seq = event['seq']
+        job = self.jobs.get(seq)
+        if job is None:
+            job = self.jobs[seq] = {
+                'kind': event['kind'], 'name': event['name'], 'state': events.QUEUED, 'started': None,
+                'finished': None, 'bytes': 0, 'http_retries': 0, 'attempts': 0, 'wait_until': None,
+            }
+        job['attempts'] = event['attempts']
+        kind = event['event']
+        if kind == events.QUEUED:
+            if job['state'] not in DONE_STATES:
+                job['state'] = events.QUEUED
+                self._ticking.discard(seq)
+        elif kind in (events.WAITING, events.RETRYING):
+            job['state'] = kind
+            job['wait_until'] = event['time'] + event['seconds']
+            self._ticking.add(seq)
+        elif kind == events.RUNNING:
+            job['state'] = events.RUNNING
+            job['wait_until'] = None
+            if job['started'] is None:
+                job['started'] = event['time']
+            if event.get('span') is not None:
+                self.span_jobs[event['span']] = seq
+            self._ticking.add(seq)
+        elif kind in DONE_STATES:
+            if job['state'] not in DONE_STATES:
+                self.done += 1
+                self.failed += kind == events.FAILED
+            job['state'] = kind
+            job['finished'] = event['time']
+            job['wait_until'] = None
+            self._ticking.discard(seq)
+        self._dirty.add(seq)
+
+    def _values(self, job, now):
+        if job['started'] is None:
+            elapsed = ""
+        else:
+            elapsed = format_seconds((job['finished'] or now) - job['started'])
+        wait = format_seconds(job['wait_until'] - now) if job['wait_until'] else ""
+        retries = max(0, job['attempts'] - 1) + job['http_retries']
+        return (job['kind'], f"r/{job['name']}", job['state'], elapsed,
+                format_bytes(job['bytes']) if job['bytes'] else "", retries or "", wait)
+
+    def redraw(self):
+        try:
+            while True:
+                self._apply(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        now = time.time()
+        # Rows only change on events, except the elapsed time and countdown of running and waiting ones
+        for seq in self._dirty | self._ticking:
+            values = self._values(self.jobs[seq], now)
+            if seq not in self._shown:
+                self.tree.insert("", tk.END, iid=seq, values=values)
+            elif values != self._shown[seq]:
+                self.tree.item(seq, values=values)
+            self._shown[seq] = values
+        if self._dirty or self._ticking:
+            self._update_summary(now)
+        self._dirty.clear()
+        self.tree.after(self.interval, self.redraw)
+
+    def _update_summary(self, now):
+        total = len(self.jobs)
+        done = self.done
+        self.progress.config(maximum=total, value=done)
+
+        parts = [f"{done}/{total} jobs done"]
+        if self.failed:
+            parts.append(f"{self.failed} failed")
+        # Only waiting jobs have a wait_until, and they are all ticking
+        waits = [self.jobs[seq]['wait_until'] for seq in self._ticking
+                 if self.jobs[seq]['wait_until'] and self.jobs[seq]['wait_until'] > now]
+        if waits:
+            parts.append(f"next slot in {format_seconds(min(waits) - now)}")
+        if 0 < done < total and self.run_started is not None:
+            # Jobs so far took this long on average, waits included
+            eta = (now - self.run_started) / done * (total - done)
+            parts.append(f"ETA {format_seconds(eta)}")
+        self.summary_label.config(text=" · ".join(parts))
@@ -0,0 +1,141 @@
+import logging
+import logging.handlers
+import queue
+import re
+import tkinter as tk
+from collections import deque
+
+from storage import state_path
+
+# Milliseconds between two drains of the log queue
+POLL_INTERVAL = 100
+
+# Records moved from the queue to the view per drain; the rest wait for the next one
+MAX_BATCH = 500
+
+# Lines kept in the log view and in the history it is filtered from
+MAX_LINES = 2000
+HISTORY_SIZE = 10000
+
+# Size and number of the rotated log files holding the full log
+LOG_FILE_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUPS = 3
+
+# Log messages name the subreddit they are about as "r/name"
+SUBREDDIT_PATTERN = re.compile(r'\br/([A-Za-z0-9_]+)')
+
+# Levels the view can be filtered by
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+class QueueLogHandler(logging.Handler):
+    """
+    Log handler that only puts records on a queue
+
+    emit() never touches Tk, so worker threads log without waiting for the GUI.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__()
+        self.queue = log_queue
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait((record.levelno, self.format(record)))
+        except Exception:
+            self.handleError(record)
+
+def rotating_file_handler(path=None):
+    """Return a handler that writes the full log to a rotating file in the state directory"""
+    handler = logging.handlers.RotatingFileHandler(path or state_path('gui.log'), maxBytes=LOG_FILE_BYTES,
+                                                   backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    return handler
+
+class LogView:
+    """
+    Shows queued log records in a Text widget, in batches, with bounded history
+
+    The queue is drained on a Tk timer, and each drain inserts its lines in one go.
+    The widget keeps at most `max_lines` lines, and the view only follows new lines
+    while it is scrolled to the bottom. The last `history_size` lines are kept, so the
+    view can be filtered by level and subreddit after the fact.
+    """
+
+    def __init__(self, text_widget, log_queue, max_lines=MAX_LINES, history_size=HISTORY_SIZE,
+                 interval=POLL_INTERVAL, max_batch=MAX_BATCH):
+        self.text = text_widget
+        self.queue = log_queue
+        self.max_lines = max_lines
+        self.interval = interval
+        self.max_batch = max_batch
+        self.history = deque(maxlen=history_size)  # (levelno, subreddits, line)
+        self.min_level = logging.INFO
+        self.subreddit = ""
+        self._lines = 0
+        # The root logger drops records below its level before any handler sees them
+        self._root_level = logging.getLogger().level
+
+    def start(self):
+        """Start draining the queue on the Tk timer"""
+        self.text.after(self.interval, self.poll)
+
+    def poll(self):
+        batch = []
+        try:
+            while len(batch) < self.max_batch:
+                batch.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        if batch:
+            entries = []
+            for levelno, line in batch:
+                entry = (levelno, {name.lower() for name in SUBREDDIT_PATTERN.findall(line)}, line)
+                self.history.append(entry)
+                entries.append(entry)
+            self._show([line for levelno, subreddits, line in entries if self._matches(levelno, subreddits)])
+        # Drain again right away while records are piling up
+        self.text.after(1 if len(batch) == self.max_batch else self.interval, self.poll)
+
+    def _matches(self, levelno, subreddits):
+        return levelno >= self.min_level and (not self.subreddit or self.subreddit in subreddits)
+
+    def _show(self, lines):
+        if not lines:
+            return
+        follow = self.text.yview()[1] >= 1.0
+        self.text.insert(tk.END, '\n'.join(lines) + '\n')
+        self._lines += sum(line.count('\n') + 1 for line in lines)
+        excess = self._lines - self.max_lines
+        if excess > 0:
+            self.text.delete('1.0', f'{excess + 1}.0')
+            self._lines -= excess
+        if follow:
+            self.text.see(tk.END)
+
+    def set_filter(self, level=None, subreddit=None):
+        """
+        Show only lines at or above a level and, optionally, about one subreddit
+
+        Lines below the root logger's level were never logged, so picking DEBUG lowers the
+        root logger to DEBUG until another level is picked; earlier debug lines stay missing.
+
+        Args:
+            level (str): Level name, e.g. "WARNING"
+            subreddit (str): Subreddit name with or without "r/", or "" for all
+        """
+        if level is not None:
+            self.min_level = logging.getLevelName(level)
+            # Lower the root logger while DEBUG is shown, so debug records are created at all
+            logging.getLogger().setLevel(min(self.min_level, self._root_level))
+        if subreddit is not None:
+            self.subreddit = subreddit.strip().lower().removeprefix("r/")
+        self.text.delete('1.0', tk.END)
+        self._lines = 0
+        lines = [line for levelno, subreddits, line in self.history if self._matches(levelno, subreddits)]
+        self._show(lines[-self.max_lines:])
+
+    def clear(self):
+        """Clear the view and its history"""
+        self.history.clear()
+        self.text.delete('1.0', tk.END)
+        self._lines = 0
@@ -1,56 +1,142 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
-import praw
-import time
 import logging
-import random
 import os
+import queue
+import time
 from dotenv import load_dotenv
-from PIL import Image, ImageTk
+from media_cache import MIME_TYPES, MediaCache
+from image_prep import ImagePreparer, preview_image
+from subreddit_rules import SubredditRulesCache
+import metrics
+from scheduler import RateLimitScheduler
+from client import create_reddit
+from journal import Journal
+from post_index import PostIndex
+from engine import PostingEngine
+from gui_log import LEVELS, LogView, QueueLogHandler, rotating_file_handler
+from gui_dashboard import JobDashboard
+from events import EventBus
 
 # Load environment variables from .env file
 load_dotenv()
 
+def is_video(path):
+    """Return True if a picked file is posted as a video"""
+    return MIME_TYPES.get(path.lower().rpartition(".")[2], "").startswith("video/")
+
 class RedditPosterGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Reddit Post Automater")
-        self.root.geometry("800x700")
+        self.root.geometry("800x900")
         self.root.resizable(True, True)
         
-        # Initialize Reddit client
+        # Timing spans for every API job, enabled with RED_POST_METRICS (see metrics.configure)
+        self.tracer = metrics.configure()
+        
+        # Pipelines publish job state changes here, and the tracer its spans, for the job table
+        self.event_bus = EventBus()
+        self.tracer.add_exporter(self.event_bus)
+        
+        # The Reddit client is created and checked in the background once the window is up
         self.reddit = None
-        self.init_reddit_client()
+        self.connected = False
+        self.auth_pending = True
+        self.auth_status = "⏳ Connecting to Reddit..."
+        
+        # With RED_POST_DAEMON_URL set, runs go to the posting daemon (see daemon.py) instead
+        self.daemon = None
+        if os.getenv('RED_POST_DAEMON_URL'):
+            # Imported here so that the HTTP client does not slow down startup without a daemon
+            from daemon import DaemonClient
+            self.daemon = DaemonClient(os.getenv('RED_POST_DAEMON_URL'), token=os.getenv('RED_POST_DAEMON_TOKEN'))
+        
+        # Uploaded images are reused across subreddits and runs
+        self.media_cache = MediaCache()
+        
+        # Images are downscaled, re-encoded and stripped of EXIF once before they are uploaded
+        self.image_preparer = ImagePreparer()
+        
+        # Posting rules of each subreddit, checked before any upload
+        self.subreddit_rules = SubredditRulesCache()
+        
+        # Every run is journaled so it can be resumed if the app dies halfway
+        self.journal = Journal()
+        
+        # Runs go through the same engine as the CLI, publishing their jobs on the event bus
+        self.engine = PostingEngine(lambda: self.reddit, self.media_cache, self.subreddit_rules, self.image_preparer,
+                                    PostIndex(), self.journal, event_bus=self.event_bus)
         
         # Variables
         self.image_path = tk.StringVar()
+        # Every picked file: one image, the images of a gallery or one video
+        self.media_paths = []
         self.post_title = tk.StringVar()
         self.comment_text = tk.StringVar(value="yo this is the sauce")
+        self.use_async = tk.BooleanVar(value=os.getenv('RED_POST_BACKEND') == 'async')
         self.subreddits_text = tk.StringVar(value="test")
+        self.log_level = tk.StringVar(value="INFO")
+        self.log_subreddit = tk.StringVar()
         
         # Create GUI elements
         self.create_widgets()
         
         # Configure logging to show in GUI
         self.setup_logging()
+        
+        self.event_bus.subscribe(self.dashboard.handle)
+        self.dashboard.start()
+        
+        thread = threading.Thread(target=self.init_reddit_client)
+        thread.daemon = True
+        thread.start()
     
     def init_reddit_client(self):
-        """Initialize Reddit client with credentials from .env"""
+        """Initialize Reddit client with credentials from .env (runs in a background thread)"""
+        if self.daemon:
+            self.connect_daemon()
+            return
         try:
-            self.reddit = praw.Reddit(
-                client_id=os.getenv('REDDIT_CLIENT_ID'),
-                client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
-                password=os.getenv('REDDIT_PASSWORD'),
-                user_agent=os.getenv('REDDIT_USER_AGENT'),
-                username=os.getenv('REDDIT_USERNAME'),
-            )
+            reddit = create_reddit()
             # Test authentication
-            user = self.reddit.user.me()
-            self.auth_status = f"✅ Authenticated as: {user}"
+            user = reddit.user.me()
+            status = f"✅ Authenticated as: {user}"
         except Exception as e:
-            self.auth_status = f"❌ Authentication failed: {str(e)}"
-            self.reddit = None
+            reddit = None
+            status = f"❌ Authentication failed: {str(e)}"
+        self.root.after(0, self.set_auth_status, reddit, status, reddit is not None)
+    
+    def connect_daemon(self):
+        """Check that the posting daemon is up and authenticated (runs in a background thread)"""
+        try:
+            health = self.daemon.health()
+            if health['auth_error']:
+                status, connected = f"❌ Daemon authentication failed: {health['auth_error']}", False
+            else:
+                status, connected = f"✅ Using daemon at {self.daemon.url} as: {health['user'] or '...'}", True
+        except Exception as e:
+            status, connected = f"❌ Daemon at {self.daemon.url} unreachable: {str(e)}", False
+        self.root.after(0, self.set_auth_status, None, status, connected)
+    
+    def set_auth_status(self, reddit, status, connected):
+        """Show the result of the background authentication check"""
+        self.reddit = reddit
+        self.connected = connected
+        self.auth_pending = False
+        self.auth_status = status
+        self.auth_label.config(text=status)
+    
+    def check_authenticated(self):
+        """Tell the user why posting can't start yet, if it can't"""
+        if self.auth_pending:
+            messagebox.showinfo("Please wait", "Still connecting to Reddit, try again in a moment")
+            return False
+        if not self.connected:
+            messagebox.showerror("Error", "Reddit authentication failed. Check your .env file")
+            return False
+        return True
     
     def create_widgets(self):
         """Create all GUI widgets"""
@@ -69,9 +155,9 @@ class RedditPosterGUI:
         title_label.grid(row=0, column=0, columnspan=2, pady=(0, 20))
         
         # Authentication status
-        auth_label = ttk.Label(main_frame, text=self.auth_status, 
-                              font=("Arial", 10))
-        auth_label.grid(row=1, column=0, columnspan=2, pady=(0, 20))
+        self.auth_label = ttk.Label(main_frame, text=self.auth_status, 
+                                    font=("Arial", 10))
+        self.auth_label.grid(row=1, column=0, columnspan=2, pady=(0, 20))
         
         # Post Title
         ttk.Label(main_frame, text="Post Title:", font=("Arial", 10, "bold")).grid(
@@ -80,7 +166,7 @@ class RedditPosterGUI:
         title_entry.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 15))
         
         # Image Selection
-        ttk.Label(main_frame, text="Select Image:", font=("Arial", 10, "bold")).grid(
+        ttk.Label(main_frame, text="Select Image(s) or Video:", font=("Arial", 10, "bold")).grid(
             row=4, column=0, sticky=tk.W, pady=(0, 5))
         
         image_frame = ttk.Frame(main_frame)
@@ -90,7 +176,7 @@ class RedditPosterGUI:
         self.image_label = ttk.Label(image_frame, text="No image selected")
         self.image_label.grid(row=0, column=0, sticky=(tk.W, tk.E))
         
-        ttk.Button(image_frame, text="Browse Image", 
+        ttk.Button(image_frame, text="Browse Media", 
                   command=self.browse_image).grid(row=0, column=1, padx=(10, 0))
         
         # Image preview
@@ -109,101 +195,147 @@ class RedditPosterGUI:
         comment_entry = ttk.Entry(main_frame, textvariable=self.comment_text, width=50)
         comment_entry.grid(row=10, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 15))
         
-        # Post Button
-        self.post_button = ttk.Button(main_frame, text="🚀 Post to Reddit", 
+        # Post and Resume Buttons
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=11, column=0, columnspan=2, pady=(0, 20))
+        
+        self.post_button = ttk.Button(button_frame, text="🚀 Post to Reddit", 
                                      command=self.start_posting, style="Accent.TButton")
-        self.post_button.grid(row=11, column=0, columnspan=2, pady=(0, 20))
+        self.post_button.grid(row=0, column=0)
+        
+        self.resume_button = ttk.Button(button_frame, text="⏯ Resume Last Run", 
+                                       command=self.start_resume)
+        self.resume_button.grid(row=0, column=1, padx=(10, 0))
+        
+        # Estimates requests, uploads and duration of the run without sending anything
+        self.plan_button = ttk.Button(button_frame, text="📋 Plan Run", 
+                                     command=self.start_planning)
+        self.plan_button.grid(row=0, column=2, padx=(10, 0))
+        
+        # Async backend overlaps uploads, posts and comments
+        ttk.Checkbutton(button_frame, text="⚡ Async backend", 
+                        variable=self.use_async).grid(row=0, column=3, padx=(10, 0))
         
         # Progress Bar
-        self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
-        self.progress.grid(row=12, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 15))
+        self.progress = ttk.Progressbar(main_frame, mode='determinate')
+        self.progress.grid(row=12, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 5))
+        self.progress_label = ttk.Label(main_frame, text="")
+        self.progress_label.grid(row=13, column=0, columnspan=2, sticky=tk.W, pady=(0, 10))
+        
+        # Job table
+        ttk.Label(main_frame, text="Jobs:", font=("Arial", 10, "bold")).grid(
+            row=14, column=0, sticky=tk.W, pady=(0, 5))
+        self.dashboard = JobDashboard(main_frame, self.progress, self.progress_label)
+        self.dashboard.frame.grid(row=15, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 15))
+        main_frame.rowconfigure(15, weight=1)
         
         # Log Display
         ttk.Label(main_frame, text="Activity Log:", font=("Arial", 10, "bold")).grid(
-            row=13, column=0, sticky=tk.W, pady=(0, 5))
+            row=16, column=0, sticky=tk.W, pady=(0, 5))
+        
+        # Log filters
+        filter_frame = ttk.Frame(main_frame)
+        filter_frame.grid(row=16, column=1, sticky=tk.E, pady=(0, 5))
+        ttk.Label(filter_frame, text="Level:").grid(row=0, column=0)
+        level_box = ttk.Combobox(filter_frame, textvariable=self.log_level, values=LEVELS,
+                                 state="readonly", width=9)
+        level_box.grid(row=0, column=1, padx=(5, 10))
+        level_box.bind("<<ComboboxSelected>>", lambda event: self.log_view.set_filter(level=self.log_level.get()))
+        ttk.Label(filter_frame, text="Subreddit:").grid(row=0, column=2)
+        subreddit_entry = ttk.Entry(filter_frame, textvariable=self.log_subreddit, width=15)
+        subreddit_entry.grid(row=0, column=3, padx=(5, 0))
+        subreddit_entry.bind("<Return>", lambda event: self.log_view.set_filter(subreddit=self.log_subreddit.get()))
         
         self.log_text = scrolledtext.ScrolledText(main_frame, height=15, width=70)
-        self.log_text.grid(row=14, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        self.log_text.grid(row=17, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
         
         # Configure row weight for log text to expand
-        main_frame.rowconfigure(14, weight=1)
+        main_frame.rowconfigure(17, weight=1)
         
         # Clear Log Button
         ttk.Button(main_frame, text="Clear Log", 
-                  command=self.clear_log).grid(row=15, column=0, columnspan=2)
+                  command=self.clear_log).grid(row=18, column=0, columnspan=2)
     
     def setup_logging(self):
         """Setup logging to display in GUI"""
-        class GUILogHandler(logging.Handler):
-            def __init__(self, text_widget):
-                super().__init__()
-                self.text_widget = text_widget
-            
-            def emit(self, record):
-                msg = self.format(record)
-                def append():
-                    self.text_widget.insert(tk.END, msg + '\n')
-                    self.text_widget.see(tk.END)
-                # Schedule the GUI update in the main thread
-                self.text_widget.after(0, append)
-        
         # Configure logging
         logging.basicConfig(level=logging.INFO, 
                            format='%(asctime)s - %(levelname)s - %(message)s')
         
-        # Add GUI handler
-        gui_handler = GUILogHandler(self.log_text)
+        # The full log of every module goes to a rotating file in the state directory
+        logging.getLogger().addHandler(rotating_file_handler())
+        
+        # Worker threads only queue their records; the log view drains the queue in batches
+        log_queue = queue.SimpleQueue()
+        gui_handler = QueueLogHandler(log_queue)
         gui_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        self.log_view = LogView(self.log_text, log_queue)
+        self.log_view.start()
         
+        # On the root logger, so the engine's messages about each post show up too
+        logging.getLogger().addHandler(gui_handler)
         self.logger = logging.getLogger(__name__)
-        self.logger.addHandler(gui_handler)
         self.logger.setLevel(logging.INFO)
     
     def browse_image(self):
-        """Open file dialog to select image"""
+        """Open file dialog to select an image, several images for a gallery, or a video"""
         filetypes = (
+            ('Media files', '*.jpg *.jpeg *.png *.gif *.webp *.mp4 *.mov'),
             ('Image files', '*.jpg *.jpeg *.png *.gif *.webp'),
-            ('JPEG files', '*.jpg *.jpeg'),
-            ('PNG files', '*.png'),
-            ('GIF files', '*.gif'),
+            ('Video files', '*.mp4 *.mov'),
             ('All files', '*.*')
         )
         
-        filename = filedialog.askopenfilename(
-            title='Select an image',
+        filenames = filedialog.askopenfilenames(
+            title='Select an image, several images for a gallery, or a video',
             initialdir=os.path.expanduser('~'),
             filetypes=filetypes
         )
         
-        if filename:
-            self.image_path.set(filename)
-            self.image_label.config(text=os.path.basename(filename))
-            self.show_image_preview(filename)
+        if filenames:
+            self.media_paths = list(filenames)
+            self.image_path.set(filenames[0])
+            if len(filenames) == 1:
+                self.image_label.config(text=os.path.basename(filenames[0]))
+            else:
+                self.image_label.config(text=f"Gallery of {len(filenames)}: "
+                                             f"{', '.join(os.path.basename(name) for name in filenames)}")
+            if is_video(filenames[0]):
+                self.image_preview.config(image='', text=f"🎬 {os.path.basename(filenames[0])}")
+            else:
+                self.show_image_preview(filenames[0])
+    
+    def media_post(self, absolute=False):
+        """Return the post type and media arguments for the picked files, with absolute paths if asked"""
+        paths = [os.path.abspath(path) if absolute else path for path in self.media_paths or [self.image_path.get()]]
+        if len(paths) > 1:
+            return {"post_type": "gallery", "image_paths": paths}
+        if is_video(paths[0]):
+            return {"post_type": "video", "video_path": paths[0]}
+        return {"post_type": "image", "image_path": paths[0]}
     
     def show_image_preview(self, image_path):
         """Show a preview of the selected image"""
         try:
-            # Open and resize image for preview
-            with Image.open(image_path) as img:
-                # Calculate size to fit in preview area (max 200x200)
-                img.thumbnail((200, 200), Image.Resampling.LANCZOS)
-                
-                # Convert to PhotoImage
-                photo = ImageTk.PhotoImage(img)
-                
-                # Update preview label
-                self.image_preview.config(image=photo)
-                self.image_preview.image = photo  # Keep a reference
-                
+            # Imported here so that PIL does not slow down startup
+            from PIL import ImageTk
+            
+            # Decode only as much of the image as fits in the preview area (max 200x200)
+            photo = ImageTk.PhotoImage(preview_image(image_path, (200, 200)))
+            
+            # Update preview label
+            self.image_preview.config(image=photo)
+            self.image_preview.image = photo  # Keep a reference
+            
         except Exception as e:
             self.image_preview.config(image='', text=f"Preview error: {str(e)}")
     
     def clear_log(self):
         """Clear the log display"""
-        self.log_text.delete(1.0, tk.END)
+        self.log_view.clear()
     
-    def validate_inputs(self):
-        """Validate user inputs"""
+    def validate_inputs(self, require_auth=True):
+        """Validate user inputs; planning a run needs no connection, so require_auth=False skips that check"""
         if not self.post_title.get().strip():
             messagebox.showerror("Error", "Please enter a post title")
             return False
@@ -212,16 +344,19 @@ class RedditPosterGUI:
             messagebox.showerror("Error", "Please select an image")
             return False
         
-        if not os.path.exists(self.image_path.get()):
-            messagebox.showerror("Error", "Selected image file does not exist")
+        if not all(os.path.exists(path) for path in self.media_paths or [self.image_path.get()]):
+            messagebox.showerror("Error", "Selected file does not exist")
+            return False
+        
+        if len(self.media_paths) > 1 and any(is_video(path) for path in self.media_paths):
+            messagebox.showerror("Error", "Galleries can only hold images; pick one video on its own")
             return False
         
         if not self.subreddits_text.get().strip():
             messagebox.showerror("Error", "Please enter at least one subreddit")
             return False
         
-        if not self.reddit:
-            messagebox.showerror("Error", "Reddit authentication failed. Check your .env file")
+        if require_auth and not self.check_authenticated():
             return False
         
         return True
@@ -231,15 +366,44 @@ class RedditPosterGUI:
         if not self.validate_inputs():
             return
         
-        # Disable the post button and start progress bar
-        self.post_button.config(state='disabled')
-        self.progress.start()
+        # Disable the buttons and start progress bar
+        self.set_running(True)
         
         # Start posting in separate thread to avoid freezing GUI
         thread = threading.Thread(target=self.post_to_reddit)
         thread.daemon = True
         thread.start()
     
+    def start_resume(self):
+        """Resume the last unfinished run in a separate thread"""
+        if not self.check_authenticated():
+            return
+        
+        self.set_running(True)
+        
+        thread = threading.Thread(target=self.resume_from_journal)
+        thread.daemon = True
+        thread.start()
+    
+    def start_planning(self):
+        """Plan the run in a separate thread; hashing large media files can take a moment"""
+        if not self.validate_inputs(require_auth=False):
+            return
+        
+        self.plan_button.config(state='disabled')
+        thread = threading.Thread(target=self.plan_run)
+        thread.daemon = True
+        thread.start()
+    
+    def set_running(self, running):
+        """Disable the buttons while a run is active and start the job table afresh"""
+        state = 'disabled' if running else 'normal'
+        self.post_button.config(state=state)
+        self.resume_button.config(state=state)
+        self.plan_button.config(state=state)
+        if running:
+            self.dashboard.reset()
+    
     def post_to_reddit(self):
         """Post to Reddit (runs in separate thread)"""
         try:
@@ -248,18 +412,36 @@ class RedditPosterGUI:
             
             self.logger.info(f"Starting to post to {len(subreddit_list)} subreddits...")
             
-            # Post to subreddits
-            successful, failed, submissions = self.post_to_subreddits(
+            if self.daemon:
+                comment_text = self.comment_text.get().strip() or None
+                result = self.run_on_daemon({
+                    "type": "post",
+                    "title": self.post_title.get(),
+                    "subreddits": subreddit_list,
+                    "comment_text": comment_text,
+                    **self.media_post(absolute=True),
+                })
+                success_count = len(result['successful_posts'])
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "Posting Complete", 
+                    f"Posted to {success_count}/{len(subreddit_list)} subreddits successfully!"
+                ))
+                return
+            
+            # One scheduler per run so posts and comments share the rate limit budget
+            self.scheduler = RateLimitScheduler(self.reddit)
+            
+            # Post to subreddits, commenting on each post as soon as it is created
+            (successful, failed, submissions), _ = self.engine.post_and_comment(
                 title=self.post_title.get(),
+                content="",
                 subreddit_list=subreddit_list,
-                image_path=self.image_path.get()
+                comment_text=self.comment_text.get().strip() or None,
+                scheduler=self.scheduler,
+                executor=self.executor(),
+                **self.media_post()
             )
             
-            # Comment on successful posts
-            if submissions and self.comment_text.get().strip():
-                self.logger.info(f"Starting to comment on {len(submissions)} successful posts...")
-                self.comment_on_posts(submissions, self.comment_text.get())
-            
             # Show completion message
             total_posts = len(subreddit_list)
             success_count = len(successful)
@@ -274,61 +456,97 @@ class RedditPosterGUI:
             self.root.after(0, lambda: messagebox.showerror("Error", f"Posting failed: {str(e)}"))
         
         finally:
-            # Re-enable button and stop progress bar
-            self.root.after(0, lambda: [
-                self.post_button.config(state='normal'),
-                self.progress.stop()
-            ])
+            # Re-enable buttons and stop progress bar
+            self.root.after(0, lambda: self.set_running(False))
+    
+    def plan_run(self):
+        """Estimate the run's requests, uploads and duration from local caches and history (runs in separate thread)"""
+        from planner import RunPlanner, format_plan, single_post
+        
+        try:
+            subreddit_list = [s.strip() for s in self.subreddits_text.get().split(',') if s.strip()]
+            post = single_post(self.post_title.get(), "", subreddit_list,
+                               comment_text=self.comment_text.get().strip() or None, **self.media_post())
+            # The connected client already knows the rate limit budget from its last response
+            plan = RunPlanner(self.engine).plan([post], scheduler=RateLimitScheduler(self.reddit),
+                                                executor=self.executor())
+            text = format_plan(plan)
+            self.logger.info(text)
+            self.root.after(0, lambda: messagebox.showinfo("Run Plan", text))
+        
+        except Exception as e:
+            self.logger.error(f"Error during planning: {str(e)}")
+            self.root.after(0, lambda: messagebox.showerror("Error", f"Planning failed: {str(e)}"))
+        
+        finally:
+            self.root.after(0, lambda: self.plan_button.config(state='normal'))
+    
+    def resume_from_journal(self):
+        """Resume the last unfinished run from the journal (runs in separate thread)"""
+        try:
+            if self.daemon:
+                result = self.run_on_daemon({"type": "resume"})
+                if not result['resumed']:
+                    self.logger.info("Nothing to resume, the last run finished")
+                    return
+                successful, failed = result['successful_posts'], result['failed_posts']
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "Resume Complete", 
+                    f"Posted to {len(successful)}/{len(successful) + len(failed)} remaining subreddits successfully!"
+                ))
+                return
+            
+            self.scheduler = RateLimitScheduler(self.reddit)
+            result = self.engine.resume_run(scheduler=self.scheduler, executor=self.executor())
+            if result is None:
+                return
+            (successful, failed, submissions), _ = result
+            
+            self.root.after(0, lambda: messagebox.showinfo(
+                "Resume Complete", 
+                f"Posted to {len(successful)}/{len(successful) + len(failed)} remaining subreddits successfully!"
+            ))
+            
+        except Exception as e:
+            self.logger.error(f"Error during resume: {str(e)}")
+            self.root.after(0, lambda: messagebox.showerror("Error", f"Resume failed: {str(e)}"))
+        
+        finally:
+            self.root.after(0, lambda: self.set_running(False))
     
-    def post_to_subreddits(self, title, subreddit_list, image_path):
-        """Post to multiple subreddits (adapted from original function)"""
-        successful_posts = []
-        failed_posts = []
-        submissions = []
-        
-        for subreddit_name in subreddit_list:
-            try:
-                subreddit = self.reddit.subreddit(subreddit_name)
-                submission = subreddit.submit_image(title=title, image_path=image_path, nsfw=False)
-                
-                self.logger.info(f"✅ Successfully posted to r/{subreddit_name}: {submission.url}")
-                successful_posts.append(subreddit_name)
-                submissions.append(submission)
-                
-                # Add delay between posts
-                if subreddit_name != subreddit_list[-1]:
-                    delay = random.randint(20, 40)
-                    self.logger.info(f"⏳ Waiting {delay} seconds before next post...")
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                self.logger.error(f"❌ Failed to post to r/{subreddit_name}: {str(e)}")
-                failed_posts.append(subreddit_name)
-        
-        return successful_posts, failed_posts, submissions
+    def run_on_daemon(self, job):
+        """
+        Submit a job to the posting daemon and follow it until it finishes
+        
+        The job's events are published on the GUI's event bus, so the job table shows the
+        daemon's run like a local one.
+        
+        Returns:
+            dict: The job result
+        """
+        from daemon import FINAL_STATES, SUCCEEDED
+        
+        status = self.daemon.submit(job)
+        job_id = status['id']
+        self.logger.info(f"Submitted job {job_id} to the daemon")
+        after = 0
+        while True:
+            page = self.daemon.events(job_id, after)
+            for event in page['events']:
+                self.event_bus.publish(**event)
+            after = page['next']
+            if page['state'] in FINAL_STATES:
+                break
+            time.sleep(0.5)
+        status = self.daemon.status(job_id)
+        if status['state'] != SUCCEEDED:
+            raise RuntimeError(f"Daemon job {job_id} {status['state']}" + (f": {status['error']}" if status['error'] else ""))
+        self.logger.info(f"Daemon job {job_id} finished")
+        return status['result']
     
-    def comment_on_posts(self, submissions, comment_text):
-        """Comment on successful posts (adapted from original function)"""
-        successful_comments = []
-        failed_comments = []
-        
-        for submission in submissions:
-            try:
-                comment = submission.reply(comment_text)
-                self.logger.info(f"💬 Successfully commented on r/{submission.subreddit.display_name}")
-                successful_comments.append(submission.subreddit.display_name)
-                
-                # Add delay between comments
-                if submission != submissions[-1]:
-                    delay = random.randint(15, 30)
-                    self.logger.info(f"⏳ Waiting {delay} seconds before next comment...")
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                self.logger.error(f"❌ Failed to comment on r/{submission.subreddit.display_name}: {str(e)}")
-                failed_comments.append(submission.subreddit.display_name)
-        
-        return successful_comments, failed_comments
+    def executor(self):
+        """Return the engine executor picked with the async checkbox"""
+        return "async" if self.use_async.get() else "sync"
 
 def main():
     root = tk.Tk()
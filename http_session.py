@@ -0,0 +1,223 @@
+import binascii
+import io
+import logging
+import os
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.fields import RequestField
+
+logger = logging.getLogger(__name__)
+
+# Host Reddit's upload leases point at; REDDIT_UPLOAD_URL overrides it (e.g. for the mock server)
+UPLOAD_URL = "https://reddit-uploaded-media.s3-accelerate.amazonaws.com"
+
+# Bytes read from disk per chunk of a streamed upload
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+def _env_flag(name, default):
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
+
+def session_settings():
+    """
+    Return the HTTP tuning settings from the environment
+
+    RED_POST_POOL_SIZE: connections kept open per API host (default 10)
+    RED_POST_UPLOAD_POOL_SIZE: connections kept open per upload host (default 4)
+    RED_POST_CONNECT_TIMEOUT / RED_POST_READ_TIMEOUT: seconds (default 5 / 16)
+    RED_POST_KEEPALIVE_IDLE: seconds before TCP keep-alive probes on idle connections (default 60)
+    RED_POST_HTTP_COMPRESSION: set to 0 to ask for uncompressed responses, e.g. to debug
+        traffic (requests and aiohttp ask for gzip by default)
+    RED_POST_PREWARM: open connections to the API and upload hosts up front (default on)
+    """
+    return {
+        'pool_size': int(_env_float('RED_POST_POOL_SIZE', 10)),
+        'upload_pool_size': int(_env_float('RED_POST_UPLOAD_POOL_SIZE', 4)),
+        'connect_timeout': _env_float('RED_POST_CONNECT_TIMEOUT', 5.0),
+        'read_timeout': _env_float('RED_POST_READ_TIMEOUT', 16.0),
+        'keepalive_idle': int(_env_float('RED_POST_KEEPALIVE_IDLE', 60)),
+        'compression': _env_flag('RED_POST_HTTP_COMPRESSION', True),
+        'prewarm': _env_flag('RED_POST_PREWARM', True),
+        'upload_url': os.getenv('REDDIT_UPLOAD_URL') or UPLOAD_URL,
+    }
+
+def keepalive_socket_options(idle):
+    """Return urllib3 socket options that turn on TCP keep-alive probes after `idle` seconds"""
+    options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # Not every platform has the per-socket knobs (macOS only has TCP_KEEPALIVE)
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPALIVE', idle), ('TCP_KEEPINTVL', max(1, idle // 4)),
+                        ('TCP_KEEPCNT', 4)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+class TunedAdapter(HTTPAdapter):
+    """
+    requests adapter with its own connection pool size, socket options and connect timeout
+
+    A plain timeout from the caller (prawcore passes one number) becomes the read timeout,
+    and the adapter's connect timeout is used for setting up the connection.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=None, socket_options=None):
+        self.connect_timeout = connect_timeout
+        self.socket_options = socket_options
+        super().__init__(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if self.connect_timeout is not None and not isinstance(timeout, tuple):
+            timeout = (self.connect_timeout, timeout)
+        return super().send(request, timeout=timeout, **kwargs)
+
+def create_session(settings, api_urls=()):
+    """
+    Build the requests session praw's requestor sends everything through
+
+    The API hosts get a pool of settings['pool_size'] connections, every other host (the
+    media upload target) one of settings['upload_pool_size']. Connections use TCP keep-alive,
+    so idle pooled connections stay usable between jobs.
+
+    Args:
+        settings (dict): From session_settings()
+        api_urls (list): Base URLs of the API hosts (oauth_url and reddit_url)
+
+    Returns:
+        requests.Session
+    """
+    session = requests.Session()
+    socket_options = keepalive_socket_options(settings['keepalive_idle'])
+    session.mount('https://', TunedAdapter(settings['upload_pool_size'], settings['connect_timeout'], socket_options))
+    session.mount('http://', TunedAdapter(settings['upload_pool_size'], settings['connect_timeout'], socket_options))
+    for url in dict.fromkeys(api_urls):
+        # Longest prefix wins, so these take the API hosts away from the default adapters
+        session.mount(url.rstrip('/') + '/', TunedAdapter(settings['pool_size'], settings['connect_timeout'],
+                                                          socket_options))
+    if not settings['compression']:
+        session.headers['Accept-Encoding'] = 'identity'
+    return session
+
+def prewarm(session, urls):
+    """
+    Open one pooled connection to each URL's host in the background
+
+    The TCP (and TLS) setup then overlaps with the rest of startup instead of delaying the
+    first request. Failures only cost the warm connection and are logged at debug level.
+
+    Returns:
+        threading.Thread: The thread opening the connections
+    """
+    def warm():
+        for url in dict.fromkeys(url.rstrip('/') + '/' for url in urls):
+            try:
+                # With the trailing slash, the URL matches the adapter create_session() mounted for its host
+                adapter = session.get_adapter(url)
+                request = requests.Request('HEAD', url).prepare()
+                # verify and cert are part of the pool key; resolve them (e.g. REQUESTS_CA_BUNDLE) as a request would
+                tls = session.merge_environment_settings(url, {}, None, None, None)
+                pool = adapter.get_connection_with_tls_context(request, tls['verify'], cert=tls['cert'])
+                # urllib3 has no public call for this; check out a connection, connect it, return it
+                connection = pool._get_conn()
+                connection.connect()
+                pool._put_conn(connection)
+            except Exception as e:
+                logger.debug(f"Could not pre-warm a connection to {url}: {e}")
+
+    thread = threading.Thread(target=warm, name="red-post-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+class MultipartFile:
+    """
+    multipart/form-data body of form fields plus one file, read from disk as it is sent
+
+    requests loads a `files=` upload into memory whole; this body has a known length (so
+    the request carries a Content-Length, which S3 requires) and only holds one chunk of
+    the file at a time. It has no tell(): requests would take a failing tell() for an
+    unknown length and fall back to chunked encoding.
+    """
+
+    def __init__(self, fields, file_field, path, chunk_size=UPLOAD_CHUNK_SIZE):
+        boundary = binascii.hexlify(os.urandom(16)).decode()
+        head = io.BytesIO()
+        for name, value in fields.items():
+            field = RequestField(name=name, data=value)
+            field.make_multipart()
+            head.write(f"--{boundary}\r\n".encode())
+            head.write(field.render_headers().encode())
+            head.write(value.encode() if isinstance(value, str) else value)
+            head.write(b"\r\n")
+        field = RequestField(name=file_field, data=b"", filename=os.path.basename(path))
+        field.make_multipart()
+        head.write(f"--{boundary}\r\n".encode())
+        head.write(field.render_headers().encode())
+        tail = f"\r\n--{boundary}--\r\n".encode()
+
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.chunk_size = chunk_size
+        self._file = open(path, 'rb')
+        self._parts = [io.BytesIO(head.getvalue()), self._file, io.BytesIO(tail)]
+        self._length = len(head.getvalue()) + os.fstat(self._file.fileno()).st_size + len(tail)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length
+        data = b""
+        while self._parts and len(data) < size:
+            chunk = self._parts[0].read(size - len(data))
+            if chunk:
+                data += chunk
+            else:
+                self._parts.pop(0)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.chunk_size), b"")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def stream_upload(session, upload_url, upload_fields, path, timeout=None):
+    """
+    POST a file and its form fields to an upload lease, streaming the file from disk
+
+    Returns:
+        requests.Response
+    """
+    with MultipartFile(upload_fields, "file", path) as body:
+        return session.post(upload_url, data=body, headers={'Content-Type': body.content_type}, timeout=timeout)
+
+def create_async_session(settings):
+    """
+    Build an aiohttp session tuned like create_session(), for asyncpraw
+
+    Must be called inside the event loop that will use it.
+    """
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit_per_host=settings['pool_size'],
+                                     keepalive_timeout=settings['keepalive_idle'], ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(sock_connect=settings['connect_timeout'], sock_read=settings['read_timeout'])
+    headers = {} if settings['compression'] else {'Accept-Encoding': 'identity'}
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
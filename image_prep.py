@@ -0,0 +1,209 @@
+import hashlib
+import io
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from media_cache import file_digest
+from storage import state_path
+
+logger = logging.getLogger(__name__)
+
+# Reddit accepts images up to 20 MB; larger dimensions than this are only shown downscaled
+DEFAULT_SETTINGS = {
+    "max_dimension": 3840,
+    "max_bytes": 20 * 1024 * 1024,
+    "quality": 85,
+    "formats": ["jpeg", "webp"],
+}
+
+# Lowest JPEG/WebP quality tried before shrinking the image further to meet max_bytes
+MIN_QUALITY = 50
+
+FORMAT_EXTENSIONS = {"jpeg": "jpg", "webp": "webp", "png": "png"}
+
+def settings_key(settings):
+    """Return a short, stable hash of preprocessing settings"""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+def _encode(img, fmt, quality):
+    """Encode an image without metadata and return the bytes"""
+    buffer = io.BytesIO()
+    if fmt == "jpeg":
+        img.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    elif fmt == "webp":
+        img.save(buffer, "WEBP", quality=quality, method=4)
+    else:
+        img.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+def _smallest_encoding(img, formats, quality):
+    """Return (format, bytes) of the smallest encoding of an image among the allowed formats"""
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    candidates = []
+    for fmt in formats:
+        if fmt == "jpeg" and has_alpha:
+            # JPEG would drop the transparency
+            continue
+        if fmt == "jpeg":
+            candidates.append((fmt, _encode(img.convert("RGB"), fmt, quality)))
+        else:
+            candidates.append((fmt, _encode(img.convert("RGBA" if has_alpha else "RGB"), fmt, quality)))
+    if not candidates:
+        # Only lossless PNG keeps the alpha channel without WebP
+        candidates.append(("png", _encode(img.convert("RGBA"), "png", quality)))
+    return min(candidates, key=lambda candidate: len(candidate[1]))
+
+def _encode_within_limits(img, settings):
+    """Encode an image, lowering the quality and then the size until it fits max_bytes"""
+    from PIL import Image
+
+    quality = settings["quality"]
+    while True:
+        fmt, data = _smallest_encoding(img, settings["formats"], quality)
+        if len(data) <= settings["max_bytes"] or min(img.size) <= 64:
+            return fmt, data
+        if fmt != "png" and quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - 10)
+        else:
+            img = img.resize((max(1, img.width * 3 // 4), max(1, img.height * 3 // 4)), Image.Resampling.LANCZOS)
+
+def prepare_image(image_path, output_path, settings):
+    """
+    Downscale, re-encode and strip the metadata of one image
+
+    Runs in a worker process, so it only takes and returns plain values.
+
+    Args:
+        image_path (str): Image picked by the user
+        output_path (str): Path without extension to write the prepared image to
+        settings (dict): Preprocessing settings (see DEFAULT_SETTINGS)
+
+    Returns:
+        str: Path of the image to upload; the original if it is already the smallest clean version
+    """
+    # Pillow is imported where it is used, so importing this module at startup stays cheap
+    from PIL import Image, ImageOps
+
+    original_size = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        if getattr(img, "is_animated", False):
+            # Re-encoding would drop the animation
+            return image_path
+        max_dimension = settings["max_dimension"]
+        fits = max(img.size) <= max_dimension and original_size <= settings["max_bytes"]
+        has_metadata = bool(img.getexif()) or "icc_profile" in img.info or "xmp" in img.info
+
+        # Let the JPEG decoder skip detail that the downscale would throw away anyway
+        img.draft("RGB", (max_dimension, max_dimension))
+        # Bake the EXIF orientation into the pixels before the EXIF is dropped
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+        fmt, data = _encode_within_limits(img, settings)
+
+    if fits and not has_metadata and original_size <= len(data):
+        return image_path
+    prepared_path = f"{output_path}.{FORMAT_EXTENSIONS[fmt]}"
+    tmp_path = f"{prepared_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, prepared_path)
+    return prepared_path
+
+class ImagePreparer:
+    """
+    Prepares images for upload once per content and settings
+
+    Prepared images are stored in the state directory under a name derived from the
+    content hash of the original and the settings hash, so picking the same image again,
+    resuming a run or posting it in a later run reuses the earlier result.
+    """
+
+    def __init__(self, directory=None, settings=None, workers=None):
+        """
+        Args:
+            directory (str): Where prepared images are kept (default: prepared_images in the state directory)
+            settings (dict): Overrides for DEFAULT_SETTINGS
+            workers (int): Size of the process pool for batches (default: one per CPU)
+        """
+        self.directory = directory or state_path('prepared_images')
+        os.makedirs(self.directory, exist_ok=True)
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.workers = workers
+        self._prepared = {}  # original digest -> prepared path
+
+    def _output_path(self, image_path, digest):
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        return os.path.join(self.directory, f"{stem}_{digest[:16]}_{settings_key(self.settings)}")
+
+    def _cached(self, image_path, digest):
+        """Return the prepared image of a digest if one exists, else None"""
+        if digest in self._prepared:
+            return self._prepared[digest]
+        output_path = self._output_path(image_path, digest)
+        for extension in FORMAT_EXTENSIONS.values():
+            if os.path.exists(f"{output_path}.{extension}"):
+                return f"{output_path}.{extension}"
+        return None
+
+    def prepared_path(self, image_path):
+        """Return the upload-ready version of an image if it was prepared before, else None; never encodes"""
+        return self._cached(image_path, file_digest(image_path))
+
+    def prepare(self, image_path):
+        """Return the path of the upload-ready version of one image"""
+        return self.prepare_many([image_path])[image_path]
+
+    def prepare_many(self, image_paths):
+        """
+        Prepare a batch of images, encoding the ones not seen before in a process pool
+
+        Args:
+            image_paths (list): Paths of the images picked by the user
+
+        Returns:
+            dict: Original path -> path of the image to upload
+        """
+        results = {}
+        todo = {}
+        for image_path in dict.fromkeys(image_paths):
+            digest = file_digest(image_path)
+            cached = self._cached(image_path, digest)
+            if cached is not None:
+                results[image_path] = cached
+            else:
+                todo[image_path] = digest
+
+        if len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = {image_path: executor.submit(prepare_image, image_path,
+                                                       self._output_path(image_path, digest), self.settings)
+                           for image_path, digest in todo.items()}
+                prepared = {image_path: future.result() for image_path, future in futures.items()}
+        else:
+            # A single image isn't worth starting worker processes for
+            prepared = {image_path: prepare_image(image_path, self._output_path(image_path, digest), self.settings)
+                        for image_path, digest in todo.items()}
+
+        for image_path, prepared_path in prepared.items():
+            if prepared_path != image_path:
+                logger.info(f"Prepared {os.path.basename(image_path)}: {os.path.getsize(image_path)} -> "
+                            f"{os.path.getsize(prepared_path)} bytes")
+            self._prepared[todo[image_path]] = prepared_path
+            results[image_path] = prepared_path
+        return results
+
+def preview_image(image_path, size=(200, 200)):
+    """
+    Return a thumbnail of an image for display
+
+    JPEGs are decoded at a reduced scale, so a full-resolution photo is never fully decoded.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as img:
+        img.draft("RGB", (size[0] * 2, size[1] * 2))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        return img.copy()
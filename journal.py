@@ -0,0 +1,240 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from retry import AUTH, RATELIMIT, TRANSIENT
+from storage import state_path
+
+logger = logging.getLogger(__name__)
+
+# Job states, in the order a job goes through them
+PLANNED = "planned"
+IN_FLIGHT = "in_flight"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Error classes of failed jobs that a resume runs again: the failure said nothing about the
+# post itself, so it may go through next time. Other failures (a banned account, a
+# validation error) would fail the same way and stay final.
+RESUMABLE_ERRORS = {RATELIMIT, TRANSIENT, AUTH}
+
+# Error classes of posts dropped before they were submitted: rejected by the subreddit
+# rules check, or already in the subreddit (see post_index)
+REJECTED = "rejected"
+DUPLICATE = "duplicate"
+
+class Journal:
+    """
+    Append-only JSONL log of posting runs, used to resume a run that died halfway
+
+    Every run starts with a "run" record holding its parameters, followed by one record
+    per job state change. Records are handed to a background writer thread, which appends
+    them and fsyncs in batches, so journaling adds no disk latency to the posting loop.
+    """
+
+    def __init__(self, path=None, fsync_interval=1.0):
+        """
+        Args:
+            path (str): Journal file (default: journal.jsonl in the state directory)
+            fsync_interval (float): Maximum seconds between fsyncs of written records
+        """
+        self.path = path or state_path('journal.jsonl')
+        self.fsync_interval = fsync_interval
+        self._queue = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _write_loop(self):
+        with open(self.path, 'a') as f:
+            last_sync = time.monotonic()
+            dirty = False
+            while True:
+                try:
+                    # With unsynced records, wake up in time to fsync them
+                    record = self._queue.get(timeout=self.fsync_interval if dirty else None)
+                except queue.Empty:
+                    os.fsync(f.fileno())
+                    last_sync, dirty = time.monotonic(), False
+                    continue
+
+                # Write everything that is queued in one go
+                batch = [record]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                f.writelines(json.dumps(r) + '\n' for r in batch if r is not None)
+                f.flush()
+                dirty = True
+
+                stop = None in batch
+                if stop or time.monotonic() - last_sync >= self.fsync_interval:
+                    os.fsync(f.fileno())
+                    last_sync, dirty = time.monotonic(), False
+                if stop:
+                    return
+
+    def start_run(self, params, run_id=None):
+        """
+        Record the start of a run
+
+        Args:
+            params (dict): JSON-serializable run parameters needed to resume it
+            run_id (str): Existing run id when resuming (default: a new id)
+
+        Returns:
+            str: The run id
+        """
+        run_id = run_id or uuid.uuid4().hex
+        self._queue.put({'run': run_id, 'event': 'run', 'params': params, 'ts': time.time()})
+        return run_id
+
+    def record(self, run_id, kind, name, state, **fields):
+        """Record a job state change; returns immediately, the write happens in the background"""
+        self._queue.put({'run': run_id, 'event': 'job', 'kind': kind, 'name': name,
+                         'state': state, 'ts': time.time(), **fields})
+
+    def close(self):
+        """Write and fsync all pending records and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def runs(self):
+        """
+        Read the journal back
+
+        Returns:
+            dict: run_id -> {'params': dict, 'jobs': {(kind, name): last record}} in journal order
+        """
+        runs = {}
+        for record in self._records():
+            if record['event'] == 'run':
+                runs.setdefault(record['run'], {'params': record['params'], 'jobs': {}})
+            elif record['run'] in runs:
+                runs[record['run']]['jobs'][(record['kind'], record['name'])] = record
+        return runs
+
+    def _records(self):
+        """Yield the records written so far, in order"""
+        try:
+            f = open(self.path, 'r')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write
+                    continue
+
+    def durations(self):
+        """
+        Return how long the jobs of earlier runs took, from going in flight to succeeding
+
+        Returns:
+            dict: (kind, post_type) -> list of seconds, with the post_type of the job's run
+        """
+        post_types = {}
+        started = {}
+        durations = {}
+        for record in self._records():
+            if record['event'] == 'run':
+                post_types[record['run']] = record['params'].get('post_type')
+                continue
+            key = (record['run'], record['kind'], record['name'])
+            if record['state'] == IN_FLIGHT:
+                started[key] = record['ts']
+            elif record['state'] == SUCCEEDED and key in started:
+                durations.setdefault((record['kind'], post_types.get(record['run'])), []).append(
+                    record['ts'] - started.pop(key))
+        return durations
+
+    def unfinished_run(self, match=None):
+        """
+        Find the most recent run with work left to do
+
+        Args:
+            match (callable): Optional filter called with the run parameters
+
+        Returns:
+            tuple: (run_id, params, pending_posts, pending_comments, unconfirmed) or None.
+            pending_comments is a list of (subreddit_name, submission_id) for posts that still
+            need their comment; unconfirmed maps the pending posts that may have been made
+            already (see pending_work) to the time of their first attempt.
+        """
+        for run_id, run in reversed(list(self.runs().items())):
+            params = run['params']
+            if match and not match(params):
+                continue
+            pending_posts, pending_comments, unconfirmed = pending_work(params, run['jobs'])
+            if pending_posts or pending_comments:
+                return run_id, params, pending_posts, pending_comments, unconfirmed
+        return None
+
+    def results(self, run_id=None):
+        """
+        Return what a run created
+
+        Args:
+            run_id (str): Run to look at (default: the most recent run that created anything)
+
+        Returns:
+            tuple: (run_id, [(kind, subreddit_name, id)]) for the jobs that succeeded with an
+            id, or (None, []) if there is no such run
+        """
+        runs = self.runs()
+        candidates = [run_id] if run_id is not None else reversed(list(runs))
+        for candidate in candidates:
+            jobs = runs.get(candidate, {'jobs': {}})['jobs']
+            created = [(kind, name, record['id']) for (kind, name), record in jobs.items()
+                       if record['state'] == SUCCEEDED and record.get('id')]
+            if created:
+                return candidate, created
+        return None, []
+
+def _pending(record):
+    """Return True if a job still has to run: it never finished, or failed in a way worth another try"""
+    if record is None or record['state'] in (PLANNED, IN_FLIGHT):
+        return True
+    if record['state'] == FAILED:
+        # Records from before failures were classified count as resumable
+        return record.get('error_class', TRANSIENT) in RESUMABLE_ERRORS
+    return False
+
+def pending_work(params, jobs):
+    """
+    Split a run's subreddits into posts still to make and comments still to add
+
+    Posts that were in flight when the run stopped, or failed with a transient error, may
+    have been made anyway; they are returned in `unconfirmed` too, with the time of their
+    first attempt, so the resumed run checks for them before posting again.
+    """
+    pending_posts = []
+    pending_comments = []
+    unconfirmed = {}
+    for name in params['subreddits']:
+        post = jobs.get(("submit", name))
+        if post is None or post['state'] != SUCCEEDED:
+            if post is not None and post['state'] == IN_FLIGHT:
+                logger.warning(f"Post to r/{name} was in flight when the run stopped and may already exist")
+            if _pending(post):
+                pending_posts.append(name)
+                if post is not None and (post['state'] == IN_FLIGHT or post.get('error_class') == TRANSIENT):
+                    unconfirmed[name] = post.get('first_attempt') or post['ts']
+        elif params.get('comment_text'):
+            comment = jobs.get(("comment", name))
+            if _pending(comment) and post.get('id'):
+                pending_comments.append((name, post['id']))
+    return pending_posts, pending_comments, unconfirmed
@@ -1,10 +1,18 @@
-import praw
-import time
+import argparse
 import logging
-from praw.models import InlineImage
-import random
 import os
+import threading
 from dotenv import load_dotenv
+from media_cache import MediaCache
+from image_prep import ImagePreparer
+from scheduler import RateLimitScheduler
+from client import create_reddit
+from journal import Journal
+from campaign import read_manifest
+from subreddit_rules import SubredditRulesCache
+from post_index import PostIndex
+from engine import DEFAULT_MAX_PENDING, EXECUTORS, PostingEngine
+import metrics
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,143 +20,246 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-reddit = praw.Reddit(
-    client_id=os.getenv('REDDIT_CLIENT_ID'),
-    client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
-    password=os.getenv('REDDIT_PASSWORD'),
-    user_agent=os.getenv('REDDIT_USER_AGENT'),
-    username=os.getenv('REDDIT_USERNAME'),
-)
+# Shared state, each built on first use by its accessor below, so importing this module stays fast,
+# offline and free of side effects (no state files, journal writer thread or exporters)
+_reddit = None
+_tracer = None
+_run_journal = None
+_engine = None
+_lock = threading.RLock()
 
-def post_to_subreddits(title, content, subreddit_list, post_type="text", url=None, image_path=None, delay=60):
+# Executor runs go through (see engine.EXECUTORS): "sync" runs one request at a time with praw,
+# "threaded" overlaps praw jobs on a few threads, "async" overlaps requests with asyncpraw
+backend = os.getenv('RED_POST_BACKEND', 'sync')
+
+def get_reddit():
+    """Return the shared praw client, creating it on first use"""
+    global _reddit
+    with _lock:
+        if _reddit is None:
+            _reddit = create_reddit()
+        return _reddit
+
+def get_tracer():
+    """
+    Return the shared tracer with timing spans for every API job
+
+    Configured from RED_POST_METRICS and friends on first use (see metrics.configure),
+    unless configure_metrics() was called first.
+    """
+    global _tracer
+    with _lock:
+        if _tracer is None:
+            _tracer = metrics.configure()
+        return _tracer
+
+def configure_metrics(enabled=None, jsonl_path=None, prometheus_path=None):
+    """Configure the shared tracer with explicit settings, see metrics.configure"""
+    global _tracer
+    with _lock:
+        _tracer = metrics.configure(enabled=enabled, jsonl_path=jsonl_path, prometheus_path=prometheus_path)
+        return _tracer
+
+def get_run_journal():
+    """Return the shared journal every run is recorded in, so it can be resumed if the process dies halfway"""
+    global _run_journal
+    with _lock:
+        if _run_journal is None:
+            _run_journal = Journal()
+        return _run_journal
+
+def close_run_journal():
+    """Write out and close the shared journal, if it was opened"""
+    with _lock:
+        if _run_journal is not None:
+            _run_journal.close()
+
+def get_engine():
     """
-    Post to multiple subreddits with a delay between posts
+    Return the engine posting, commenting and resuming go through, creating it on first use
+
+    It holds the caches shared by all runs: uploaded media (reused across subreddits and
+    runs), the posting rules of each subreddit (checked before any upload), the repost
+    index (so the same post is not made twice to a subreddit) and the image preparer
+    (downscales, re-encodes and strips EXIF once before upload). The GUI and the daemon
+    use the same engine class.
+    """
+    global _engine
+    with _lock:
+        if _engine is None:
+            get_tracer()
+            _engine = PostingEngine(get_reddit, MediaCache(), SubredditRulesCache(), ImagePreparer(), PostIndex(),
+                                    get_run_journal())
+        return _engine
+
+def _check_auth():
+    """Log who we are authenticated as; runs in the background while the run starts"""
+    try:
+        reddit = get_reddit()
+        logger.info(f"Authenticated as: {reddit.user.me()}")
+        logger.info(f"Read-only mode: {reddit.read_only}")
+    except Exception as e:
+        logger.error(f"Authentication failed: {e}")
+
+def post_and_comment(title, content, subreddit_list, comment_text=None, post_type="text", url=None, image_path=None,
+                     image_paths=None, video_path=None, delay=None, comment_delay=None, scheduler=None, journal=None,
+                     event_bus=None, cancel=None):
+    """
+    Post to multiple subreddits and comment on each post as soon as it is created
+    
+    Runs on the selected backend; see PostingEngine.post_and_comment for the arguments.
+    
+    Returns:
+        tuple: ((successful_posts, failed_posts, submissions), (successful_comments, failed_comments))
+    """
+    return get_engine().post_and_comment(title, content, subreddit_list, comment_text=comment_text, post_type=post_type,
+                                   url=url, image_path=image_path, image_paths=image_paths, video_path=video_path,
+                                   delay=delay, comment_delay=comment_delay, scheduler=scheduler, journal=journal,
+                                   executor=backend, event_bus=event_bus, cancel=cancel)
+
+def resume_run(scheduler=None, journal=None, event_bus=None, cancel=None):
+    """
+    Resume the most recent unfinished run from the journal, see PostingEngine.resume_run
+    
+    Returns:
+        tuple: Same as post_and_comment, or None if there is nothing to resume
+    """
+    return get_engine().resume_run(scheduler=scheduler, journal=journal, executor=backend, event_bus=event_bus,
+                             cancel=cancel)
+
+def run_campaign(manifest_path, scheduler=None, max_pending=DEFAULT_MAX_PENDING):
+    """
+    Run every post of a campaign manifest through one shared, rate limit aware pipeline
+    
+    The manifest is streamed, see PostingEngine.run_campaign.
     
     Args:
-        title (str): The title of the post
-        content (str): The content/selftext of the post (for text posts)
-        subreddit_list (list): List of subreddit names to post to
-        post_type (str): "text" for text posts, "link" for link posts, "image" for image posts
-        url (str): URL for link posts (required if post_type="link")
-        image_path (str): Path to image file (required if post_type="image")
-        delay (int): Delay in seconds between posts (default: 60)
+        manifest_path (str): JSON, JSON Lines, YAML or CSV manifest (see campaign.read_manifest)
+        scheduler (RateLimitScheduler): Scheduler to share with other calls (default: a new one)
+        max_pending (int): Maximum number of jobs waiting in the pipeline at once
+    
+    Returns:
+        dict: Counts of successful and failed posts and comments
+    """
+    return get_engine().run_campaign(read_manifest(manifest_path), scheduler=scheduler, max_pending=max_pending,
+                               executor=backend)
+
+def post_to_subreddits(title, content, subreddit_list, post_type="text", url=None, image_path=None, image_paths=None,
+                       video_path=None, delay=None, scheduler=None):
+    """
+    Post to multiple subreddits, pacing the posts by Reddit's rate limit budget
     
     Returns:
         tuple: (successful_posts, failed_posts, submissions) where submissions is a list of submission objects
     """
+    return get_engine().post_to_subreddits(title, content, subreddit_list, post_type=post_type, url=url,
+                                     image_path=image_path, image_paths=image_paths, video_path=video_path,
+                                     delay=delay, scheduler=scheduler, executor=backend)
+
+def comment_on_posts(submissions, comment_text, delay=None, scheduler=None, event_bus=None, cancel=None):
+    """
+    Comment on a list of submissions, see PostingEngine.comment_on_posts
+    
+    Returns:
+        tuple: (successful_comments, failed_comments)
+    """
+    return get_engine().comment_on_posts(submissions, comment_text, delay=delay, scheduler=scheduler, executor=backend,
+                                   event_bus=event_bus, cancel=cancel)
+
+def plan_posts(posts, scheduler=None):
+    """
+    Estimate the API requests, uploads and duration of a run without sending anything
     
-    successful_posts = []
-    failed_posts = []
-    submissions = []  # Store submission objects for commenting later
-    
-    for subreddit_name in subreddit_list:
-        try:
-            subreddit = reddit.subreddit(subreddit_name)
-            
-            if post_type == "text":
-                submission = subreddit.submit(title=title, selftext=content)
-            elif post_type == "link":
-                if not url:
-                    logger.error(f"URL required for link post to r/{subreddit_name}")
-                    failed_posts.append(subreddit_name)
-                    continue
-                submission = subreddit.submit(title=title, url=url)
-            elif post_type == "image":
-                if not image_path:
-                    logger.error(f"Image path required for image post to r/{subreddit_name}")
-                    failed_posts.append(subreddit_name)
-                    continue
-                # Check if image file exists
-                import os
-                if not os.path.exists(image_path):
-                    logger.error(f"Image file not found: {image_path}")
-                    failed_posts.append(subreddit_name)
-                    continue
-                submission = subreddit.submit_image(title=title, image_path=image_path, nsfw=False)
-            else:
-                logger.error(f"Invalid post type: {post_type}")
-                failed_posts.append(subreddit_name)
-                continue
-            
-            logger.info(f"Successfully posted to r/{subreddit_name}: {submission.url}")
-            successful_posts.append(subreddit_name)
-            submissions.append(submission)  # Store submission for later commenting
-            
-            # Add delay between posts to avoid rate limiting
-            if subreddit_name != subreddit_list[-1]:  # Don't delay after last post
-                logger.info(f"Waiting {delay} seconds before next post...")
-                time.sleep(delay)
-                
-        except Exception as e:
-            logger.error(f"Failed to post to r/{subreddit_name}: {str(e)}")
-            failed_posts.append(subreddit_name)
-    
-    # Summary
-    logger.info(f"\nPosting complete!")
-    logger.info(f"Successful posts: {len(successful_posts)}")
-    logger.info(f"Failed posts: {len(failed_posts)}")
-    
-    if successful_posts:
-        logger.info(f"Posted successfully to: {', '.join(successful_posts)}")
-    if failed_posts:
-        logger.info(f"Failed to post to: {', '.join(failed_posts)}")
-    
-    return successful_posts, failed_posts, submissions
-
-def comment_on_posts(submissions, comment_text, delay=30):
-    """
-    Comment on a list of submissions
+    Uses the cached subreddit rules, media and repost index, and the latencies of earlier
+    runs from the journal and the trace file (see planner.RunPlanner). The plan is logged.
     
     Args:
-        submissions (list): List of submission objects to comment on
-        comment_text (str): The comment text to post
-        delay (int): Delay in seconds between comments (default: 30)
+        posts (iterable): Post dicts as from campaign.read_manifest or planner.single_post
+        scheduler (RateLimitScheduler): Scheduler whose rate limit budget the run would start with
+                                        (default: None, a fresh window is assumed)
     
     Returns:
-        tuple: (successful_comments, failed_comments)
+        dict: The plan, see RunPlanner.plan
     """
-    successful_comments = []
-    failed_comments = []
-    
-    logger.info(f"\nStarting to comment on {len(submissions)} posts...")
-    
-    for submission in submissions:
-        try:
-            # Add comment to the submission
-            comment = submission.reply(comment_text)
-            logger.info(f"Successfully commented on post in r/{submission.subreddit.display_name}: {comment.permalink}")
-            successful_comments.append(submission.subreddit.display_name)
-            
-            # Add delay between comments to avoid rate limiting
-            if submission != submissions[-1]:  # Don't delay after last comment
-                logger.info(f"Waiting {delay} seconds before next comment...")
-                time.sleep(delay)
-                
-        except Exception as e:
-            logger.error(f"Failed to comment on post in r/{submission.subreddit.display_name}: {str(e)}")
-            failed_comments.append(submission.subreddit.display_name)
-    
-    # Summary
-    logger.info(f"\nCommenting complete!")
-    logger.info(f"Successful comments: {len(successful_comments)}")
-    logger.info(f"Failed comments: {len(failed_comments)}")
-    
-    if successful_comments:
-        logger.info(f"Commented successfully on: {', '.join(successful_comments)}")
-    if failed_comments:
-        logger.info(f"Failed to comment on: {', '.join(failed_comments)}")
-    
-    return successful_comments, failed_comments
+    from planner import RunPlanner, format_plan
+    
+    plan = RunPlanner(get_engine()).plan(posts, scheduler=scheduler, executor=backend)
+    logger.info(format_plan(plan))
+    return plan
+
+def collect_run_status(run_id=None, watch=False, rounds=None, journal=None, cancel=None):
+    """
+    Fetch the score, comment count and removal status of everything a run created
+    
+    The posts and comments are read from the journal and fetched in batches of 100 per
+    request (see post_status), and each poll is stored in the status database.
+    
+    Args:
+        run_id (str): Run to check (default: the most recent run that created anything)
+        watch (bool): Keep polling at growing intervals instead of polling once
+        rounds (int): Number of polls when watching (default: until cancelled)
+        journal (Journal): Journal to read the run from (default: the shared journal)
+        cancel (threading.Event): Stops watching once set (default: None)
+    
+    Returns:
+        list: Latest status of each post and comment (see StatusCollector.latest)
+    """
+    from post_status import StatusCollector
+    
+    journal = journal or get_run_journal()
+    run_id, created = journal.results(run_id)
+    if not created:
+        logger.info("No posts or comments to collect the status of")
+        return []
+    
+    collector = StatusCollector()
+    try:
+        fullnames = collector.track(run_id, created)
+        if watch:
+            collector.poll(get_reddit(), fullnames, rounds=rounds, cancel=cancel)
+        else:
+            collector.collect(get_reddit(), fullnames)
+        latest = collector.latest(run_id)
+    finally:
+        collector.close()
+    
+    for row in latest:
+        state = f", removed ({row['removed']})" if row['removed'] else ""
+        comments = f", {row['num_comments']} comments" if row['num_comments'] is not None else ""
+        logger.info(f"r/{row['subreddit']} {row['fullname']}: score {row['score']}{comments}{state}")
+    return latest
 
 # Example usage
 if __name__ == "__main__":
-    # Check if we can authenticate
-    try:
-        logger.info(f"Authenticated as: {reddit.user.me()}")
-        logger.info(f"Read-only mode: {reddit.read_only}")
-    except Exception as e:
-        logger.error(f"Authentication failed: {e}")
-        exit(1)
+    parser = argparse.ArgumentParser(description="Post to multiple subreddits")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume the last unfinished run from the journal instead of starting a new one")
+    parser.add_argument('--campaign', metavar="MANIFEST",
+                        help="Run every post of a JSON, JSON Lines, YAML or CSV campaign manifest")
+    parser.add_argument('--backend', choices=sorted(EXECUTORS), default=backend,
+                        help="sync: one request at a time with praw, threaded: praw jobs on a few threads, "
+                             "async: overlapping requests with asyncpraw")
+    parser.add_argument('--backfill-index', action='store_true',
+                        help="Add the account's earlier submissions to the repost index before running")
+    parser.add_argument('--collect-status', action='store_true',
+                        help="Fetch the score and removal status of the last run's posts and comments, then exit")
+    parser.add_argument('--watch-status', action='store_true',
+                        help="Like --collect-status, but keep polling at growing intervals until interrupted")
+    parser.add_argument('--plan', action='store_true',
+                        help="Estimate the API requests, uploads and duration of the run or --campaign "
+                             "without sending anything, then exit")
+    parser.add_argument('--metrics', action='store_true', help="Print a timing summary after each run")
+    parser.add_argument('--trace-file', help="Append a JSON line per API job span to this file")
+    parser.add_argument('--prometheus-file', help="Write run counters to this Prometheus textfile")
+    args = parser.parse_args()
+    backend = args.backend
+    if args.metrics or args.trace_file or args.prometheus_file:
+        configure_metrics(enabled=args.metrics or None, jsonl_path=args.trace_file,
+                          prometheus_path=args.prometheus_file)
+    
+    if args.collect_status or args.watch_status:
+        collect_run_status(watch=args.watch_status)
+        exit(0)
     
     # Example configuration - modify these values
     POST_TITLE = "you say perfection, i show this"
@@ -158,6 +269,33 @@ if __name__ == "__main__":
     
     # List of subreddits to post to
     SUBREDDITS = ["test", "HentaiOnlyGoodHentai"]  # Replace with your subreddits
+    
+    if args.plan:
+        # Planning is offline: no client is created, so the budget is assumed to be a fresh window
+        from planner import single_post
+        if args.campaign:
+            plan_posts(read_manifest(args.campaign))
+        else:
+            plan_posts([single_post(POST_TITLE, POST_CONTENT, SUBREDDITS, comment_text=COMMENT_TEXT,
+                                    post_type="image", image_path=IMAGE_PATH)])
+        exit(0)
+    
+    # Check if we can authenticate without holding up the run; posts fail on their own if we can't
+    threading.Thread(target=_check_auth, daemon=True).start()
+
+    # One scheduler for the whole run so posts and comments share the rate limit budget
+    scheduler = RateLimitScheduler(get_reddit())
+    
+    if args.backfill_index:
+        get_engine().post_index.backfill(get_reddit())
+    
+    if args.resume:
+        resume_run(scheduler=scheduler)
+        exit(0)
+    
+    if args.campaign:
+        run_campaign(args.campaign, scheduler=scheduler)
+        exit(0)
 
     # For text posts
     # print("Starting to post to subreddits...")
@@ -169,26 +307,19 @@ if __name__ == "__main__":
     #     delay=60  # 60 seconds between posts
     # )
     
-    # For image posts
+    # For image posts - each post is commented on as soon as it is created
     print("Starting to post image to subreddits...")
-    successful, failed, submissions = post_to_subreddits(
+    (successful, failed, submissions), (successful_comments, failed_comments) = post_and_comment(
         title=POST_TITLE,
         content="",  # Not used for image posts
         subreddit_list=SUBREDDITS,
+        comment_text=COMMENT_TEXT,
         post_type="image",
         image_path=IMAGE_PATH,
-        delay=random.randint(20, 40)  # Random delay between 20-40 seconds
+        scheduler=scheduler
     )
     
-    # Comment on successful posts
-    if submissions:
-        print(f"\nFound {len(submissions)} successful posts. Starting to comment...")
-        successful_comments, failed_comments = comment_on_posts(
-            submissions=submissions,
-            comment_text=COMMENT_TEXT,
-            delay=random.randint(15, 30)  # Random delay between 15-30 seconds
-        )
-    else:
+    if not submissions:
         print("No successful posts to comment on.")
     
     # Example for link posts (uncomment to use)
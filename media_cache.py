@@ -0,0 +1,532 @@
+import asyncio
+import contextvars
+import hashlib
+import importlib.util
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from metrics import tracer
+from storage import state_path
+
+logger = logging.getLogger(__name__)
+
+# Uploaded assets are only kept by Reddit for a limited time; past this age we upload again
+DEFAULT_TTL = 60 * 60
+
+# Reddit error types that mean the submitted media URL is no longer usable
+ASSET_REJECTION_ERRORS = {"BAD_URL", "INVALID_URL", "NO_URL"}
+
+# Same endpoint praw's _upload_media leases uploads from; kept here so importing this module doesn't import praw
+MEDIA_ASSET_PATH = "api/media/asset.json"
+
+# Uploads of one post (the images of a gallery, a video and its thumbnail) that run at once
+UPLOAD_WORKERS = int(os.getenv('RED_POST_UPLOAD_WORKERS') or 4)
+
+# Endpoint of praw's submit_gallery
+SUBMIT_GALLERY_PATH = "api/submit_gallery_post.json"
+
+# Same mapping praw uses to pick the mimetype of an upload, plus WebP from image preprocessing
+MIME_TYPES = {
+    "png": "image/png",
+    "mov": "video/quicktime",
+    "mp4": "video/mp4",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "webp": "image/webp",
+}
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """
+    Return the SHA-256 hex digest of a file
+
+    The file is memory-mapped, so even a large video is hashed in one call without
+    being copied into Python objects; files that cannot be mapped are read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+                return digest.hexdigest()
+        except (OSError, ValueError):
+            # Empty files and special files have nothing to map
+            pass
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _lease_request(media_path, expected_mime_prefix):
+    """Return the form data asking Reddit for an upload lease for a media file"""
+    file_name = os.path.basename(media_path).lower()
+    file_extension = file_name.rpartition(".")[2]
+    mime_type = MIME_TYPES.get(file_extension, "image/jpeg")
+    if expected_mime_prefix is not None and mime_type.partition("/")[0] != expected_mime_prefix:
+        from praw.exceptions import ClientException
+        raise ClientException(f"Expected a mimetype starting with {expected_mime_prefix!r} but got "
+                              f"mimetype {mime_type!r} (from file extension {file_extension!r}).")
+    return {"filepath": file_name, "mimetype": mime_type}
+
+def _upload_target(lease):
+    """Return (upload_url, upload_fields) from an upload lease"""
+    upload_args = lease["args"]
+    action = upload_args["action"]
+    # Reddit hands out scheme-relative S3 URLs; keep explicit schemes (e.g. a local test server)
+    upload_url = action if "://" in action else f"https:{action}"
+    return upload_url, {item["name"]: item["value"] for item in upload_args["fields"]}
+
+def _uploaded_asset(lease, upload_url, upload_fields, upload_type):
+    if upload_type == "link":
+        return f"{upload_url}/{upload_fields['key']}"
+    return lease["asset"]["asset_id"]
+
+def upload_media(subreddit, media_path, expected_mime_prefix="image", upload_type="link"):
+    """
+    Request an upload lease and upload a media file to it (what praw's _upload_media does)
+
+    Returns:
+        str: The asset URL for "link" uploads, the asset id otherwise
+    """
+    with tracer.span("upload", name=os.path.basename(media_path)) as span:
+        lease = subreddit._reddit.post(MEDIA_ASSET_PATH, data=_lease_request(media_path, expected_mime_prefix))
+        upload_url, upload_fields = _upload_target(lease)
+        # Streamed from disk, where praw's _read_and_post_media would read the whole file into memory
+        from http_session import stream_upload
+        response = stream_upload(subreddit._reddit._core._requestor._http, upload_url, upload_fields, media_path,
+                                 timeout=subreddit._reddit.config.timeout)
+        # The upload itself bypasses prawcore's requestor, so count it here
+        span.add_response(response.status_code, bytes_sent=os.path.getsize(media_path))
+        if not response.ok:
+            from prawcore.exceptions import ServerError
+            subreddit._parse_xml_response(response)
+            raise ServerError(response=response)
+        return _uploaded_asset(lease, upload_url, upload_fields, upload_type)
+
+async def upload_media_async(subreddit, media_path, expected_mime_prefix="image", upload_type="link"):
+    """Async version of upload_media for an asyncpraw Subreddit"""
+    with tracer.span("upload", name=os.path.basename(media_path)) as span:
+        lease = await subreddit._reddit.post(MEDIA_ASSET_PATH,
+                                             data=_lease_request(media_path, expected_mime_prefix))
+        upload_url, upload_fields = _upload_target(lease)
+        # aiohttp sends the open file in chunks, read off the event loop, so it is not loaded whole either
+        response = await subreddit._read_and_post_media(Path(media_path), upload_url, upload_fields)
+        span.add_response(response.status, bytes_sent=os.path.getsize(media_path))
+        if response.status != 201:
+            await subreddit._parse_xml_response(response)
+            response.raise_for_status()
+        return _uploaded_asset(lease, upload_url, upload_fields, upload_type)
+
+class MediaCache:
+    """
+    Cache of uploaded media assets keyed by the content hash of the file
+
+    The same image is uploaded once and its asset URL is reused for every subreddit.
+    Entries are persisted to disk so they survive across runs until they expire. Jobs
+    running at once (threaded or async) that need the same file share one upload.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, clock=time.time, upload_workers=UPLOAD_WORKERS):
+        self.path = path or state_path('media_cache.json')
+        self.ttl = ttl
+        self.upload_workers = upload_workers
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Uploads finishing on several threads save at once; they must not share the temporary file
+        self._save_lock = threading.Lock()
+        self._digests = {}  # (path, mtime, size) -> digest, so each file is hashed once
+        self._pending = {}  # key -> asyncio.Future of an upload in progress
+        self._uploading = {}  # key -> concurrent.futures.Future of an upload in progress on some thread
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = self.clock()
+        return {key: entry for key, entry in entries.items() if entry['expires_at'] > now}
+
+    def save(self):
+        """Write the cache to disk atomically"""
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps(self._entries)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+
+    def digest(self, media_path):
+        """Return the content hash of a media file, memoized by path, mtime and size"""
+        stat = os.stat(media_path)
+        key = (os.path.abspath(media_path), stat.st_mtime_ns, stat.st_size)
+        if key not in self._digests:
+            self._digests[key] = file_digest(media_path)
+        return self._digests[key]
+
+    def _lookup(self, key):
+        # Callers hold the lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires_at'] <= self.clock():
+            del self._entries[key]
+            return None
+        return entry['asset']
+
+    def get(self, digest, upload_type="link"):
+        """Return the cached asset for a digest, or None if missing or expired"""
+        with self._lock:
+            return self._lookup(f"{upload_type}:{digest}")
+
+    def put(self, digest, asset, upload_type="link"):
+        """Store an uploaded asset for a digest"""
+        with self._lock:
+            self._entries[f"{upload_type}:{digest}"] = {
+                'asset': asset,
+                'expires_at': self.clock() + self.ttl,
+            }
+
+    def invalidate(self, digest, upload_type="link"):
+        """Drop a cached asset, e.g. after the server rejected it"""
+        with self._lock:
+            self._entries.pop(f"{upload_type}:{digest}", None)
+
+    def upload(self, subreddit, media_path, expected_mime_prefix="image", upload_type="link"):
+        """
+        Upload a media file, or reuse a previous upload of the same content
+
+        Args:
+            subreddit: praw Subreddit used to request the upload lease
+            media_path (str): Path to the media file
+            expected_mime_prefix (str): Mime type prefix enforced by praw (e.g. "image")
+            upload_type (str): "link" for the asset URL, "gallery"/"selfpost" for the asset id
+
+        Returns:
+            tuple: (asset, cached) where cached is True if no upload was made
+        """
+        digest = self.digest(media_path)
+        key = f"{upload_type}:{digest}"
+        with self._lock:
+            asset = self._lookup(key)
+            pending = self._uploading.get(key) if asset is None else None
+            uploading = asset is None and pending is None
+            if uploading:
+                pending = self._uploading[key] = Future()
+        if asset is not None:
+            logger.info(f"Reusing uploaded media for {os.path.basename(media_path)}")
+            return asset, True
+        if not uploading:
+            # Another thread is uploading the same content, e.g. for another subreddit
+            return pending.result(), True
+
+        try:
+            asset = upload_media(subreddit, media_path, expected_mime_prefix, upload_type)
+        except BaseException as e:
+            # Including KeyboardInterrupt, so threads waiting on the same content are not left hanging
+            with self._lock:
+                del self._uploading[key]
+            pending.set_exception(e)
+            raise
+        self.put(digest, asset, upload_type)
+        # Stored before the upload stops counting as in progress, so no caller misses both
+        with self._lock:
+            del self._uploading[key]
+        pending.set_result(asset)
+        self.save()
+        return asset, False
+
+    def upload_all(self, subreddit, uploads, workers=None):
+        """
+        Upload the media files of one post, up to `workers` at a time
+
+        Files with a cached upload are not uploaded again, and when at most one file
+        needs uploading no threads are started.
+
+        Args:
+            subreddit: praw Subreddit used to request the upload leases
+            uploads (list): (media_path, expected_mime_prefix, upload_type) per file
+            workers (int): Most uploads running at once (default: self.upload_workers)
+
+        Returns:
+            list: (asset, cached) per file, in the order of uploads
+        """
+        workers = workers or self.upload_workers
+        missing = sum(self.get(self.digest(media_path), upload_type) is None
+                      for media_path, _, upload_type in uploads)
+        if missing <= 1 or workers <= 1:
+            return [self.upload(subreddit, *upload) for upload in uploads]
+        with ThreadPoolExecutor(max_workers=min(workers, missing), thread_name_prefix="red-post-upload") as pool:
+            # Each upload runs in a copy of this context, so its span nests in the job's span
+            futures = [pool.submit(contextvars.copy_context().run, self.upload, subreddit, *upload)
+                       for upload in uploads]
+            return [future.result() for future in futures]
+
+    async def upload_async(self, subreddit, media_path, expected_mime_prefix="image", upload_type="link"):
+        """
+        Async version of upload for an asyncpraw Subreddit
+
+        Concurrent calls for the same content share a single upload. If the call making
+        the upload is cancelled, the next waiter makes it instead.
+        """
+        digest = self.digest(media_path)
+        key = f"{upload_type}:{digest}"
+        while True:
+            asset = self.get(digest, upload_type)
+            if asset is not None:
+                return asset, True
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending), True
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    # This call was cancelled, not the upload it waited for
+                    raise
+
+        pending = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            asset = await upload_media_async(subreddit, media_path, expected_mime_prefix, upload_type)
+        except Exception as e:
+            pending.set_exception(e)
+            # Waiters get the exception; don't warn about it never being retrieved
+            pending.exception()
+            raise
+        except BaseException:
+            # Cancelled: waiters must not hang on a future nobody resolves
+            pending.cancel()
+            raise
+        finally:
+            del self._pending[key]
+        pending.set_result(asset)
+        self.put(digest, asset, upload_type)
+        self.save()
+        return asset, False
+
+    async def upload_all_async(self, subreddit, uploads, workers=None):
+        """Async version of upload_all for an asyncpraw Subreddit"""
+        semaphore = asyncio.Semaphore(workers or self.upload_workers)
+
+        async def upload(media_path, expected_mime_prefix, upload_type):
+            async with semaphore:
+                return await self.upload_async(subreddit, media_path, expected_mime_prefix, upload_type)
+
+        return list(await asyncio.gather(*(upload(*item) for item in uploads)))
+
+def is_asset_rejection(exception):
+    """Return True if an exception means the server refused a previously uploaded asset"""
+    # Matched by name so that both praw and asyncpraw exceptions are recognized
+    names = {cls.__name__ for cls in type(exception).__mro__}
+    if "MediaPostFailed" in names:
+        return True
+    if "RedditAPIException" in names:
+        return any(item.error_type in ASSET_REJECTION_ERRORS for item in exception.items)
+    return False
+
+def _media_submit_data(subreddit, title, nsfw, spoiler, flair_id=None, flair_text=None, kind="image"):
+    data = {
+        "sr": str(subreddit),
+        "resubmit": True,
+        "sendreplies": True,
+        "title": title,
+        "nsfw": bool(nsfw),
+        "spoiler": bool(spoiler),
+        "validate_on_submit": subreddit._reddit.validate_on_submit,
+        "kind": kind,
+    }
+    if flair_id is not None:
+        data["flair_id"] = flair_id
+    if flair_text is not None:
+        data["flair_text"] = flair_text
+    return data
+
+def submit_image(subreddit, title, image_path, cache, nsfw=False, spoiler=False, timeout=10, flair_id=None,
+                 flair_text=None):
+    """
+    Submit an image post, reusing a cached upload of the same image when possible
+
+    Mirrors praw's Subreddit.submit_image, but takes the asset URL from the media cache.
+    If the server rejects a cached asset, it is uploaded again and the submit is retried once.
+
+    Args:
+        subreddit: praw Subreddit to post to
+        title (str): The title of the post
+        image_path (str): Path to the image file
+        cache (MediaCache): Cache of uploaded assets
+        nsfw (bool): Whether to mark the post NSFW
+        spoiler (bool): Whether to mark the post as a spoiler
+        timeout (int): Websocket timeout in seconds
+        flair_id (str): Optional link flair template id
+        flair_text (str): Optional link flair text
+
+    Returns:
+        Submission: The newly created submission
+    """
+    data = _media_submit_data(subreddit, title, nsfw, spoiler, flair_id, flair_text)
+    image_url, cached = cache.upload(subreddit, image_path)
+    data["url"] = image_url
+    try:
+        return subreddit._submit_media(data=data, timeout=timeout, without_websockets=False)
+    except Exception as e:
+        if not cached or not is_asset_rejection(e):
+            raise
+        logger.warning(f"Cached media for {os.path.basename(image_path)} was rejected, uploading again")
+
+    cache.invalidate(cache.digest(image_path))
+    image_url, _ = cache.upload(subreddit, image_path)
+    data["url"] = image_url
+    return subreddit._submit_media(data=data, timeout=timeout, without_websockets=False)
+
+async def submit_image_async(subreddit, title, image_path, cache, nsfw=False, spoiler=False, timeout=10,
+                             flair_id=None, flair_text=None):
+    """Async version of submit_image for an asyncpraw Subreddit"""
+    data = _media_submit_data(subreddit, title, nsfw, spoiler, flair_id, flair_text)
+    image_url, cached = await cache.upload_async(subreddit, image_path)
+    data["url"] = image_url
+    try:
+        return await subreddit._submit_media(data=data, timeout=timeout, without_websockets=False)
+    except Exception as e:
+        if not cached or not is_asset_rejection(e):
+            raise
+        logger.warning(f"Cached media for {os.path.basename(image_path)} was rejected, uploading again")
+
+    cache.invalidate(cache.digest(image_path))
+    image_url, _ = await cache.upload_async(subreddit, image_path)
+    data["url"] = image_url
+    return await subreddit._submit_media(data=data, timeout=timeout, without_websockets=False)
+
+def _gallery_submit_data(subreddit, title, media_ids, nsfw, spoiler, flair_id=None, flair_text=None):
+    data = {
+        "api_type": "json",
+        "items": [{"caption": "", "outbound_url": "", "media_id": media_id} for media_id in media_ids],
+        "nsfw": bool(nsfw),
+        "sendreplies": True,
+        "show_error_list": True,
+        "spoiler": bool(spoiler),
+        "sr": str(subreddit),
+        "title": title,
+        "validate_on_submit": subreddit._reddit.validate_on_submit,
+    }
+    if flair_id is not None:
+        data["flair_id"] = flair_id
+    if flair_text is not None:
+        data["flair_text"] = flair_text
+    return data
+
+def default_thumbnail(package="praw"):
+    """Return the image praw (or asyncpraw) posts as the thumbnail of a video that has none, without importing it"""
+    return os.path.join(os.path.dirname(importlib.util.find_spec(package).origin), "images", "PRAW logo.png")
+
+def _default_thumbnail(subreddit):
+    return default_thumbnail(type(subreddit).__module__.partition('.')[0])
+
+def submit_gallery(subreddit, title, image_paths, cache, nsfw=False, spoiler=False, flair_id=None, flair_text=None):
+    """
+    Submit a gallery post, reusing cached uploads of its images
+
+    Mirrors praw's Subreddit.submit_gallery with the media ids taken from the media cache.
+    The images that are not cached yet are uploaded in parallel (see upload_all). If the
+    server rejects cached assets, the images are uploaded again and the submit is retried once.
+
+    Args:
+        subreddit: praw Subreddit to post to
+        title (str): The title of the post
+        image_paths (list): Paths to the image files, in gallery order
+        cache (MediaCache): Cache of uploaded assets
+        nsfw, spoiler, flair_id, flair_text: As for submit_image
+
+    Returns:
+        Submission: The newly created submission
+    """
+    from praw.exceptions import RedditAPIException
+
+    for attempt in range(2):
+        uploads = cache.upload_all(subreddit, [(image_path, "image", "gallery") for image_path in image_paths])
+        data = _gallery_submit_data(subreddit, title, [asset for asset, _ in uploads], nsfw, spoiler, flair_id,
+                                    flair_text)
+        try:
+            response = subreddit._reddit.request(json=data, method="POST", path=SUBMIT_GALLERY_PATH)["json"]
+            if response["errors"]:
+                raise RedditAPIException(response["errors"])
+            return subreddit._reddit.submission(url=response["data"]["url"])
+        except Exception as e:
+            if attempt or not any(cached for _, cached in uploads) or not is_asset_rejection(e):
+                raise
+            logger.warning(f"Cached media for the gallery {title!r} was rejected, uploading again")
+        for image_path in image_paths:
+            cache.invalidate(cache.digest(image_path), "gallery")
+
+async def submit_gallery_async(subreddit, title, image_paths, cache, nsfw=False, spoiler=False, flair_id=None,
+                               flair_text=None):
+    """Async version of submit_gallery for an asyncpraw Subreddit"""
+    from asyncpraw.exceptions import RedditAPIException
+
+    for attempt in range(2):
+        uploads = await cache.upload_all_async(subreddit, [(image_path, "image", "gallery")
+                                                           for image_path in image_paths])
+        data = _gallery_submit_data(subreddit, title, [asset for asset, _ in uploads], nsfw, spoiler, flair_id,
+                                    flair_text)
+        try:
+            response = (await subreddit._reddit.request(json=data, method="POST", path=SUBMIT_GALLERY_PATH))["json"]
+            if response["errors"]:
+                raise RedditAPIException(response["errors"])
+            return await subreddit._reddit.submission(url=response["data"]["url"], fetch=False)
+        except Exception as e:
+            if attempt or not any(cached for _, cached in uploads) or not is_asset_rejection(e):
+                raise
+            logger.warning(f"Cached media for the gallery {title!r} was rejected, uploading again")
+        for image_path in image_paths:
+            cache.invalidate(cache.digest(image_path), "gallery")
+
+def submit_video(subreddit, title, video_path, cache, thumbnail_path=None, nsfw=False, spoiler=False, timeout=10,
+                 flair_id=None, flair_text=None):
+    """
+    Submit a video post, reusing cached uploads of the video and its thumbnail
+
+    Mirrors praw's Subreddit.submit_video, but the video and the thumbnail are uploaded at
+    the same time and streamed from disk. Without a thumbnail_path, praw's logo is used
+    like praw does, and since it is cached it is only uploaded once.
+
+    Returns:
+        Submission: The newly created submission
+    """
+    data = _media_submit_data(subreddit, title, nsfw, spoiler, flair_id, flair_text, kind="video")
+    thumbnail_path = thumbnail_path or _default_thumbnail(subreddit)
+    for attempt in range(2):
+        (video_url, video_cached), (poster_url, poster_cached) = cache.upload_all(
+            subreddit, [(video_path, "video", "link"), (thumbnail_path, "image", "link")])
+        data.update(url=video_url, video_poster_url=poster_url)
+        try:
+            return subreddit._submit_media(data=data, timeout=timeout, without_websockets=False)
+        except Exception as e:
+            if attempt or not (video_cached or poster_cached) or not is_asset_rejection(e):
+                raise
+            logger.warning(f"Cached media for {os.path.basename(video_path)} was rejected, uploading again")
+        cache.invalidate(cache.digest(video_path))
+        cache.invalidate(cache.digest(thumbnail_path))
+
+async def submit_video_async(subreddit, title, video_path, cache, thumbnail_path=None, nsfw=False, spoiler=False,
+                             timeout=10, flair_id=None, flair_text=None):
+    """Async version of submit_video for an asyncpraw Subreddit"""
+    data = _media_submit_data(subreddit, title, nsfw, spoiler, flair_id, flair_text, kind="video")
+    thumbnail_path = thumbnail_path or _default_thumbnail(subreddit)
+    for attempt in range(2):
+        (video_url, video_cached), (poster_url, poster_cached) = await cache.upload_all_async(
+            subreddit, [(video_path, "video", "link"), (thumbnail_path, "image", "link")])
+        data.update(url=video_url, video_poster_url=poster_url)
+        try:
+            return await subreddit._submit_media(data=data, timeout=timeout, without_websockets=False)
+        except Exception as e:
+            if attempt or not (video_cached or poster_cached) or not is_asset_rejection(e):
+                raise
+            logger.warning(f"Cached media for {os.path.basename(video_path)} was rejected, uploading again")
+        cache.invalidate(cache.digest(video_path))
+        cache.invalidate(cache.digest(thumbnail_path))
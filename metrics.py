@@ -0,0 +1,377 @@
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+# Statuses prawcore retries on; a response with one of these inside a span counts as a retry
+RETRY_STATUSES = {500, 502, 503, 504, 520, 522}
+
+# Span the HTTP requests of the current thread or asyncio task are attributed to
+_current_span = contextvars.ContextVar('red_post_span', default=None)
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of a list of numbers, or 0.0 for an empty list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+def _body_size(kwargs):
+    """Estimate the bytes of a request body from the arguments passed to the HTTP session"""
+    data = kwargs.get('data')
+    if kwargs.get('json') is not None:
+        return len(json.dumps(kwargs['json']))
+    if data is None:
+        return 0
+    if isinstance(data, (bytes, str)):
+        return len(data)
+    return len(urlencode(data))
+
+class Span:
+    """
+    Timing and request counters of one unit of work (a submit, an upload, a comment, ...)
+
+    Used as a context manager. HTTP requests made inside it, in the same thread or asyncio
+    task, add their status, byte counts and retries to it.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, tracer, kind, name=None, **attrs):
+        self.tracer = tracer
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.id = next(Span._ids)
+        self.parent = None
+        self.start = None
+        self.duration = None
+        self.status = None
+        self.requests = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.error = None
+        self._token = None
+        self._started = None
+        self._last_failed = False
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent = parent.id if parent is not None else None
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.tracer.finish(self)
+        return False
+
+    def set(self, **attrs):
+        """Add attributes to the span, e.g. the byte count of an upload"""
+        for key, value in attrs.items():
+            if hasattr(self, key) and key not in ('tracer', 'attrs'):
+                setattr(self, key, value)
+            else:
+                self.attrs[key] = value
+
+    def add_response(self, status, bytes_sent=0, bytes_received=0):
+        """Count one HTTP request made inside the span; status is None for a connection error"""
+        self.requests += 1
+        if self._last_failed:
+            # The previous request failed, so this one retries it
+            self.retries += 1
+        self._last_failed = status is None or status == 429 or status in RETRY_STATUSES
+        if status is not None:
+            self.status = status
+        self.bytes_sent += bytes_sent
+        self.bytes_received += bytes_received
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'parent': self.parent,
+            'kind': self.kind,
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'status': self.status,
+            'requests': self.requests,
+            'retries': self.retries,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'error': self.error,
+            **self.attrs,
+        }
+
+class _NullSpan:
+    """Span handed out while tracing is disabled; does nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add_response(self, status, bytes_sent=0, bytes_received=0):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+class JsonlExporter:
+    """Appends every finished span as one JSON line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+
+    def export(self, span):
+        self._file.write(json.dumps(span.to_dict()) + '\n')
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def read_spans(path):
+    """Yield the spans a JsonlExporter wrote to a file, as dicts; nothing if the file does not exist"""
+    try:
+        f = open(path, 'r')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+class PrometheusExporter:
+    """
+    Aggregates spans into counters and writes them as a Prometheus textfile
+
+    Meant for node_exporter's textfile collector; the file is rewritten atomically on
+    every flush.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._counters = {}  # (metric, labels) -> value
+
+    def _inc(self, metric, labels, value=1):
+        key = (metric, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def export(self, span):
+        labels = {'kind': span.kind}
+        self._inc('red_post_spans_total', {**labels, 'outcome': 'error' if span.error else 'ok'})
+        self._inc('red_post_span_seconds_sum', labels, span.duration)
+        self._inc('red_post_span_seconds_count', labels)
+        self._inc('red_post_http_requests_total', labels, span.requests)
+        self._inc('red_post_http_retries_total', labels, span.retries)
+        self._inc('red_post_bytes_sent_total', labels, span.bytes_sent)
+        self._inc('red_post_bytes_received_total', labels, span.bytes_received)
+
+    def flush(self):
+        lines = []
+        for (metric, labels), value in sorted(self._counters.items()):
+            label_text = ','.join(f'{name}="{value_}"' for name, value_ in labels)
+            lines.append(f"{metric}{{{label_text}}} {value}")
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.flush()
+
+class Tracer:
+    """
+    Collects spans for every API job and hands them to exporters
+
+    While disabled, span() returns a shared no-op span, so instrumented code pays only
+    for one attribute check. Finished spans are kept for the summary table only while
+    `summarize` is set; exporters get them either way.
+    """
+
+    def __init__(self, enabled=False, exporters=None, summarize=None):
+        self.enabled = enabled
+        self.exporters = list(exporters or [])
+        self.summarize = enabled if summarize is None else summarize
+        self._lock = threading.Lock()
+        self._finished = []
+
+    def span(self, kind, name=None, **attrs):
+        """Return a context manager that times a unit of work"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, kind, name, **attrs)
+
+    def add(self, kind, duration, name=None, **attrs):
+        """Record a span measured elsewhere, e.g. time spent waiting for the rate limit"""
+        if not self.enabled:
+            return
+        span = Span(self, kind, name, **attrs)
+        span.start = time.time() - duration
+        span.duration = duration
+        self.finish(span)
+
+    def add_exporter(self, exporter):
+        """Start collecting spans for an exporter, without turning on the summary table"""
+        with self._lock:
+            self.exporters.append(exporter)
+            self.enabled = True
+
+    def finish(self, span):
+        with self._lock:
+            if self.summarize:
+                self._finished.append(span)
+            for exporter in self.exporters:
+                exporter.export(span)
+
+    def summary(self):
+        """
+        Aggregate the spans finished since the last summary, per kind
+
+        Returns:
+            list: Dicts with kind, count, errors, p50/p99/total seconds, requests, retries and bytes
+        """
+        with self._lock:
+            spans, self._finished = self._finished, []
+        by_kind = {}
+        for span in spans:
+            by_kind.setdefault(span.kind, []).append(span)
+        rows = []
+        for kind, kind_spans in by_kind.items():
+            durations = [span.duration for span in kind_spans]
+            rows.append({
+                'kind': kind,
+                'count': len(kind_spans),
+                'errors': sum(1 for span in kind_spans if span.error),
+                'p50': percentile(durations, 50),
+                'p99': percentile(durations, 99),
+                'total': sum(durations),
+                'requests': sum(span.requests for span in kind_spans),
+                'retries': sum(span.retries for span in kind_spans),
+                'bytes_sent': sum(span.bytes_sent for span in kind_spans),
+            })
+        return rows
+
+    def log_summary(self, log=None):
+        """Log a table of the spans finished since the last summary and flush the exporters"""
+        if not self.summarize:
+            return
+        log = log or logger
+        rows = self.summary()
+        self.flush()
+        if not rows:
+            return
+        lines = [f"{'kind':<8} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8} {'total s':>8} "
+                 f"{'requests':>8} {'retries':>7} {'bytes sent':>10}"]
+        for row in rows:
+            lines.append(f"{row['kind']:<8} {row['count']:>6} {row['errors']:>6} {row['p50'] * 1000:>8.1f} "
+                         f"{row['p99'] * 1000:>8.1f} {row['total']:>8.2f} {row['requests']:>8} "
+                         f"{row['retries']:>7} {row['bytes_sent']:>10}")
+        log.info("Timing summary:\n" + '\n'.join(lines))
+
+    def flush(self):
+        with self._lock:
+            for exporter in self.exporters:
+                exporter.flush()
+
+    def close(self):
+        with self._lock:
+            for exporter in self.exporters:
+                exporter.close()
+            self.exporters = []
+
+# Shared tracer used by the pipeline, the media upload and the HTTP requestors
+tracer = Tracer()
+
+def configure(enabled=None, jsonl_path=None, prometheus_path=None):
+    """
+    Enable the shared tracer and its exporters
+
+    Without arguments, reads RED_POST_METRICS (enable, prints the summary table),
+    RED_POST_TRACE_FILE (JSONL spans) and RED_POST_PROMETHEUS_FILE (Prometheus textfile).
+    Setting either file enables tracing.
+    """
+    jsonl_path = jsonl_path or os.getenv('RED_POST_TRACE_FILE')
+    prometheus_path = prometheus_path or os.getenv('RED_POST_PROMETHEUS_FILE')
+    if enabled is None:
+        enabled = os.getenv('RED_POST_METRICS', '').lower() in ('1', 'true', 'yes')
+    tracer.close()
+    if jsonl_path:
+        tracer.exporters.append(JsonlExporter(jsonl_path))
+    if prometheus_path:
+        tracer.exporters.append(PrometheusExporter(prometheus_path))
+    tracer.enabled = tracer.summarize = bool(enabled or tracer.exporters)
+    return tracer
+
+_requestor_class = None
+
+def tracing_requestor():
+    """Return a prawcore Requestor subclass that adds every request to the current span"""
+    global _requestor_class
+    if _requestor_class is None:
+        # Imported here so that importing metrics does not import prawcore
+        from prawcore import Requestor
+
+        class TracingRequestor(Requestor):
+            def request(self, *args, timeout=None, **kwargs):
+                span = _current_span.get()
+                if span is None:
+                    return super().request(*args, timeout=timeout, **kwargs)
+                try:
+                    response = super().request(*args, timeout=timeout, **kwargs)
+                except Exception:
+                    # Connection errors are retried by prawcore like server errors
+                    span.add_response(None)
+                    raise
+                received = response.headers.get('Content-Length')
+                span.add_response(response.status_code, _body_size(kwargs),
+                                  int(received) if received else len(response.content))
+                return response
+
+        _requestor_class = TracingRequestor
+    return _requestor_class
+
+_async_requestor_class = None
+
+def async_tracing_requestor():
+    """Return the asyncprawcore counterpart of tracing_requestor() (asyncpraw is optional)"""
+    global _async_requestor_class
+    if _async_requestor_class is None:
+        from asyncprawcore import Requestor as AsyncRequestor
+
+        class AsyncTracingRequestor(AsyncRequestor):
+            async def request(self, *args, timeout=None, **kwargs):
+                span = _current_span.get()
+                if span is None:
+                    return await super().request(*args, timeout=timeout, **kwargs)
+                try:
+                    response = await super().request(*args, timeout=timeout, **kwargs)
+                except Exception:
+                    span.add_response(None)
+                    raise
+                span.add_response(response.status, _body_size(kwargs), response.content_length or 0)
+                return response
+
+        _async_requestor_class = AsyncTracingRequestor
+    return _async_requestor_class
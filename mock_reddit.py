@@ -0,0 +1,499 @@
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Magic value from RFC 6455 used to answer a websocket handshake
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class MockReddit:
+    """
+    Local stand-in for the Reddit API, for offline benchmarks and end-to-end checks
+
+    Implements the endpoints the posting code uses: the OAuth token, `me`, submit, the
+    media asset lease, an S3-style upload target, the websocket that reports a finished
+    media post, submission lookup, comments, and subreddit info, post requirements and
+    flair choices (configurable per subreddit through `subreddits`). Every OAuth response carries
+    X-Ratelimit headers for a fixed window, and requests over the budget get a 429.
+
+    Failures can be injected at random (error_rate, api_error_rate) or on demand with
+    inject(), to exercise the error handling and retry paths.
+
+    Point the clients built from client.reddit_settings() at it with env(), e.g.:
+
+        with MockReddit(latency=0.02) as server:
+            os.environ.update(server.env())
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, upload_bandwidth=None,
+                 ratelimit=1000, window=600, error_rate=0.0, error_status=503, api_error_rate=0.0,
+                 api_error_wait=1, handshake=0.0, seed=None):
+        """
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on (default: 0, any free port)
+            latency (float): Seconds added to every response
+            jitter (float): Up to this many extra seconds added to every response, at random
+            upload_bandwidth (float): Upload speed in bytes per second (default: None, unlimited)
+            ratelimit (int): Requests allowed per window, as Reddit reports in X-Ratelimit headers
+            window (int): Length of the rate limit window in seconds
+            error_rate (float): Fraction of requests answered with error_status
+            error_status (int): HTTP status of injected errors (e.g. 500, 503)
+            api_error_rate (float): Fraction of submits and comments answered with a RATELIMIT API error
+            api_error_wait (int): Seconds the RATELIMIT errors ask to wait (praw itself retries up to 5)
+            handshake (float): Seconds added to the first response on every new connection, as
+                               a stand-in for the TCP and TLS setup of a real server
+            seed (int): Seed for the random latency and errors, for repeatable runs
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.upload_bandwidth = upload_bandwidth
+        self.ratelimit = ratelimit
+        self.window = window
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.api_error_rate = api_error_rate
+        self.api_error_wait = api_error_wait
+        self.handshake = handshake
+        self._random = random.Random(seed)
+        self._injected = {}  # endpoint -> list of (error, after) to answer the next requests with
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.submissions = {}
+        self.comments = {}
+        # Subreddit name -> overrides of its 'about' fields ('about': None for a missing
+        # subreddit), 'requirements' and 'flair_choices'
+        self.subreddits = {}
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Environment variables that point praw and asyncpraw at this server"""
+        return {
+            'REDDIT_OAUTH_URL': self.url,
+            'REDDIT_URL': self.url,
+            'praw_check_for_updates': 'False',
+            'REDDIT_CLIENT_ID': 'mock_client',
+            'REDDIT_CLIENT_SECRET': 'mock_secret',
+            'REDDIT_USERNAME': 'mock_user',
+            'REDDIT_PASSWORD': 'mock_password',
+            'REDDIT_USER_AGENT': 'red-post mock benchmark',
+            'REDDIT_UPLOAD_URL': self.url,
+        }
+
+    def reset_stats(self):
+        """Clear request counters and restart the rate limit window"""
+        with self._lock:
+            self.stats = {'requests': 0, 'connections': 0, 'bytes_uploaded': 0, 'ratelimited': 0, 'errors': 0,
+                          'endpoints': {}}
+            self._window_start = time.monotonic()
+            self._used = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def next_id(self):
+        return format(next(self._ids) + 36 ** 5, 'x')
+
+    def inject(self, endpoint, error=None, times=1, after=False):
+        """
+        Make the next requests to an endpoint fail
+
+        Args:
+            endpoint (str): Endpoint name as counted in stats, e.g. "submit", "comment", "upload"
+            error: HTTP status to answer with, or "RATELIMIT" for a Reddit API error
+                   (default: error_status)
+            times (int): Number of requests to fail
+            after (bool): Handle the request first and fail only the response, like a
+                          gateway timeout on a post Reddit did make
+        """
+        with self._lock:
+            self._injected.setdefault(endpoint, []).extend([(error or self.error_status, after)] * times)
+
+    def delay(self):
+        """Return the latency to add to one response"""
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def failure(self, endpoint):
+        """
+        Return (error, after) for a request: the error to answer with (an HTTP status or
+        "RATELIMIT", None for no error) and whether to handle the request first
+        """
+        with self._lock:
+            injected = self._injected.get(endpoint)
+            after = False
+            if injected:
+                error, after = injected.pop(0)
+            elif self.error_rate and self._random.random() < self.error_rate:
+                error = self.error_status
+            elif (self.api_error_rate and endpoint in ('submit', 'comment')
+                    and self._random.random() < self.api_error_rate):
+                error = "RATELIMIT"
+            else:
+                return None, False
+            self.stats['errors'] += 1
+            return error, after
+
+    def count(self, endpoint, uploaded=0):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_uploaded'] += uploaded
+            self.stats['endpoints'][endpoint] = self.stats['endpoints'].get(endpoint, 0) + 1
+
+    def connected(self):
+        with self._lock:
+            self.stats['connections'] += 1
+
+    def spend(self):
+        """Spend one request of the budget; returns (allowed, ratelimit headers)"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.window:
+                self._window_start, self._used = now, 0
+            allowed = self._used < self.ratelimit
+            if allowed:
+                self._used += 1
+            else:
+                self.stats['ratelimited'] += 1
+            headers = {
+                'x-ratelimit-remaining': str(float(self.ratelimit - self._used)),
+                'x-ratelimit-used': str(self._used),
+                'x-ratelimit-reset': str(int(self.window - (now - self._window_start))),
+            }
+        return allowed, headers
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, delayed ACKs add ~40ms per response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.mock.connected()
+        self._handshake_pending = bool(self.mock.handshake)
+
+    def handle_one_request(self):
+        if self._handshake_pending:
+            # Runs right after accept, so a client that connected ahead of time (pre-warmed) does not notice it
+            self._handshake_pending = False
+            time.sleep(self.mock.handshake)
+        super().handle_one_request()
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _form(self, body):
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    def _send(self, status, payload=b'', content_type='application/json', headers=None):
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            # Tell clients that pool connections not to reuse this one
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _oauth(self, endpoint, handler, *args):
+        """Answer an OAuth API request, applying latency, injected errors and the rate limit budget"""
+        self.mock.count(endpoint)
+        delay = self.mock.delay()
+        if delay:
+            time.sleep(delay)
+        allowed, headers = self.mock.spend()
+        if not allowed:
+            self._send(429, {'message': 'Too Many Requests', 'error': 429}, headers=headers)
+            return
+        error, after = self.mock.failure(endpoint)
+        if error and after:
+            handler(*args)
+        if error == "RATELIMIT":
+            self._send(200, {'json': {'errors': [
+                ['RATELIMIT', f"Looks like you've been doing that a lot. Take a break for "
+                              f"{self.mock.api_error_wait} seconds before trying again.", 'ratelimit']]}},
+                       headers=headers)
+        elif error:
+            self._send(error, {'message': 'Injected error', 'error': error}, headers=headers)
+        else:
+            status, payload = handler(*args)
+            self._send(status, payload, headers=headers)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip('/')
+        if path.startswith('/ws/'):
+            self._websocket(path.rsplit('/', 1)[1])
+        elif path == '/api/v1/me':
+            self._oauth('me', lambda: (200, {'name': 'mock_user', 'id': 'mockuser'}))
+        elif path.startswith('/comments/'):
+            self._oauth('info', self._submission_listing, path.split('/')[2])
+        elif path.startswith('/user/') and path.endswith('/submitted'):
+            self._oauth('user_submitted', self._user_submitted, parse_qs(parsed.query))
+        elif path == '/api/info' and 'id' in parse_qs(parsed.query):
+            self._oauth('things_info', self._things_info, parse_qs(parsed.query)['id'][0])
+        elif path == '/api/info':
+            self._oauth('subreddit_info', self._subreddit_info, parse_qs(parsed.query).get('sr_name', [''])[0])
+        elif path.startswith('/api/v1/') and path.endswith('/post_requirements'):
+            self._oauth('post_requirements', self._post_requirements, path.split('/')[3])
+        else:
+            self._send(404, {'message': 'Not Found', 'error': 404})
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip('/')
+        body = self._body()
+        if path == '/api/v1/access_token':
+            self.mock.count('access_token')
+            delay = self.mock.delay()
+            if delay:
+                time.sleep(delay)
+            self._send(200, {'access_token': 'mock_token', 'token_type': 'bearer',
+                             'expires_in': 86400, 'scope': '*'})
+        elif path == '/api/submit':
+            self._oauth('submit', self._submit, self._form(body))
+        elif path == '/api/submit_gallery_post.json':
+            self._oauth('submit', self._submit_gallery, json.loads(body or b'{}'))
+        elif path == '/api/media/asset.json':
+            self._oauth('media_asset', self._media_asset, self._form(body))
+        elif path == '/api/comment':
+            self._oauth('comment', self._comment, self._form(body))
+        elif path.startswith('/r/') and path.endswith('/api/flairselector'):
+            self._oauth('flairselector', self._flair_choices, path.split('/')[2])
+        elif path == '/upload':
+            self._upload(body)
+        else:
+            self._send(404, {'message': 'Not Found', 'error': 404})
+
+    def _submit(self, form):
+        submission_id = self.mock.next_id()
+        subreddit = form.get('sr', 'test')
+        permalink = f"/r/{subreddit}/comments/{submission_id}/mock_post/"
+        self.mock.submissions[submission_id] = {
+            'id': submission_id,
+            'name': f"t3_{submission_id}",
+            'title': form.get('title', ''),
+            'selftext': form.get('text', ''),
+            'subreddit': subreddit,
+            'link_flair_template_id': form.get('flair_id'),
+            'link_flair_text': form.get('flair_text'),
+            'author': 'mock_user',
+            'permalink': permalink,
+            'url': form.get('url') or f"https://www.reddit.com{permalink}",
+            'is_self': form.get('kind') == 'self',
+            'created_utc': time.time(),
+            'score': 1,
+            'num_comments': 0,
+            'removed_by_category': None,
+        }
+        if form.get('kind') in ('image', 'video', 'videogif'):
+            host, port = self.server.server_address[:2]
+            return 200, {'json': {'errors': [], 'data': {
+                'user_submitted_page': 'https://www.reddit.com/user/mock_user/submitted/',
+                'websocket_url': f"ws://{host}:{port}/ws/{submission_id}",
+            }}}
+        return 200, {'json': {'errors': [], 'data': {
+            'id': submission_id,
+            'name': f"t3_{submission_id}",
+            'url': f"https://www.reddit.com{permalink}",
+            'drafts_count': 0,
+        }}}
+
+    def _submit_gallery(self, data):
+        """Gallery posts are sent as JSON and answered with the post URL, like text and link posts"""
+        return self._submit({'sr': data.get('sr', 'test'), 'title': data.get('title', ''), 'kind': 'gallery',
+                             'url': None})
+
+    def _media_asset(self, form):
+        asset_id = self.mock.next_id()
+        key = f"{asset_id}/{form.get('filepath', 'image.jpg')}"
+        return 200, {
+            'args': {
+                'action': f"{self.mock.url}/upload",
+                'fields': [{'name': 'key', 'value': key}, {'name': 'acl', 'value': 'public-read'}],
+            },
+            'asset': {'asset_id': asset_id, 'payload': {'filepath': form.get('filepath')},
+                      'websocket_url': f"ws://mock/assets/{asset_id}"},
+        }
+
+    def _upload(self, body):
+        self.mock.count('upload', uploaded=len(body))
+        delay = self.mock.delay()
+        if self.mock.upload_bandwidth:
+            delay += len(body) / self.mock.upload_bandwidth
+        if delay:
+            time.sleep(delay)
+        error, _ = self.mock.failure('upload')
+        if error:
+            self._send(error if isinstance(error, int) else 500, b'<?xml version="1.0" encoding="UTF-8"?><Error>'
+                       b'<Code>InternalError</Code><Message>Injected error</Message></Error>',
+                       content_type='application/xml')
+            return
+        self._send(201, b'<?xml version="1.0" encoding="UTF-8"?><PostResponse><Location>mock</Location>'
+                        b'</PostResponse>', content_type='application/xml')
+
+    def _comment(self, form):
+        comment_id = self.mock.next_id()
+        parent = form.get('thing_id', 't3_unknown')
+        submission = self.mock.submissions.get(parent.split('_', 1)[1], {})
+        data = {
+            'id': comment_id,
+            'name': f"t1_{comment_id}",
+            'body': form.get('text', ''),
+            'author': 'mock_user',
+            'link_id': parent,
+            'parent_id': parent,
+            'subreddit': submission.get('subreddit', 'test'),
+            'permalink': f"{submission.get('permalink', '/')}{comment_id}/",
+            'created_utc': time.time(),
+            'score': 1,
+            'replies': '',
+        }
+        self.mock.comments[comment_id] = data
+        return 200, {'json': {'errors': [], 'data': {'things': [{'kind': 't1', 'data': data}]}}}
+
+    def _submission_listing(self, submission_id):
+        submission = self.mock.submissions.get(submission_id)
+        if submission is None:
+            return 404, {'message': 'Not Found', 'error': 404}
+        listing = {'kind': 'Listing', 'data': {'children': [{'kind': 't3', 'data': submission}],
+                                               'after': None, 'before': None}}
+        comments = {'kind': 'Listing', 'data': {'children': [], 'after': None, 'before': None}}
+        return 200, [listing, comments]
+
+    def _user_submitted(self, query):
+        """Page through the submissions made so far, newest first"""
+        submissions = sorted(self.mock.submissions.values(), key=lambda submission: submission['created_utc'],
+                             reverse=True)
+        names = [submission['name'] for submission in submissions]
+        after = query.get('after', [None])[0]
+        start = names.index(after) + 1 if after in names else 0
+        page = submissions[start:start + int(query.get('limit', ['25'])[0])]
+        more = start + len(page) < len(submissions)
+        return 200, {'kind': 'Listing', 'data': {
+            'children': [{'kind': 't3', 'data': submission} for submission in page],
+            'after': page[-1]['name'] if page and more else None, 'before': None}}
+
+    def _things_info(self, fullnames):
+        """Submissions and comments by fullname; unknown ones are left out, like Reddit does"""
+        children = []
+        for fullname in filter(None, fullnames.split(',')):
+            prefix, _, thing_id = fullname.partition('_')
+            things = self.mock.submissions if prefix == 't3' else self.mock.comments
+            if thing_id in things:
+                children.append({'kind': prefix, 'data': things[thing_id]})
+        return 200, {'kind': 'Listing', 'data': {'children': children, 'after': None, 'before': None}}
+
+    def _subreddit_info(self, names):
+        children = []
+        for name in filter(None, names.split(',')):
+            overrides = self.mock.subreddits.get(name, {})
+            if 'about' in overrides and overrides['about'] is None:
+                continue
+            about = {'display_name': name, 'name': f"t5_{name}", 'id': name, 'subreddit_type': 'public',
+                     'submission_type': 'any', 'allow_images': True, 'allow_galleries': True, 'allow_videos': True,
+                     **overrides.get('about', {})}
+            children.append({'kind': 't5', 'data': about})
+        return 200, {'kind': 'Listing', 'data': {'children': children, 'after': None, 'before': None}}
+
+    def _post_requirements(self, name):
+        requirements = {'title_text_min_length': None, 'title_text_max_length': 300, 'is_flair_required': False,
+                        'body_restriction_policy': 'none', 'domain_blacklist': [], 'domain_whitelist': [],
+                        'title_required_strings': [], 'title_blacklisted_strings': [], 'title_regexes': [],
+                        'body_blacklisted_strings': [], 'body_required_strings': []}
+        requirements.update(self.mock.subreddits.get(name, {}).get('requirements', {}))
+        return 200, requirements
+
+    def _flair_choices(self, name):
+        return 200, {'choices': self.mock.subreddits.get(name, {}).get('flair_choices', [])}
+
+    def _websocket(self, submission_id):
+        """Accept the websocket and report the media post as finished, like Reddit does"""
+        self.mock.count('websocket')
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+
+        submission = self.mock.submissions.get(submission_id, {})
+        message = json.dumps({'type': 'success', 'payload': {
+            'redirect': f"https://www.reddit.com{submission.get('permalink', '/')}"}}).encode()
+        if len(message) < 126:
+            header = bytes([0x81, len(message)])
+        else:
+            header = bytes([0x81, 126]) + len(message).to_bytes(2, 'big')
+        self.wfile.write(header + message + bytes([0x88, 0x00]))
+        self.wfile.flush()
+        self.close_connection = True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local mock of the Reddit API")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra seconds added to every response")
+    parser.add_argument('--ratelimit', type=int, default=1000, help="Requests per rate limit window")
+    parser.add_argument('--window', type=int, default=600, help="Length of the rate limit window in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument('--error-status', type=int, default=503, help="HTTP status of injected errors")
+    parser.add_argument('--api-error-rate', type=float, default=0.0,
+                        help="Fraction of submits and comments that get a RATELIMIT error")
+    parser.add_argument('--api-error-wait', type=int, default=1, help="Seconds the RATELIMIT errors ask to wait")
+    parser.add_argument('--handshake', type=float, default=0.0, help="Seconds added to each new connection")
+    args = parser.parse_args()
+
+    server = MockReddit(port=args.port, latency=args.latency, jitter=args.jitter, ratelimit=args.ratelimit,
+                        window=args.window, error_rate=args.error_rate, error_status=args.error_status,
+                        api_error_rate=args.api_error_rate, api_error_wait=args.api_error_wait,
+                        handshake=args.handshake)
+    print(f"Mock Reddit API listening on {server.url}")
+    for name, value in server.env().items():
+        print(f"export {name}='{value}'")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
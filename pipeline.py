@@ -0,0 +1,404 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import events
+from journal import FAILED, IN_FLIGHT, PLANNED, SUCCEEDED
+import metrics
+from retry import UNSAFE_KINDS, RetryPolicy, single_attempt
+
+logger = logging.getLogger(__name__)
+
+class Job:
+    """
+    A single API action (a submission, a comment, ...) run by the pipeline
+
+    `action` is called with no arguments and returns the result. `on_success(job, result)`
+    and `on_failure(job, exception)` are called afterwards; on_success may add follow-up
+    jobs to the pipeline, e.g. the comment for a new submission. A job with `not_before`
+    (a timestamp on the scheduler's clock) is held back until then. on_failure is only
+    called once the pipeline's retry policy gives up on the job.
+
+    `verify(since)` finds out whether an earlier attempt went through after all: it is
+    called instead of retrying blindly once a job is `unconfirmed` (see RetryPolicy), with
+    the time of the first attempt, and returns what that attempt created, or None.
+    """
+
+    _counter = itertools.count()
+
+    def __init__(self, kind, name, action, cost=1, on_success=None, on_failure=None, not_before=None, verify=None):
+        self.kind = kind
+        self.name = name
+        self.action = action
+        self.cost = cost
+        self.on_success = on_success
+        self.on_failure = on_failure
+        self.not_before = not_before
+        self.verify = verify
+        self.attempts = 0
+        self.first_attempt = None
+        self.unconfirmed = False
+        self.seq = next(Job._counter)
+
+    def __repr__(self):
+        return f"Job({self.kind!r}, {self.name!r})"
+
+class Pipeline:
+    """
+    Runs jobs as soon as the rate limit scheduler allows, interleaving kinds
+
+    Jobs of the same kind run in the order they were added. Between kinds, the job that
+    can run soonest goes first, so a comment does not have to wait for the remaining
+    submissions when only the submissions are blocked. Jobs with a `not_before` time wait
+    aside until it passes, so they do not hold up the jobs that are ready.
+    """
+
+    def __init__(self, scheduler, on_wait=None, journal=None, run_id=None, retry_policy=None, event_bus=None,
+                 cancel=None, tracer=None):
+        """
+        Args:
+            scheduler (RateLimitScheduler): Decides when each kind of job may run
+            on_wait (callable): Called with (job, seconds) before waiting for a job
+            journal (Journal): Optional journal that records every job state change
+            run_id (str): Run the journal records belong to (required with a journal)
+            retry_policy (RetryPolicy): Decides which failed jobs run again (default: RetryPolicy())
+            event_bus (EventBus): Optional bus that gets an event for every job state change
+            cancel (threading.Event): Once set, no more jobs are started; the ones left stay
+                planned in the journal, so the run can be resumed
+            tracer (Tracer): Gets a span per job and per wait (default: the shared metrics.tracer)
+        """
+        self.scheduler = scheduler
+        self.on_wait = on_wait
+        self.journal = journal
+        self.run_id = run_id
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.event_bus = event_bus
+        self.cancel = cancel
+        self.tracer = tracer or metrics.tracer
+        self._queues = {}
+        self._deferred = []  # heap of (not_before, seq, job)
+        self._source = None
+        self._max_pending = None
+
+    def _record(self, job, state, **fields):
+        if self.journal is not None:
+            self.journal.record(self.run_id, job.kind, job.name, state, **fields)
+
+    def _publish(self, event, job, **fields):
+        if self.event_bus is not None:
+            self.event_bus.publish_job(event, job, **fields)
+
+    def _waiting(self, job, seconds):
+        """Report that the pipeline waits `seconds` before it can run a job"""
+        self._publish(events.WAITING, job, seconds=seconds)
+        if self.on_wait:
+            self.on_wait(job, seconds)
+
+    def add(self, job):
+        """Queue a job behind the other jobs of its kind, or aside until its not_before time"""
+        if job.not_before is not None and job.not_before > self.scheduler.clock.time():
+            heapq.heappush(self._deferred, (job.not_before, job.seq, job))
+        else:
+            self._queues.setdefault(job.kind, deque()).append(job)
+        self._record(job, PLANNED)
+        self._publish(events.QUEUED, job, not_before=job.not_before)
+
+    def feed(self, jobs, max_pending=100):
+        """
+        Add jobs from an iterable lazily while running
+
+        Jobs are pulled only while fewer than max_pending jobs are waiting, so a long
+        generator (e.g. a streamed manifest) runs in bounded memory.
+        """
+        self._source = iter(jobs)
+        self._max_pending = max_pending
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values()) + len(self._deferred)
+
+    def _refill(self):
+        """Pull jobs from the fed iterable and queue the deferred jobs that are due"""
+        while self._source is not None and len(self) < self._max_pending:
+            job = next(self._source, None)
+            if job is None:
+                self._source = None
+            else:
+                self.add(job)
+        now = self.scheduler.clock.time()
+        while self._deferred and self._deferred[0][0] <= now:
+            _, _, job = heapq.heappop(self._deferred)
+            self._queues.setdefault(job.kind, deque()).append(job)
+
+    def _cancelled(self):
+        """Return True if the run was cancelled, dropping the jobs that have not started"""
+        if self.cancel is None or not self.cancel.is_set():
+            return False
+        if self._source is not None or len(self):
+            logger.info(f"Run cancelled, {len(self)} queued jobs not started")
+            self._queues.clear()
+            self._deferred.clear()
+            self._source = None
+        return True
+
+    def _deferred_delay(self):
+        """Return (seconds, job) until the next deferred job is due, or (None, None)"""
+        if not self._deferred:
+            return None, None
+        not_before, _, job = self._deferred[0]
+        return not_before - self.scheduler.clock.time(), job
+
+    def _failed(self, job, exception):
+        """Queue a failed job again if the retry policy allows, otherwise report the failure"""
+        self.scheduler.penalize(job.kind, exception)
+        error_class, delay = self.retry_policy.retry_delay(job, exception)
+        if delay is not None:
+            logger.warning(f"{job.kind} job for {job.name} failed ({error_class}: {exception}), "
+                           f"retrying in {delay:.0f} seconds")
+            job.not_before = self.scheduler.clock.time() + delay
+            self.add(job)
+            self._publish(events.RETRYING, job, seconds=delay, error=str(exception), error_class=error_class)
+            return
+        self._record(job, FAILED, error=str(exception), error_class=error_class, first_attempt=job.first_attempt)
+        self._publish(events.FAILED, job, error=str(exception), error_class=error_class)
+        if job.on_failure:
+            job.on_failure(job, exception)
+        else:
+            logger.error(f"{job.kind} job for {job.name} failed: {exception}")
+
+    def _attempt(self, job):
+        """Count an attempt of a job that is about to run"""
+        job.attempts += 1
+        if job.first_attempt is None:
+            # Wall time, not the scheduler's clock: verify() compares it with Reddit's created_utc
+            job.first_attempt = time.time()
+
+    def _call(self, job):
+        """Run a job's action, unless an earlier attempt turns out to have gone through"""
+        if job.unconfirmed and job.verify is not None:
+            result = job.verify(job.first_attempt)
+            if result is not None:
+                logger.info(f"{job.kind} job for {job.name} went through before it failed, not running it again")
+                return result
+        if job.kind not in UNSAFE_KINDS:
+            return job.action()
+        with single_attempt():
+            return job.action()
+
+    def _succeeded(self, job, result):
+        self._record(job, SUCCEEDED, id=getattr(result, 'id', None))
+        self._publish(events.SUCCEEDED, job, id=getattr(result, 'id', None))
+        if job.on_success:
+            job.on_success(job, result)
+
+    def _peek(self):
+        """Return (delay, queue) for the queue whose head job can run soonest, or (None, None)"""
+        best = None
+        for queue in self._queues.values():
+            if not queue:
+                continue
+            job = queue[0]
+            key = (max(0, self.scheduler.delay_for(job.kind, job.cost)), job.seq)
+            if best is None or key < best[0]:
+                best = (key, queue)
+        return (best[0][0], best[1]) if best else (None, None)
+
+    def _next_job(self):
+        _, queue = self._peek()
+        return queue.popleft() if queue else None
+
+    def run(self):
+        """Run jobs until the queue is empty, including jobs added while running"""
+        while True:
+            if self._cancelled():
+                return
+            self.scheduler.observe()
+            self._refill()
+            job = self._next_job()
+            if job is None:
+                delay, job = self._deferred_delay()
+                if job is None:
+                    return
+                self._waiting(job, delay)
+                self.scheduler.clock.sleep(delay)
+                self.tracer.add("wait", delay, name=job.name, waiting_for=job.kind)
+                continue
+            on_wait = (lambda seconds: self._waiting(job, seconds)) if self.on_wait or self.event_bus else None
+            waited = self.scheduler.wait(job.kind, job.cost, on_wait=on_wait)
+            if waited:
+                self.tracer.add("wait", waited, name=job.name, waiting_for=job.kind)
+            if self._cancelled():
+                return
+            self._record(job, IN_FLIGHT)
+            self._attempt(job)
+            try:
+                with self.tracer.span(job.kind, name=job.name) as span:
+                    self._publish(events.RUNNING, job, span=getattr(span, 'id', None))
+                    result = self._call(job)
+            except Exception as e:
+                self._failed(job, e)
+                continue
+            self.scheduler.dispatched(job.kind, job.cost)
+            self._succeeded(job, result)
+
+class AsyncPipeline(Pipeline):
+    """
+    Pipeline for asyncio jobs whose actions are coroutine functions
+
+    Up to `concurrency` jobs are in flight at once. The rate limit budget is reserved
+    when a job is dispatched and released when it finishes, so concurrent jobs never
+    overspend it.
+    """
+
+    def __init__(self, scheduler, concurrency=8, on_wait=None, journal=None, run_id=None, retry_policy=None,
+                 event_bus=None, cancel=None, tracer=None):
+        super().__init__(scheduler, on_wait=on_wait, journal=journal, run_id=run_id, retry_policy=retry_policy,
+                         event_bus=event_bus, cancel=cancel, tracer=tracer)
+        self.concurrency = concurrency
+
+    async def _call(self, job):
+        if job.unconfirmed and job.verify is not None:
+            result = await job.verify(job.first_attempt)
+            if result is not None:
+                logger.info(f"{job.kind} job for {job.name} went through before it failed, not running it again")
+                return result
+        if job.kind not in UNSAFE_KINDS:
+            return await job.action()
+        with single_attempt():
+            return await job.action()
+
+    async def _run_job(self, job):
+        self._attempt(job)
+        try:
+            try:
+                with self.tracer.span(job.kind, name=job.name) as span:
+                    self._publish(events.RUNNING, job, span=getattr(span, 'id', None))
+                    result = await self._call(job)
+            finally:
+                self.scheduler.release(job.kind, job.cost)
+        except Exception as e:
+            self._failed(job, e)
+            return
+        self._succeeded(job, result)
+
+    async def run(self):
+        """Run jobs until the queue is empty and nothing is in flight"""
+        in_flight = set()
+        announced = None
+        announced_at = None
+        while True:
+            if self._cancelled() and not in_flight:
+                return
+            self.scheduler.observe()
+            self._refill()
+            delay, queue = self._peek()
+            if queue is None or len(in_flight) >= self.concurrency or delay > 0:
+                deferred_delay, deferred = self._deferred_delay()
+                if queue is None and not in_flight and deferred is None:
+                    return
+                if queue is not None and delay > 0:
+                    waiting, wait = queue[0], delay
+                else:
+                    # Only deferred jobs are left to start
+                    waiting, wait = (deferred, deferred_delay) if queue is None and not in_flight else (None, None)
+                if waiting is not None and waiting is not announced:
+                    announced, announced_at = waiting, time.perf_counter()
+                    self._waiting(announced, wait)
+                # Wake up when the next job may run or is due, or a running job finishes (and may add jobs)
+                timeouts = [deferred_delay] if deferred is not None else []
+                if queue is not None and len(in_flight) < self.concurrency:
+                    timeouts.append(delay)
+                timeout = max(0, min(timeouts)) if timeouts else None
+                if in_flight:
+                    done, in_flight = await asyncio.wait(in_flight, timeout=timeout,
+                                                         return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(timeout)
+                continue
+
+            job = queue.popleft()
+            if job is announced:
+                self.tracer.add("wait", time.perf_counter() - announced_at, name=job.name, waiting_for=job.kind)
+            self.scheduler.acquire(job.kind, job.cost)
+            self._record(job, IN_FLIGHT)
+            in_flight.add(asyncio.ensure_future(self._run_job(job)))
+
+class ThreadedPipeline(Pipeline):
+    """
+    Pipeline that runs up to `concurrency` blocking jobs at once on worker threads
+
+    Gives the sync (praw) client the overlap of the async backend without an event loop.
+    Only the job actions run on the workers; jobs are dispatched and their callbacks run
+    on the thread calling run(), so on_success and on_failure need no locking. As in
+    AsyncPipeline, the rate limit budget is reserved when a job is dispatched and
+    released when it finishes.
+    """
+
+    def __init__(self, scheduler, concurrency=8, on_wait=None, journal=None, run_id=None, retry_policy=None,
+                 event_bus=None, cancel=None, tracer=None):
+        super().__init__(scheduler, on_wait=on_wait, journal=journal, run_id=run_id, retry_policy=retry_policy,
+                         event_bus=event_bus, cancel=cancel, tracer=tracer)
+        self.concurrency = concurrency
+
+    def _execute(self, job):
+        # Runs on a worker thread; the span is opened there so the job's requests nest in it
+        with self.tracer.span(job.kind, name=job.name) as span:
+            self._publish(events.RUNNING, job, span=getattr(span, 'id', None))
+            return self._call(job)
+
+    def _finish(self, job, future):
+        self.scheduler.release(job.kind, job.cost)
+        exception = future.exception()
+        if exception is not None:
+            self._failed(job, exception)
+        else:
+            self._succeeded(job, future.result())
+
+    def run(self):
+        """Run jobs until the queue is empty and nothing is in flight"""
+        in_flight = {}  # future -> job
+        announced = None
+        announced_at = None
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="red-post-job") as workers:
+            while True:
+                if self._cancelled() and not in_flight:
+                    return
+                self.scheduler.observe()
+                self._refill()
+                delay, queue = self._peek()
+                if queue is not None and len(in_flight) < self.concurrency and delay <= 0:
+                    job = queue.popleft()
+                    if job is announced:
+                        self.tracer.add("wait", time.perf_counter() - announced_at, name=job.name, waiting_for=job.kind)
+                    self.scheduler.acquire(job.kind, job.cost)
+                    self._record(job, IN_FLIGHT)
+                    self._attempt(job)
+                    in_flight[workers.submit(self._execute, job)] = job
+                    continue
+
+                deferred_delay, deferred = self._deferred_delay()
+                if queue is None and not in_flight and deferred is None:
+                    return
+                if queue is not None and delay > 0:
+                    waiting, seconds = queue[0], delay
+                elif queue is None and not in_flight:
+                    waiting, seconds = deferred, deferred_delay
+                else:
+                    waiting = None
+                if waiting is not None and waiting is not announced:
+                    announced, announced_at = waiting, time.perf_counter()
+                    self._waiting(announced, seconds)
+                # Wake up when the next job may run or is due, or a running job finishes (and may add jobs)
+                timeouts = [deferred_delay] if deferred is not None else []
+                if queue is not None and len(in_flight) < self.concurrency:
+                    timeouts.append(delay)
+                timeout = max(0, min(timeouts)) if timeouts else None
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(in_flight.pop(future), future)
+                else:
+                    self.scheduler.clock.sleep(timeout)
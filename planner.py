@@ -0,0 +1,352 @@
+"""
+Dry-run planning: what a run would send and how long it would take, without sending anything
+
+The planner walks the same steps as PostingEngine, but only against local state: cached
+subreddit rules reject what the run would reject, the repost index drops reposts and the
+media cache says which files still need uploading. The jobs that are left go through a
+real Pipeline and RateLimitScheduler on a FakeClock, so rate limit waits, minimum delays
+and campaign start times come out the way a run would see them; each job advances the
+clock by the latency measured in earlier runs (see LatencyHistory).
+
+    plan = RunPlanner(engine).plan([single_post("title", "", ["test", "pics"], comment_text="hi")])
+    print(format_plan(plan))
+"""
+import logging
+import os
+import time
+
+from engine import EXECUTORS
+from metrics import Tracer, percentile, read_spans
+from pipeline import Job, Pipeline
+from scheduler import FakeClock, RateLimitScheduler
+from subreddit_rules import INFO_BATCH, check_post
+
+logger = logging.getLogger(__name__)
+
+# Reddit's OAuth rate limit: requests per window and its length in seconds, assumed while the budget is unknown
+RATELIMIT_BUDGET = 1000
+RATELIMIT_WINDOW = 600
+
+# Seconds per job, and upload bytes per second, assumed until earlier runs were measured
+DEFAULT_LATENCIES = {"submit": 1.5, "comment": 0.7}
+DEFAULT_UPLOAD_RATE = 1024 * 1024
+
+# Jobs format_plan lists from the start of the schedule; the last one is always shown
+SCHEDULE_LINES = 15
+
+class LatencyHistory:
+    """
+    Job latencies and upload throughput measured in earlier runs
+
+    Job durations come from the journal (from going in flight to succeeding, by job kind
+    and post type) and, when a trace file is kept, from its spans, which also give the
+    upload throughput. Medians are used, so a few slow or retried jobs don't skew the
+    estimate. A comment is a single request, so its latency stands in for any other API
+    request (rules fetches, upload leases).
+    """
+
+    def __init__(self, durations=None, spans=None):
+        """
+        Args:
+            durations (dict): (kind, post_type) -> list of seconds, as from Journal.durations()
+            spans (iterable): Span dicts, as from metrics.read_spans()
+        """
+        self.durations = durations or {}
+        self.span_durations = {}
+        upload_bytes = upload_seconds = 0
+        for span in spans or ():
+            if span.get('error') or not span.get('duration'):
+                continue
+            self.span_durations.setdefault(span['kind'], []).append(span['duration'])
+            if span['kind'] == "upload":
+                upload_bytes += span.get('bytes_sent') or 0
+                upload_seconds += span['duration']
+        self.upload_rate = upload_bytes / upload_seconds if upload_bytes else DEFAULT_UPLOAD_RATE
+
+    @classmethod
+    def load(cls, journal=None, trace_path=None):
+        """
+        Read the history of a journal and a trace file
+
+        Args:
+            journal (Journal): Journal of earlier runs (default: None, no job durations)
+            trace_path (str): JSONL span file (default: RED_POST_TRACE_FILE, if set)
+        """
+        trace_path = trace_path or os.getenv('RED_POST_TRACE_FILE')
+        return cls(journal.durations() if journal is not None else None,
+                   read_spans(trace_path) if trace_path else None)
+
+    def latency(self, kind, post_type=None):
+        """Return the median seconds of a job kind, preferring jobs of the same post type"""
+        samples = self.durations.get((kind, post_type))
+        if not samples:
+            samples = [seconds for (sample_kind, _), values in self.durations.items() if sample_kind == kind
+                       for seconds in values]
+        if not samples:
+            samples = self.span_durations.get(kind)
+        return percentile(samples, 50) if samples else DEFAULT_LATENCIES[kind]
+
+    def request_latency(self):
+        """Return the median seconds of one API request"""
+        return self.latency("comment")
+
+    def describe(self):
+        """Return where the latencies come from, for the plan summary"""
+        jobs = sum(len(values) for values in self.durations.values())
+        spans = sum(len(values) for values in self.span_durations.values())
+        if not jobs and not spans:
+            return "defaults, no earlier runs measured"
+        return f"{jobs} journaled jobs and {spans} trace spans"
+
+class _PlannedScheduler(RateLimitScheduler):
+    """Scheduler on a fake clock whose budget refills at the end of every window, like Reddit's"""
+
+    def __init__(self, clock, min_intervals=None, budget=RATELIMIT_BUDGET):
+        super().__init__(clock=clock, min_intervals=min_intervals)
+        self.budget = budget
+
+    def observe(self):
+        with self._lock:
+            if self.reset_at is not None and self.clock.time() >= self.reset_at:
+                self.update(self.budget, 0, RATELIMIT_WINDOW)
+
+class _PlannedResult:
+    id = None
+
+def single_post(title, content, subreddit_list, comment_text=None, post_type="text", url=None, image_path=None,
+                image_paths=None, video_path=None, delay=None, comment_delay=None):
+    """Return the post dict of a post_and_comment run, to plan it; the arguments are those of post_and_comment"""
+    return {
+        "row": None,
+        "post_type": post_type,
+        "title": title,
+        "content": content,
+        "url": url,
+        "image_path": image_path,
+        "image_paths": list(image_paths) if image_paths else None,
+        "video_path": video_path,
+        "comment_text": comment_text,
+        "subreddits": list(subreddit_list),
+        "earliest": None,
+        "delay": delay,
+        "comment_delay": comment_delay,
+    }
+
+class RunPlanner:
+    """
+    Estimates the API requests, uploads and duration of runs, without sending anything
+
+    Subreddits without cached rules can't be checked offline; they are counted as
+    accepted, and the requests that fetch their rules are part of the plan. Images that
+    were never prepared are counted at their original size, which is at most what
+    preparation leaves. With the threaded and async executors, jobs overlap up to the
+    executor's concurrency, which the plan models by dividing each job's latency by it.
+    """
+
+    def __init__(self, engine, history=None):
+        """
+        Args:
+            engine (PostingEngine): Engine whose caches, repost index and post types the run would use
+            history (LatencyHistory): Measured latencies (default: from the engine's journal and the trace file)
+        """
+        self.engine = engine
+        self.history = history if history is not None else LatencyHistory.load(engine.journal)
+
+    def plan(self, posts, scheduler=None, executor=None):
+        """
+        Plan a run of posts
+
+        Args:
+            posts (iterable): Post dicts as from campaign.read_manifest or single_post()
+            scheduler (RateLimitScheduler): Scheduler of the client the run would use; its rate
+                limit budget and minimum intervals are where the plan starts (default: a fresh
+                window of RATELIMIT_BUDGET requests)
+            executor (str): Executor the run would use (default: the engine's)
+
+        Returns:
+            dict: executor, posts and comments to make, rejected [(row, subreddit, reason)],
+            unchecked subreddits, api_calls by endpoint, uploads, cached_uploads, upload_bytes,
+            budget, budget_known, waits and duration in seconds, start timestamp, schedule
+            [(seconds from start, kind, subreddit)] and history (where the latencies come from)
+        """
+        engine = self.engine
+        executor = executor or engine.executor
+        concurrency = EXECUTORS[executor].concurrency
+        clock = FakeClock(time.time())
+        start = clock.time()
+        if scheduler is not None:
+            scheduler.observe()
+        budget_known = scheduler is not None and scheduler.remaining is not None and scheduler.reset_at is not None
+        planned = _PlannedScheduler(clock, min_intervals=scheduler.min_intervals if scheduler else None)
+        if budget_known:
+            # The requests of a window are what is left plus what was used of it
+            planned.budget = scheduler.remaining + (scheduler.used or 0)
+            planned.update(scheduler.remaining, scheduler.used,
+                           max(0, scheduler.reset_at - scheduler.clock.time()))
+        else:
+            planned.update(RATELIMIT_BUDGET, 0, RATELIMIT_WINDOW)
+        budget = planned.remaining
+        # Planning must leave no spans behind: they would show up in the run's metrics and skew later plans
+        pipeline = Pipeline(planned, tracer=Tracer())
+
+        result = {"executor": executor, "posts": 0, "comments": 0, "rejected": [], "unchecked": [],
+                  "api_calls": {"rules": 0, "upload": 0, "submit": 0, "comment": 0}, "uploads": 0,
+                  "cached_uploads": 0, "upload_bytes": 0, "budget": budget, "budget_known": budget_known,
+                  "start": start, "schedule": [], "history": self.history.describe()}
+        request = self.history.request_latency()
+        rules_seen = set()
+        media_seen = set()
+
+        def run_job(kind, name, seconds):
+            result["schedule"].append((clock.time() - start, kind, name))
+            result["api_calls"][kind] += 1
+            clock.advance(seconds / concurrency)
+            return _PlannedResult
+
+        def posted_callback(comment_text):
+            def posted(job, _):
+                result["posts"] += 1
+                if comment_text:
+                    pipeline.add(Job("comment", job.name,
+                                     lambda: run_job("comment", job.name, self.history.latency("comment")),
+                                     on_success=commented))
+            return posted
+
+        def commented(job, _):
+            result["comments"] += 1
+
+        def jobs():
+            for post in posts:
+                row = post.get("row")
+                error = engine.validate(post)
+                if error is None and not post["subreddits"]:
+                    error = "No target subreddits"
+                if error:
+                    result["rejected"].extend((row, name, error) for name in post["subreddits"] or [None])
+                    continue
+                if post.get("delay"):
+                    planned.min_intervals["submit"] = post["delay"]
+                if post.get("comment_delay"):
+                    planned.min_intervals["comment"] = post["comment_delay"]
+
+                post_type = engine.post_type(post["post_type"])
+                targets = self._targets(post, post_type, result, rules_seen)
+                # Fetching the rules of unknown subreddits is the first thing the run does for a post
+                stale = [name for name in targets if name.lower() not in rules_seen and
+                         engine.subreddit_rules.get(name) is None]
+                if stale:
+                    rules_seen.update(name.lower() for name in stale)
+                    calls = -(-len(stale) // INFO_BATCH) + len(stale)
+                    result["api_calls"]["rules"] += calls
+                    result["unchecked"].extend(stale)
+                    clock.advance(calls * request)
+                    planned.dispatched("rules", calls)
+                if not targets:
+                    continue
+
+                upload_seconds = self._upload_seconds(post, post_type, result, media_seen, request)
+                latency = self.history.latency("submit", post_type.name)
+                posted = posted_callback(post.get("comment_text"))
+                cost = post_type.cost(post)
+                for i, name in enumerate(targets):
+                    # The first submit of a post uploads its files; the others reuse the uploads
+                    seconds = latency + (upload_seconds if i == 0 else 0)
+                    yield Job("submit", name, lambda name=name, seconds=seconds: run_job("submit", name, seconds),
+                              cost=cost, on_success=posted, not_before=post.get("earliest"))
+
+        pipeline.feed(jobs())
+        pipeline.run()
+        result["duration"] = clock.time() - start
+        result["waits"] = sum(clock.sleeps)
+        return result
+
+    def _targets(self, post, post_type, result, rules_seen):
+        """Return the subreddits the run would post to; rejected ones are added to the result"""
+        engine = self.engine
+        targets = {}
+        for name in post["subreddits"]:
+            entry = engine.subreddit_rules.get(name)
+            if entry is None:
+                targets[name] = {"title": post["title"]}
+                continue
+            fields, _, error = check_post(entry, post_type.rules_type, post["title"], post.get("content"),
+                                          post.get("url"))
+            if error:
+                result["rejected"].append((post.get("row"), name, error))
+            else:
+                targets[name] = fields
+        if targets:
+            for name, earlier in engine.post_index.duplicates(targets, post_type.media_key(engine, post)).items():
+                posted_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(earlier['created']))
+                result["rejected"].append((post.get("row"), name, f"already posted as {earlier['id']} on {posted_at}"))
+                del targets[name]
+        return targets
+
+    def _upload_seconds(self, post, post_type, result, media_seen, request):
+        """Count the uploads a post needs and return the seconds they take, up to upload_workers at a time"""
+        media_cache = self.engine.media_cache
+        sizes = []
+        for media_path, upload_type in post_type.uploads(self.engine, post):
+            key = (upload_type, media_cache.digest(media_path))
+            if key in media_seen:
+                continue
+            media_seen.add(key)
+            if media_cache.get(key[1], upload_type) is not None:
+                result["cached_uploads"] += 1
+            else:
+                sizes.append(os.path.getsize(media_path))
+        if not sizes:
+            return 0
+        result["uploads"] += len(sizes)
+        result["upload_bytes"] += sum(sizes)
+        # Every upload asks for a lease first
+        result["api_calls"]["upload"] += len(sizes)
+        seconds = len(sizes) * request + sum(sizes) / self.history.upload_rate
+        return seconds / min(len(sizes), media_cache.upload_workers)
+
+def _format_seconds(seconds):
+    if seconds >= 3600:
+        return f"{int(seconds // 3600)}h {int(seconds % 3600 // 60):02d}m"
+    if seconds >= 60:
+        return f"{int(seconds // 60)}m {int(seconds % 60):02d}s"
+    return f"{seconds:.1f}s"
+
+def _format_bytes(size):
+    if size >= 1024 * 1024:
+        return f"{size / 1024 / 1024:.1f} MB"
+    return f"{size / 1024:.0f} KB"
+
+def format_plan(plan):
+    """Return a plan as text for the log or a dialog"""
+    calls = plan["api_calls"]
+    finish = time.strftime('%H:%M', time.localtime(plan["start"] + plan["duration"]))
+    budget = (f"{plan['budget']:.0f} requests left" if plan["budget_known"]
+              else f"unknown, assuming a fresh window of {plan['budget']:.0f} requests")
+    lines = [
+        f"Plan for {plan['posts']} posts and {plan['comments']} comments on the {plan['executor']} executor "
+        f"(nothing was sent):",
+        f"  API requests: {sum(calls.values())} (rules {calls['rules']}, upload leases {calls['upload']}, "
+        f"submits {calls['submit']}, comments {calls['comment']})",
+        f"  Uploads: {plan['uploads']} files, {_format_bytes(plan['upload_bytes'])} "
+        f"({plan['cached_uploads']} reused from the media cache)",
+        f"  Rate limit budget: {budget}",
+        f"  Estimated duration: {_format_seconds(plan['duration'])}, {_format_seconds(plan['waits'])} of it "
+        f"waiting for the rate limit, delays or start times; done around {finish}",
+        f"  Latencies from: {plan['history']}",
+    ]
+    for row, name, reason in plan["rejected"]:
+        where = f"row {row}" if row is not None else "post"
+        lines.append(f"  Not posting {where} to r/{name}: {reason}" if name else f"  Skipping {where}: {reason}")
+    if plan["unchecked"]:
+        lines.append(f"  No cached rules, checked when the run starts: {', '.join(plan['unchecked'])}")
+    schedule = plan["schedule"]
+    if schedule:
+        lines.append("  Schedule:")
+        shown = schedule if len(schedule) <= SCHEDULE_LINES + 1 else schedule[:SCHEDULE_LINES] + [None, schedule[-1]]
+        for entry in shown:
+            if entry is None:
+                lines.append(f"    ... {len(schedule) - SCHEDULE_LINES - 1} more jobs")
+                continue
+            offset, kind, name = entry
+            lines.append(f"    +{_format_seconds(offset):>8}  {kind:<8} r/{name}")
+    return '\n'.join(lines)
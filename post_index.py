@@ -0,0 +1,291 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from urllib.parse import urlsplit, urlunsplit
+
+from media_cache import file_digest
+from storage import state_path
+
+logger = logging.getLogger(__name__)
+
+# Days within which the same post to the same subreddit counts as a repost; 0 turns the check off
+DEFAULT_REPOST_WINDOW = float(os.getenv('RED_POST_REPOST_WINDOW') or 30)
+
+# Per-subreddit windows in days overriding the default, e.g. "pics=7,art=90"
+REPOST_WINDOWS = os.getenv('RED_POST_REPOST_WINDOWS', '')
+
+# Side of the difference hash grid; 8 gives a 64-bit hash
+HASH_SIZE = 8
+
+# Image hashes differing in at most this many bits are the same image (rescaled, recompressed, ...)
+MAX_IMAGE_DISTANCE = 5
+
+def parse_windows(value):
+    """Parse "name=days,..." into {subreddit name: seconds}"""
+    windows = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, days = item.partition('=')
+        try:
+            windows[name.strip().lower()] = float(days) * 24 * 60 * 60
+        except ValueError:
+            logger.warning(f"Ignoring repost window {item!r}, expected name=days")
+    return windows
+
+def normalize_title(title):
+    """Fold case, accents and punctuation away so cosmetic edits of a title still match"""
+    title = unicodedata.normalize('NFKD', title).casefold()
+    title = ''.join(c for c in title if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[\W_]+', ' ', title).split())
+
+def title_hash(title):
+    return hashlib.sha1(normalize_title(title).encode()).hexdigest()[:16]
+
+def normalize_url(url):
+    """Lowercase the scheme and host, drop the fragment and any trailing slash"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+
+def image_hash(image):
+    """
+    Return the difference hash of an image as 16 hex digits
+
+    The image is shrunk to a 9x8 grayscale grid and each bit says whether a pixel is
+    brighter than its right neighbour, so re-encoded, resized or recompressed copies of
+    an image (like Reddit's previews) get the same hash.
+
+    Args:
+        image: Path or binary file object of the image
+    """
+    # Pillow is imported where it is used, so importing this module at startup stays cheap
+    from PIL import Image
+
+    with Image.open(image) as img:
+        # Let the JPEG decoder skip almost all of the detail
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        pixels = list(img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1) + col
+            bits = (bits << 1) | (pixels[offset] > pixels[offset + 1])
+    return f"{bits:0{HASH_SIZE * HASH_SIZE // 4}x}"
+
+def _distance(hash_a, hash_b):
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+def _image_hashes(media_key):
+    """Return the image hashes in a media key: one for an image post, one per image for a gallery"""
+    kind, _, value = media_key.partition(':')
+    if kind == "image":
+        return [value]
+    if kind == "gallery":
+        return value.split(',')
+    return []
+
+def _submission_media_key(submission, fetch):
+    """Return the media key of a submission from the account history, see PostIndex.media_key"""
+    data = vars(submission)
+    if data.get('is_self'):
+        return "text"
+    images = (data.get('preview') or {}).get('images') or []
+    if data.get('post_hint') == 'image' and images and fetch is not None:
+        # The smallest preview is enough for the hash
+        resolutions = images[0].get('resolutions') or [images[0]['source']]
+        try:
+            return f"image:{image_hash(io.BytesIO(fetch(resolutions[0]['url'].replace('&amp;', '&'))))}"
+        except Exception as e:
+            logger.debug(f"Could not hash the preview of {data.get('id')}: {e}")
+    return f"url:{normalize_url(data.get('url') or '')}"
+
+class PostIndex:
+    """
+    Index of the posts made from this account, to skip reposts before any upload
+
+    Posts are keyed by subreddit, a hash of the normalized title and the post's media: the
+    perceptual hash of an image, the normalized URL of a link, or nothing for text posts.
+    A lookup is one dict access for the subreddit and title. Entries are persisted to disk
+    and dropped once they are older than every repost window (all windows at 0 keep them).
+    Image hashes are cached by path, mtime and size, so each image is decoded once, and
+    dropped along with the last entry that uses them. backfill() adds the posts made
+    outside this program from the account's submission history.
+    """
+
+    def __init__(self, path=None, window=DEFAULT_REPOST_WINDOW * 24 * 60 * 60, windows=None, clock=time.time):
+        """
+        Args:
+            path (str): Index file (default: post_index.json in the state directory)
+            window (float): Seconds within which a matching post is a repost; 0 allows reposts
+            windows (dict): Subreddit name -> window in seconds overriding `window`
+                            (default: from RED_POST_REPOST_WINDOWS)
+            clock (callable): Returns the current time
+        """
+        self.path = path or state_path('post_index.json')
+        self.window = window
+        self.windows = parse_windows(REPOST_WINDOWS) if windows is None else {
+            name.lower(): seconds for name, seconds in windows.items()}
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._posts, self._image_hashes, self.backfilled_until = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}, {}, 0
+        longest = max([self.window, *self.windows.values()])
+        # With every window at 0 the repost check is off; keep the entries for when it is turned on again
+        oldest = self.clock() - longest if longest > 0 else float('-inf')
+        posts = {}
+        used_hashes = set()
+        for key, bucket in data.get('posts', {}).items():
+            bucket = {media_key: post for media_key, post in bucket.items() if post['created'] > oldest}
+            if bucket:
+                posts[key] = bucket
+                for media_key in bucket:
+                    used_hashes.update(_image_hashes(media_key))
+        image_hashes = {key: value for key, value in data.get('image_hashes', {}).items() if value in used_hashes}
+        return posts, image_hashes, data.get('backfilled_until', 0)
+
+    def save(self):
+        """Write the index to disk atomically"""
+        with self._lock:
+            data = json.dumps({'posts': self._posts, 'image_hashes': self._image_hashes,
+                               'backfilled_until': self.backfilled_until})
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def window_for(self, subreddit):
+        return self.windows.get(subreddit.lower(), self.window)
+
+    def image_hash(self, image_path):
+        """Return the perceptual hash of an image file, memoized by path, mtime and size"""
+        stat = os.stat(image_path)
+        key = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        with self._lock:
+            cached = self._image_hashes.get(key)
+        if cached is None:
+            cached = image_hash(image_path)
+            with self._lock:
+                self._image_hashes[key] = cached
+        return cached
+
+    def media_key(self, post_type, url=None, image_path=None):
+        """
+        Return the part of the index key that identifies a post's media
+
+        Images that cannot be decoded fall back to their content hash, which still
+        catches byte-identical copies.
+        """
+        if post_type == "image":
+            try:
+                return f"image:{self.image_hash(image_path)}"
+            except Exception as e:
+                logger.warning(f"Could not compute the perceptual hash of {image_path}: {e}")
+                return f"file:{file_digest(image_path)}"
+        if post_type == "link":
+            return f"url:{normalize_url(url)}"
+        return "text"
+
+    @staticmethod
+    def _key(subreddit, title):
+        return f"{subreddit.lower()}|{title_hash(title)}"
+
+    def find(self, subreddit, title, media_key):
+        """
+        Return the earlier post matching this one within the subreddit's repost window
+
+        Images match when their hashes differ in at most MAX_IMAGE_DISTANCE bits. Posts
+        are bucketed by subreddit and title, so only the few posts sharing both are compared.
+
+        Returns:
+            dict: {'id', 'created'} of the earlier post, or None
+        """
+        window = self.window_for(subreddit)
+        if not window:
+            return None
+        oldest = self.clock() - window
+        with self._lock:
+            bucket = dict(self._posts.get(self._key(subreddit, title), {}))
+        post = bucket.get(media_key)
+        if post is None and media_key.startswith("image:"):
+            matches = [post for key, post in bucket.items()
+                       if key.startswith("image:") and _distance(key[6:], media_key[6:]) <= MAX_IMAGE_DISTANCE]
+            post = max(matches, key=lambda post: post['created'], default=None)
+        if post is None or post['created'] <= oldest:
+            return None
+        return post
+
+    def add(self, subreddit, title, media_key, post_id, created=None):
+        """Record a post; the newest post wins for the same key"""
+        created = self.clock() if created is None else created
+        with self._lock:
+            bucket = self._posts.setdefault(self._key(subreddit, title), {})
+            post = bucket.get(media_key)
+            if post is None or post['created'] <= created:
+                bucket[media_key] = {'id': post_id, 'created': created}
+
+    def duplicates(self, targets, media_key):
+        """
+        Find the targets of a post that already have it
+
+        Args:
+            targets (dict): Subreddit name -> fields with the 'title' to submit (see prevalidate)
+            media_key (str): From media_key()
+
+        Returns:
+            dict: Subreddit name -> earlier post, for the targets that would be reposts
+        """
+        found = {}
+        for name, fields in targets.items():
+            post = self.find(name, fields["title"], media_key)
+            if post is not None:
+                found[name] = post
+        return found
+
+    def backfill(self, reddit, limit=None, fetch_images=True):
+        """
+        Add the account's own submissions to the index
+
+        The history is read newest first, 100 posts per listing request (praw pages it), and
+        stops at the newest post an earlier backfill already saw, so running it again
+        only fetches what is new. Image posts are hashed from their smallest preview.
+
+        Args:
+            reddit: praw Reddit instance
+            limit (int): Most posts to read (default: all Reddit keeps, about 1000)
+            fetch_images (bool): Download previews to index image posts by perceptual hash
+
+        Returns:
+            int: Number of posts added
+        """
+        fetch = None
+        if fetch_images:
+            session = reddit._core._requestor._http
+
+            def fetch(url):
+                response = session.get(url, timeout=reddit.config.timeout)
+                response.raise_for_status()
+                return response.content
+
+        newest = self.backfilled_until
+        added = 0
+        for submission in reddit.user.me().submissions.new(limit=limit):
+            if submission.created_utc <= self.backfilled_until:
+                break
+            newest = max(newest, submission.created_utc)
+            self.add(submission.subreddit.display_name, submission.title, _submission_media_key(submission, fetch),
+                     submission.id, created=submission.created_utc)
+            added += 1
+        self.backfilled_until = newest
+        self.save()
+        logger.info(f"Backfilled {added} posts from the account's submission history")
+        return added
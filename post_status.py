@@ -0,0 +1,180 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from storage import state_path
+
+logger = logging.getLogger(__name__)
+
+# Fullname prefixes of the things a run creates, by job kind
+FULLNAME_PREFIXES = {"submit": "t3_", "comment": "t1_"}
+
+# Re-polling starts this many seconds after a poll and the spacing grows by FACTOR up to MAX_INTERVAL
+FIRST_INTERVAL = 5 * 60
+FACTOR = 2
+MAX_INTERVAL = 6 * 60 * 60
+
+# Comment bodies Reddit shows in place of removed or deleted comments
+REMOVED_BODIES = {"[removed]": "removed", "[deleted]": "deleted"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS things (
+    fullname TEXT PRIMARY KEY,
+    run_id TEXT,
+    subreddit TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS status (
+    fullname TEXT NOT NULL,
+    polled_at REAL NOT NULL,
+    score INTEGER,
+    num_comments INTEGER,
+    upvote_ratio REAL,
+    removed TEXT,
+    locked INTEGER,
+    PRIMARY KEY (fullname, polled_at)
+) WITHOUT ROWID;
+"""
+
+def _status(thing):
+    """Return the status columns of a fetched submission or comment"""
+    data = vars(thing)
+    removed = data.get('removed_by_category')
+    if removed is None and data.get('body') in REMOVED_BODIES:
+        removed = REMOVED_BODIES[data['body']]
+    return (data.get('score'), data.get('num_comments'), data.get('upvote_ratio'), removed,
+            int(bool(data.get('locked'))))
+
+class StatusCollector:
+    """
+    Collects the score, comment count and removal status of the posts and comments of runs
+
+    Every fetch goes through reddit.info(), which asks for up to 100 fullnames per
+    request, so a run of hundreds of posts is checked with a handful of requests instead
+    of one lazy fetch per object. Each poll adds one row per thing to an SQLite table
+    keyed by (fullname, poll time), so the history of a post can be read back in order.
+    Things Reddit no longer returns (e.g. in a subreddit that went private) are stored
+    as removed "missing".
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): SQLite database (default: post_status.db in the state directory)
+        """
+        self.path = path or state_path('post_status.db')
+        self._lock = threading.Lock()
+        # Polls may run on a background thread; the lock serializes access to the connection
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def track(self, run_id, created):
+        """
+        Remember what a run created, so it can be polled later without the journal
+
+        Args:
+            run_id (str): The run
+            created (list): (kind, subreddit_name, id) as returned by Journal.results()
+
+        Returns:
+            list: Fullnames of the tracked things
+        """
+        rows = [(FULLNAME_PREFIXES[kind] + thing_id, run_id, name) for kind, name, thing_id in created
+                if kind in FULLNAME_PREFIXES]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO things VALUES (?, ?, ?)", rows)
+        return [fullname for fullname, _, _ in rows]
+
+    def fullnames(self, run_id):
+        """Return the fullnames tracked for a run"""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT fullname FROM things WHERE run_id = ?", (run_id,))]
+
+    def collect(self, reddit, fullnames):
+        """
+        Fetch the current status of things and store it
+
+        Args:
+            reddit: praw Reddit instance
+            fullnames (list): Fullnames (t3_..., t1_...) to fetch
+
+        Returns:
+            dict: fullname -> (score, num_comments, upvote_ratio, removed, locked)
+        """
+        fullnames = list(dict.fromkeys(fullnames))
+        if not fullnames:
+            return {}
+        polled_at = time.time()
+        results = {thing.fullname: _status(thing) for thing in reddit.info(fullnames=fullnames)}
+        for fullname in fullnames:
+            results.setdefault(fullname, (None, None, None, "missing", 0))
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO status VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 [(fullname, polled_at, *status) for fullname, status in results.items()])
+        logger.info(f"Collected the status of {len(fullnames)} posts and comments "
+                    f"in {(len(fullnames) + 99) // 100} requests")
+        return results
+
+    def poll(self, reddit, fullnames, rounds=None, first_interval=FIRST_INTERVAL, factor=FACTOR,
+             max_interval=MAX_INTERVAL, cancel=None):
+        """
+        Collect the status now and again at growing intervals
+
+        New posts change quickly and settle after a few hours, so polls are spaced
+        first_interval, first_interval * factor, ... apart, up to max_interval.
+
+        Args:
+            reddit: praw Reddit instance
+            fullnames (list): Fullnames to poll
+            rounds (int): Number of polls (default: until cancelled)
+            first_interval (float): Seconds between the first and second poll
+            factor (float): Growth of the interval after every poll
+            max_interval (float): Longest interval in seconds
+            cancel (threading.Event): Stops polling once set (default: None)
+        """
+        interval = first_interval
+        done = 0
+        while rounds is None or done < rounds:
+            try:
+                self.collect(reddit, fullnames)
+            except Exception as e:
+                logger.warning(f"Could not collect the post status: {e}")
+            done += 1
+            if rounds is not None and done >= rounds:
+                break
+            logger.info(f"Next status poll in {interval:.0f} seconds")
+            if cancel is not None:
+                if cancel.wait(interval):
+                    break
+            else:
+                time.sleep(interval)
+            interval = min(max_interval, interval * factor)
+
+    def latest(self, run_id=None):
+        """
+        Return the most recent status of every tracked thing
+
+        Args:
+            run_id (str): Only the things of this run (default: all)
+
+        Returns:
+            list: dicts with fullname, subreddit, polled_at and the status columns
+        """
+        query = """
+            SELECT things.fullname, things.subreddit, status.polled_at, score, num_comments, upvote_ratio,
+                   removed, locked
+            FROM things JOIN status ON status.fullname = things.fullname
+            WHERE status.polled_at = (SELECT MAX(polled_at) FROM status WHERE fullname = things.fullname)
+        """
+        params = ()
+        if run_id is not None:
+            query += " AND things.run_id = ?"
+            params = (run_id,)
+        columns = ("fullname", "subreddit", "polled_at", "score", "num_comments", "upvote_ratio", "removed",
+                   "locked")
+        with self._lock:
+            return [dict(zip(columns, row)) for row in self._db.execute(query, params)]
@@ -0,0 +1,193 @@
+import contextlib
+import contextvars
+import logging
+import random
+
+from scheduler import parse_ratelimit_error
+
+logger = logging.getLogger(__name__)
+
+# Error classes
+RATELIMIT = "ratelimit"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+AUTH = "auth"
+
+# Exception class names (prawcore and asyncprawcore share them) that are worth retrying:
+# 5xx responses, timeouts and connection errors
+TRANSIENT_ERRORS = {
+    "ServerError", "RequestException", "TimeoutError", "ConnectionError", "ClientConnectionError",
+    "ServerDisconnectedError", "ClientPayloadError",
+}
+
+# Exception class names that will fail the same way again
+AUTH_ERRORS = {"OAuthException", "InvalidToken", "InsufficientScope", "ReadOnlyException"}
+
+# Statuses of a generic ResponseException that are worth retrying
+TRANSIENT_STATUSES = {408, 500, 502, 503, 504, 520, 522}
+
+# Job kinds whose request creates something on Reddit. Reddit often acts on such a request
+# before a timeout or 5xx reaches us, so after a transient error the job is only run
+# again once its verify() check found nothing (see Job)
+UNSAFE_KINDS = {"submit"}
+
+# Exception class names (requests, urllib3, aiohttp) meaning the connection was never made,
+# so the request was not sent
+NOT_SENT_ERRORS = {"ConnectionRefusedError", "NewConnectionError", "ConnectTimeout", "ClientConnectorError",
+                   "ConnectionTimeoutError"}
+
+# Set while an unsafe job runs, see single_attempt()
+_single_attempt = contextvars.ContextVar('single_attempt', default=False)
+
+def classify(exception):
+    """
+    Sort an exception raised by praw/asyncpraw into an error class
+
+    Unknown errors count as permanent: retrying a submit that failed for an unknown reason
+    could post twice. Media post websocket errors are permanent for the same reason.
+
+    Returns:
+        str: RATELIMIT, TRANSIENT, PERMANENT or AUTH
+    """
+    names = {cls.__name__ for cls in type(exception).__mro__}
+    if "TooManyRequests" in names or parse_ratelimit_error(exception) is not None:
+        return RATELIMIT
+    if names & AUTH_ERRORS:
+        return AUTH
+    if names & TRANSIENT_ERRORS:
+        return TRANSIENT
+    if "ResponseException" in names or "ClientResponseError" in names:
+        # prawcore keeps a requests response, asyncprawcore an aiohttp one, aiohttp the status itself
+        response = getattr(exception, 'response', None)
+        status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+        if (status or getattr(exception, 'status', None)) in TRANSIENT_STATUSES:
+            return TRANSIENT
+    return PERMANENT
+
+def _wrapped(exception):
+    """Yield an exception and those it wraps: prawcore's original_exception, urllib3's reason, causes and args"""
+    seen = set()
+    pending = [exception]
+    while pending:
+        error = pending.pop()
+        if not isinstance(error, BaseException) or id(error) in seen:
+            continue
+        seen.add(id(error))
+        yield error
+        pending.extend([getattr(error, 'original_exception', None), getattr(error, 'reason', None),
+                        error.__cause__, error.__context__, *error.args])
+
+def request_sent(exception):
+    """Return False if the error shows the request never reached Reddit, True if Reddit may have acted on it"""
+    for error in _wrapped(exception):
+        if {cls.__name__ for cls in type(error).__mro__} & NOT_SENT_ERRORS:
+            return False
+    return True
+
+@contextlib.contextmanager
+def single_attempt():
+    """
+    Make prawcore send the requests made inside at most once
+
+    prawcore retries server errors and dropped connections on its own, which for a submit
+    could post twice; inside this block the error goes to the RetryPolicy instead. Works
+    for the sessions set up with guard_client_retries(), in threads and asyncio tasks alike.
+    """
+    token = _single_attempt.set(True)
+    try:
+        yield
+    finally:
+        _single_attempt.reset(token)
+
+def guard_client_retries(core):
+    """Make a prawcore or asyncprawcore Session honor single_attempt()"""
+    base = core._retry_strategy_class
+
+    class GuardedRetryStrategy(base):
+        def should_retry_on_failure(self):
+            return not _single_attempt.get() and super().should_retry_on_failure()
+
+    core._retry_strategy_class = GuardedRetryStrategy
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed job runs again
+
+    Rate limited jobs wait for as long as Reddit asked; transient errors back off
+    exponentially with jitter. The retried job is queued again behind the work that
+    is ready, and it still goes through the scheduler, so retries never overspend the
+    rate limit budget. Errors are counted per class.
+
+    An unsafe job (UNSAFE_KINDS) that failed with a transient error after its request
+    was sent may have gone through. It is only retried if it can verify that, and it is
+    marked unconfirmed so the pipeline checks before running it again.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=2.0, max_delay=300.0, rng=None):
+        """
+        Args:
+            max_attempts (int): Attempts per job, including the first one
+            base_delay (float): Backoff in seconds after the first transient failure
+            max_delay (float): Longest backoff in seconds
+            rng (random.Random): Source of the jitter (default: a new one)
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+        self.counters = {}  # error class -> {'errors': n, 'retried': n, 'gave_up': n}
+
+    def backoff(self, attempt):
+        """Return the jittered delay before retry number `attempt` (1 for the first retry)"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return self.rng.uniform(ceiling / 2, ceiling)
+
+    def retry_delay(self, job, exception):
+        """
+        Count a failure and decide on a retry
+
+        Args:
+            job (Job): The failed job; job.attempts is the number of attempts made so far
+            exception (Exception): The error it failed with
+
+        Returns:
+            tuple: (error_class, delay) where delay is the seconds to wait before the retry,
+            or None if the job should not be retried
+        """
+        error_class = classify(exception)
+        counter = self.counters.setdefault(error_class, {'errors': 0, 'retried': 0, 'gave_up': 0})
+        counter['errors'] += 1
+        if error_class in (PERMANENT, AUTH) or job.attempts >= self.max_attempts:
+            if error_class not in (PERMANENT, AUTH):
+                counter['gave_up'] += 1
+            return error_class, None
+
+        if error_class == TRANSIENT and job.kind in UNSAFE_KINDS and request_sent(exception):
+            if job.verify is None:
+                # Running it again could do it twice
+                counter['gave_up'] += 1
+                return error_class, None
+            if not job.unconfirmed:
+                # The check before the next attempt is one more request
+                job.unconfirmed = True
+                job.cost += 1
+
+        counter['retried'] += 1
+        if error_class == RATELIMIT:
+            waited = parse_ratelimit_error(exception)
+            # A 429 has no message to parse; back off like a transient error
+            return error_class, waited if waited is not None else self.backoff(job.attempts)
+        return error_class, self.backoff(job.attempts)
+
+    def log_counters(self, log=None):
+        """Log the error counts per class, if there were any errors"""
+        if not self.counters:
+            return
+        log = log or logger
+        parts = []
+        for error_class, counter in sorted(self.counters.items()):
+            part = f"{error_class} {counter['errors']}"
+            if counter['retried'] or counter['gave_up']:
+                part += f" ({counter['retried']} retried, {counter['gave_up']} gave up)"
+            parts.append(part)
+        log.info(f"Errors by class: {', '.join(parts)}")
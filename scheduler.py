@@ -0,0 +1,214 @@
+import contextlib
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Matches the wait in Reddit's RATELIMIT messages, e.g. "Take a break for 9 minutes before trying again"
+RATELIMIT_PATTERN = re.compile(r"(\d+)\s*(millisecond|second|minute|hour)s?", re.IGNORECASE)
+
+UNIT_SECONDS = {"millisecond": 0.001, "second": 1, "minute": 60, "hour": 3600}
+
+# Seconds added to the reset time from the headers: Reddit sends whole seconds, rounded down,
+# so without it requests go out just before the window actually rolls over and get a 429
+RESET_MARGIN = 1.0
+
+class SystemClock:
+    """Wall clock used in real runs"""
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+class FakeClock:
+    """Deterministic clock for offline tests: sleeping just advances the time"""
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+def parse_ratelimit_error(exception):
+    """
+    Return how long Reddit asked us to wait, if the exception is a RATELIMIT error
+
+    Args:
+        exception (Exception): Exception raised by praw
+
+    Returns:
+        float: Seconds to wait, or None if this is not a RATELIMIT error
+    """
+    messages = [item.message for item in getattr(exception, 'items', None) or []
+                if item.error_type == "RATELIMIT"]
+    if not messages and "RATELIMIT" in str(exception):
+        messages = [str(exception)]
+
+    for message in messages:
+        match = RATELIMIT_PATTERN.search(message)
+        if match:
+            return int(match.group(1)) * UNIT_SECONDS[match.group(2).lower()]
+        # RATELIMIT without a parsable duration: back off for a minute
+        return 60
+    return None
+
+class RateLimitScheduler:
+    """
+    Decides when the next API job may run, based on Reddit's rate limit budget
+
+    The budget comes from the X-Ratelimit-Remaining/Used/Reset headers that prawcore
+    tracks on every response. Reddit's per-action RATELIMIT errors ("try again in N
+    minutes") block only the kind of job that triggered them, so e.g. comments can
+    still go out while submissions are blocked.
+
+    Jobs that run alongside others acquire() their cost when they start and release()
+    it when they finish. The headers only show requests that have been answered, so the
+    reserved cost is held back from the budget until then.
+    """
+
+    def __init__(self, reddit=None, clock=None, min_intervals=None, reserve=1):
+        """
+        Args:
+            reddit: praw Reddit instance whose rate limiter is read (optional)
+            clock: Clock with time() and sleep() (default: SystemClock)
+            min_intervals (dict): Optional minimum seconds between jobs of a kind
+            reserve (int): Requests to keep in reserve before waiting for the reset
+        """
+        self.reddit = reddit
+        self.clock = clock or SystemClock()
+        self.min_intervals = dict(min_intervals or {})
+        self.reserve = reserve
+        self.remaining = None
+        self.used = None
+        self.reset_at = None
+        # Requests reserved by jobs that are still running
+        self.in_flight = 0
+        self._blocked_until = {}
+        self._last_dispatch = {}
+        self._lock = threading.RLock()
+
+    def update(self, remaining, used=None, reset_in=None):
+        """Set the API budget from ratelimit header values"""
+        with self._lock:
+            self.remaining = float(remaining)
+            self.used = used
+            self.reset_at = self.clock.time() + reset_in if reset_in is not None else None
+
+    def observe(self):
+        """Refresh the API budget from the values prawcore tracked on the last response"""
+        if self.reddit is None:
+            return
+        limiter = self.reddit._core._rate_limiter
+        if limiter.remaining is None or limiter.reset_timestamp is None:
+            return
+        # prawcore stores the reset as a wall clock timestamp
+        self.update(limiter.remaining, limiter.used, max(0, limiter.reset_timestamp - time.time()) + RESET_MARGIN)
+
+    def penalize(self, kind, exception):
+        """
+        Block a kind of job after Reddit answered with a RATELIMIT error
+
+        Returns:
+            float: Seconds the kind is blocked for, or None if the error was not a RATELIMIT
+        """
+        seconds = parse_ratelimit_error(exception)
+        if seconds is None:
+            return None
+        with self._lock:
+            until = self.clock.time() + seconds
+            self._blocked_until[kind] = max(self._blocked_until.get(kind, 0), until)
+        logger.info(f"Rate limited on {kind}, blocked for {seconds:.0f} seconds")
+        return seconds
+
+    def delay_for(self, kind, cost=1):
+        """Return the seconds until a job of this kind, using `cost` requests, may run"""
+        with self._lock:
+            now = self.clock.time()
+            if self.reset_at is not None and now >= self.reset_at:
+                # The window has rolled over; the budget is unknown until the next response
+                self.remaining = self.used = self.reset_at = None
+
+            ready = max(now, self._blocked_until.get(kind, 0))
+            interval = self.min_intervals.get(kind)
+            if interval and kind in self._last_dispatch:
+                ready = max(ready, self._last_dispatch[kind] + interval)
+            if (self.remaining is not None and self.remaining - self.in_flight - cost < self.reserve
+                    and self.reset_at is not None):
+                ready = max(ready, self.reset_at)
+            return ready - now
+
+    def wait(self, kind, cost=1, on_wait=None):
+        """
+        Block until a job of this kind may run
+
+        Args:
+            kind (str): Job kind, e.g. "submit" or "comment"
+            cost (int): Number of API requests the job will make
+            on_wait (callable): Called with the wait in seconds before sleeping
+
+        Returns:
+            float: Seconds waited
+        """
+        self.observe()
+        delay = self.delay_for(kind, cost)
+        if delay <= 0:
+            return 0
+        if on_wait:
+            on_wait(delay)
+        self.clock.sleep(delay)
+        return delay
+
+    @contextlib.contextmanager
+    def intervals(self, **seconds):
+        """
+        Apply minimum seconds between jobs of a kind while a run lasts
+
+        Kinds given None or 0 keep their current interval. The intervals from before are
+        restored afterwards, so one run's delays don't carry over to later runs sharing
+        the scheduler, e.g. the daemon's jobs.
+        """
+        with self._lock:
+            saved = dict(self.min_intervals)
+            self.min_intervals.update({kind: value for kind, value in seconds.items() if value})
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.min_intervals.clear()
+                self.min_intervals.update(saved)
+
+    def dispatched(self, kind, cost=1):
+        """Record that a job ran, spending `cost` requests of the budget"""
+        with self._lock:
+            self._last_dispatch[kind] = self.clock.time()
+            if self.remaining is not None:
+                self.remaining -= cost
+        self.observe()
+
+    def acquire(self, kind, cost=1):
+        """Record that a job starts now alongside others, holding back `cost` requests until release()"""
+        with self._lock:
+            self._last_dispatch[kind] = self.clock.time()
+            self.in_flight += cost
+
+    def release(self, kind, cost=1):
+        """Record that a reserved job finished: its requests are answered and spent"""
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - cost)
+            if self.remaining is not None:
+                self.remaining -= cost
+        self.observe()
@@ -0,0 +1,17 @@
+import os
+
+# Directory for state kept between runs (media cache, journals, ...)
+STATE_DIR = os.getenv('RED_POST_STATE_DIR', os.path.join(os.path.expanduser('~'), '.red_post'))
+
+def state_path(filename):
+    """
+    Return the path of a file inside the state directory, creating the directory if needed
+
+    Args:
+        filename (str): Name of the state file
+
+    Returns:
+        str: Absolute path to the state file
+    """
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, filename)
@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from storage import state_path
+
+logger = logging.getLogger(__name__)
+
+# Subreddit settings rarely change; refetch them after this many seconds
+DEFAULT_TTL = 6 * 60 * 60
+
+# Seconds a subreddit that does not exist (or is banned or private) stays cached; it may be
+# created or opened again any time
+MISSING_TTL = 10 * 60
+
+# Subreddits kept in the cache; the least recently used ones are dropped first
+DEFAULT_MAX_ENTRIES = 2000
+
+# Subreddits whose "about" data one /api/info request returns
+INFO_BATCH = 100
+
+# Let the rule checks change a post to fit a subreddit (shorten the title, drop a body that is not
+# allowed, pick the first flair users may pick) instead of rejecting it
+AUTO_FIX = os.getenv('RED_POST_AUTO_FIX', '').lower() in ('1', 'true', 'yes')
+
+# Fields of the subreddit "about" data that decide which posts are allowed
+ABOUT_FIELDS = ("submission_type", "allow_images", "allow_galleries", "allow_videos", "subreddit_type")
+
+def _about(subreddit):
+    """Pick the posting fields from a Subreddit without triggering a lazy fetch"""
+    data = vars(subreddit)
+    return {field: data.get(field) for field in ABOUT_FIELDS}
+
+class SubredditRulesCache:
+    """
+    Cache of subreddit posting rules: allowed post types, flair and title/body requirements
+
+    Entries hold the subreddit's "about" fields, its post_requirements and, when flair is
+    required, the first flair a user may pick (used with RED_POST_AUTO_FIX). They are persisted to disk, expire after
+    `ttl` seconds (MISSING_TTL for subreddits that don't exist) and the least recently
+    used entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, clock=time.time):
+        self.path = path or state_path('subreddit_rules.json')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return OrderedDict()
+        now = self.clock()
+        return OrderedDict((name, entry) for name, entry in entries.items() if entry['expires_at'] > now)
+
+    def save(self):
+        """Write the cache to disk atomically"""
+        with self._lock:
+            data = json.dumps(self._entries)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def get(self, name):
+        """Return the cached rules of a subreddit, or None if missing or expired"""
+        key = name.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, name, about, requirements, flair=None):
+        """Store the rules of a subreddit, evicting the least recently used beyond max_entries"""
+        key = name.lower()
+        ttl = self.ttl if about is not None else min(self.ttl, MISSING_TTL)
+        with self._lock:
+            self._entries[key] = {
+                'about': about,
+                'requirements': requirements,
+                'flair': flair,
+                'expires_at': self.clock() + ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh(self, reddit, names, scheduler=None):
+        """
+        Fetch the rules of every subreddit that is missing or stale, ahead of a run
+
+        The "about" data of all of them comes from one /api/info request per INFO_BATCH
+        subreddits; post requirements and flair choices are fetched per subreddit.
+        Failures are logged and leave the subreddit unchecked rather than failing the run.
+
+        Args:
+            reddit: praw Reddit instance
+            names (list): Subreddit names
+            scheduler (RateLimitScheduler): Scheduler of the run; every request waits for it as
+                a "rules" job, so the fetches count against the run's budget (default: None)
+        """
+        stale = [name for name in dict.fromkeys(names) if self.get(name) is None]
+        if not stale:
+            return
+        logger.info(f"Fetching posting rules for {len(stale)} subreddits")
+        about = {}
+        try:
+            for start in range(0, len(stale), INFO_BATCH):
+                batch = stale[start:start + INFO_BATCH]
+                subreddits = _request(scheduler, lambda: list(reddit.info(subreddits=batch)))
+                about.update((subreddit.display_name.lower(), _about(subreddit)) for subreddit in subreddits)
+        except Exception as e:
+            logger.warning(f"Could not fetch subreddit info, posting without rule checks: {e}")
+            return
+
+        for name in stale:
+            subreddit = reddit.subreddit(name)
+            try:
+                requirements = _request(scheduler, subreddit.post_requirements) if name.lower() in about else {}
+            except Exception as e:
+                logger.warning(f"Could not fetch post requirements of r/{name}: {e}")
+                continue
+            flair = None
+            if requirements.get('is_flair_required'):
+                try:
+                    choice = _request(scheduler,
+                                      lambda: next(iter(subreddit.flair.link_templates.user_selectable()), None))
+                except Exception as e:
+                    logger.warning(f"Could not fetch flair choices of r/{name}: {e}")
+                    choice = None
+                if choice:
+                    flair = {'id': choice['flair_template_id'], 'text': choice.get('flair_text')}
+            self.put(name, about.get(name.lower()), requirements, flair)
+        self.save()
+
+def _request(scheduler, action):
+    """Make one API request, once the scheduler (if any) allows it"""
+    if scheduler is None:
+        return action()
+    scheduler.wait("rules")
+    try:
+        return action()
+    finally:
+        scheduler.dispatched("rules")
+
+def _contains_any(text, strings):
+    text = text.lower()
+    return any(string.lower() in text for string in strings)
+
+def _matches_any(text, patterns):
+    for pattern in patterns:
+        try:
+            if re.search(pattern, text):
+                return True
+        except re.error:
+            # Reddit's regex dialect is not always valid in Python; don't reject on it
+            return True
+    return False
+
+def _domain_listed(url, domains):
+    host = (urlparse(url).hostname or "").lower()
+    return any(host == domain.lower() or host.endswith("." + domain.lower()) for domain in domains)
+
+def check_post(entry, post_type, title, content, url, auto_fix=None):
+    """
+    Check a post against cached subreddit rules
+
+    A title that is too long, a body the subreddit does not allow and a missing required
+    flair reject the post, unless `auto_fix` is set: then the title is shortened, the
+    body dropped and the first flair users may pick is filled in.
+
+    Args:
+        entry (dict): Cached rules from SubredditRulesCache.get()
+        post_type (str): "text", "link", "image", "gallery" or "video"
+        title (str): The title of the post
+        content (str): The selftext of the post (text posts)
+        url (str): URL of the post (link posts)
+        auto_fix (bool): Change the post to fit instead of rejecting it (default: RED_POST_AUTO_FIX)
+
+    Returns:
+        tuple: (fields, fixes, error) where fields holds the title, content, flair_id and
+        flair_text to submit, fixes lists what was changed and error is the reason the post
+        would be rejected, or None
+    """
+    if auto_fix is None:
+        auto_fix = AUTO_FIX
+    fields = {"title": title, "content": content, "flair_id": None, "flair_text": None}
+    fixes = []
+    about = entry['about']
+    if about is None:
+        return fields, fixes, "Subreddit does not exist, is banned or is private"
+    submission_type = about.get('submission_type')
+    if post_type == "text" and submission_type == "link":
+        return fields, fixes, "Subreddit only allows link posts"
+    if post_type in ("link", "image", "gallery", "video") and submission_type == "self":
+        return fields, fixes, "Subreddit only allows text posts"
+    if post_type in ("image", "gallery") and about.get('allow_images') is False:
+        return fields, fixes, "Subreddit does not allow image posts"
+    if post_type == "gallery" and about.get('allow_galleries') is False:
+        return fields, fixes, "Subreddit does not allow gallery posts"
+    if post_type == "video" and about.get('allow_videos') is False:
+        return fields, fixes, "Subreddit does not allow video posts"
+
+    requirements = entry['requirements'] or {}
+    min_length = requirements.get('title_text_min_length')
+    max_length = requirements.get('title_text_max_length')
+    if min_length and len(title) < min_length:
+        return fields, fixes, f"Title is shorter than {min_length} characters"
+    if max_length and len(title) > max_length:
+        if not auto_fix:
+            return fields, fixes, f"Title is longer than {max_length} characters"
+        fields["title"] = title[:max_length].rstrip()
+        fixes.append(f"shortened the title to {max_length} characters")
+    if requirements.get('title_blacklisted_strings') and _contains_any(title, requirements['title_blacklisted_strings']):
+        return fields, fixes, "Title contains a word the subreddit does not allow"
+    if requirements.get('title_required_strings') and not _contains_any(title, requirements['title_required_strings']):
+        return fields, fixes, "Title is missing a word the subreddit requires"
+    if requirements.get('title_regexes') and not _matches_any(title, requirements['title_regexes']):
+        return fields, fixes, "Title does not match the subreddit's title format"
+
+    if post_type == "text":
+        policy = requirements.get('body_restriction_policy')
+        if policy == "required" and not content:
+            return fields, fixes, "Subreddit requires a post body"
+        if policy == "notAllowed" and content:
+            if not auto_fix:
+                return fields, fixes, "Subreddit does not allow a post body"
+            fields["content"] = ""
+            fixes.append("dropped the post body")
+        elif content:
+            if requirements.get('body_text_min_length') and len(content) < requirements['body_text_min_length']:
+                return fields, fixes, f"Body is shorter than {requirements['body_text_min_length']} characters"
+            if requirements.get('body_text_max_length') and len(content) > requirements['body_text_max_length']:
+                return fields, fixes, f"Body is longer than {requirements['body_text_max_length']} characters"
+            if (requirements.get('body_blacklisted_strings')
+                    and _contains_any(content, requirements['body_blacklisted_strings'])):
+                return fields, fixes, "Body contains a word the subreddit does not allow"
+    if post_type == "link":
+        if requirements.get('domain_blacklist') and _domain_listed(url, requirements['domain_blacklist']):
+            return fields, fixes, "Link domain is not allowed in the subreddit"
+        if requirements.get('domain_whitelist') and not _domain_listed(url, requirements['domain_whitelist']):
+            return fields, fixes, "Link domain is not on the subreddit's allowed list"
+
+    if requirements.get('is_flair_required'):
+        if not auto_fix:
+            return fields, fixes, "Subreddit requires flair"
+        if entry['flair'] is None:
+            return fields, fixes, "Subreddit requires flair and has none users can pick"
+        fields["flair_id"] = entry['flair']['id']
+        fields["flair_text"] = entry['flair']['text']
+        fixes.append(f"picked flair {entry['flair']['text']!r}")
+    return fields, fixes, None
+
+def prevalidate(cache, reddit, subreddit_list, post_type, title, content, url, scheduler=None):
+    """
+    Check a post against the rules of every target subreddit before any upload or submit
+
+    Stale rules are refreshed in bulk first, through the scheduler if one is given (see
+    SubredditRulesCache.refresh). Subreddits whose rules could not be fetched are
+    accepted unchanged. Every change RED_POST_AUTO_FIX makes is logged as a warning.
+
+    Returns:
+        tuple: (accepted, rejected) where accepted maps subreddit name -> fields to submit
+        (see check_post) and rejected maps subreddit name -> reason
+    """
+    cache.refresh(reddit, subreddit_list, scheduler=scheduler)
+    accepted = {}
+    rejected = {}
+    for name in subreddit_list:
+        entry = cache.get(name)
+        if entry is None:
+            accepted[name] = {"title": title, "content": content, "flair_id": None, "flair_text": None}
+            continue
+        fields, fixes, error = check_post(entry, post_type, title, content, url)
+        if error:
+            rejected[name] = error
+            continue
+        if fixes:
+            logger.warning(f"Changed the post for r/{name} to fit its rules: {', '.join(fixes)}")
+        accepted[name] = fields
+    return accepted, rejected
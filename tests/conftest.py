@@ -0,0 +1,53 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep the token cache, journal and caches of the code under test out of the real state directory
+os.environ['RED_POST_STATE_DIR'] = tempfile.mkdtemp(prefix='red_post_tests_')
+
+IMAGE_PATH = os.path.join(ROOT, 'testimage.jpg')
+
+@pytest.fixture
+def mock(monkeypatch):
+    """A local mock Reddit server the clients are pointed at"""
+    from mock_reddit import MockReddit
+
+    server = MockReddit(ratelimit=10 ** 6, api_error_wait=0).start()
+    for name, value in server.env().items():
+        monkeypatch.setenv(name, value)
+    yield server
+    server.stop()
+
+@pytest.fixture
+def journal(tmp_path):
+    from journal import Journal
+
+    journal = Journal(str(tmp_path / 'journal.jsonl'))
+    yield journal
+    journal.close()
+
+@pytest.fixture
+def engine(mock, tmp_path, journal):
+    """A PostingEngine on the mock server, with caches of its own"""
+    from client import create_reddit
+    from engine import PostingEngine
+    from image_prep import ImagePreparer
+    from media_cache import MediaCache
+    from post_index import PostIndex
+    from subreddit_rules import SubredditRulesCache
+
+    clients = []
+
+    def get_reddit():
+        if not clients:
+            clients.append(create_reddit())
+        return clients[0]
+
+    return PostingEngine(get_reddit, MediaCache(str(tmp_path / 'media.json')),
+                         SubredditRulesCache(str(tmp_path / 'rules.json')), ImagePreparer(str(tmp_path / 'prepared')),
+                         PostIndex(str(tmp_path / 'posts.json')), journal)
@@ -0,0 +1,39 @@
+"""Reading campaign manifests"""
+import pytest
+
+from campaign import read_manifest
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+def test_yaml_list_is_read_one_post_at_a_time(tmp_path, monkeypatch):
+    import yaml
+
+    path = write(tmp_path, "posts.yaml", "".join(f"- {{title: post {i}, subreddits: [a]}}\n" for i in range(3)))
+    monkeypatch.setattr(yaml, "safe_load_all", None)
+
+    posts = read_manifest(path)
+    assert next(posts)["title"] == "post 0"
+    assert [post["title"] for post in posts] == ["post 1", "post 2"]
+
+def test_yaml_documents_and_lists(tmp_path):
+    path = write(tmp_path, "posts.yaml", "title: one\nsubreddits: a, b\n---\n---\n- &post {title: two, subreddit: c}\n"
+                                         "- *post\n")
+
+    posts = list(read_manifest(path))
+
+    assert [(post["row"], post["title"], post["subreddits"]) for post in posts] == [
+        (1, "one", ["a", "b"]), (2, "two", ["c"]), (3, "two", ["c"])]
+
+@pytest.mark.parametrize("name, text", [
+    ("posts.yaml", "- {title: one, earliest: soon}\n- {title: two, earliest: 1700000000}\n"),
+    ("posts.csv", "title,earliest\none,soon\ntwo,1700000000\n"),
+    ("posts.jsonl", '{"title": "one", "earliest": "soon"}\n{"title": "two", "earliest": 1700000000}\n'),
+])
+def test_malformed_earliest_time_rejects_only_its_row(tmp_path, name, text):
+    first, second = read_manifest(write(tmp_path, name, text))
+
+    assert first["error"] == "Invalid earliest time: 'soon'"
+    assert (second["error"], second["earliest"]) == (None, 1700000000.0)
@@ -0,0 +1,127 @@
+"""Authentication of requests to the daemon's HTTP API"""
+import http.client
+import json
+import os
+import stat
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import daemon
+import storage
+from daemon import Daemon, DaemonClient, DaemonError, DaemonRequestHandler, load_token
+
+TOKEN = "test-token"
+
+JOB = json.dumps({"title": "daemon test", "subreddits": ["a"]})
+
+@pytest.fixture
+def server():
+    """A daemon whose jobs are queued but never run"""
+    app = Daemon(red_post=None, token=TOKEN)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), DaemonRequestHandler)
+    httpd.app = app
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def request(server, method, path, body=None, headers=None, token=TOKEN):
+    headers = dict(headers or {})
+    if token:
+        headers.setdefault('Authorization', f"Bearer {token}")
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        connection.close()
+
+def test_generated_token_is_private_and_kept(monkeypatch, tmp_path):
+    monkeypatch.delenv('RED_POST_DAEMON_TOKEN', raising=False)
+    monkeypatch.setattr(storage, 'STATE_DIR', str(tmp_path))
+
+    assert load_token() is None
+    token = load_token(create=True)
+
+    path = tmp_path / daemon.TOKEN_FILE
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert load_token() == token
+    assert load_token(create=True) == token
+
+def test_token_from_environment(monkeypatch):
+    monkeypatch.setenv('RED_POST_DAEMON_TOKEN', "from-env")
+
+    assert load_token(create=True) == "from-env"
+
+def test_daemon_needs_a_token():
+    with pytest.raises(ValueError):
+        Daemon(red_post=None, token=None)
+
+@pytest.mark.parametrize("token", [None, "wrong-token"])
+def test_request_without_the_token_is_refused(server, token):
+    status, body = request(server, 'GET', '/health', token=token)
+
+    assert status == 401
+    assert "token" in body['error']
+
+def test_request_with_the_token_is_answered(server):
+    status, body = request(server, 'GET', '/health')
+
+    assert status == 200
+    assert body['queued'] == 0
+
+def test_job_is_queued(server):
+    status, body = request(server, 'POST', '/jobs', JOB, {'Content-Type': 'application/json; charset=utf-8'})
+
+    assert status == 202
+    assert body['state'] == daemon.QUEUED
+    assert request(server, 'GET', f"/jobs/{body['id']}")[1]['id'] == body['id']
+
+@pytest.mark.parametrize("content_type", [None, 'text/plain', 'application/x-www-form-urlencoded'])
+def test_job_must_be_sent_as_json(server, content_type):
+    headers = {'Content-Type': content_type} if content_type else {}
+
+    status, _ = request(server, 'POST', '/jobs', JOB, headers)
+
+    assert status == 415
+    assert server.app.runner.list() == []
+
+def test_invalid_job_is_refused(server):
+    status, _ = request(server, 'POST', '/jobs', json.dumps({"subreddits": ["a"]}),
+                        {'Content-Type': 'application/json'})
+
+    assert status == 400
+
+@pytest.mark.parametrize("origin", ["http://example.com", "null", "http://127.0.0.1"])
+def test_request_with_an_origin_is_refused(server, origin):
+    status, _ = request(server, 'POST', '/jobs', JOB, {'Content-Type': 'application/json', 'Origin': origin})
+
+    assert status == 403
+    assert server.app.runner.list() == []
+
+@pytest.mark.parametrize("host", ["example.com", "example.com:8770", "127.0.0.1.example.com"])
+def test_request_to_another_host_name_is_refused(server, host):
+    # As sent by a browser after DNS rebinding, with the token stolen or not
+    status, _ = request(server, 'GET', '/health', headers={'Host': host})
+
+    assert status == 403
+
+@pytest.mark.parametrize("host", ["localhost", "localhost:8770", "127.0.0.1:8770", "[::1]:8770"])
+def test_request_to_a_local_host_name_is_answered(server, host):
+    status, _ = request(server, 'GET', '/health', headers={'Host': host})
+
+    assert status == 200
+
+def test_client_sends_the_token(server):
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    job = DaemonClient(url, token=TOKEN).submit({"title": "daemon test", "subreddits": "a, b"})
+
+    assert job['state'] == daemon.QUEUED
+    with pytest.raises(DaemonError) as error:
+        DaemonClient(url, token="wrong-token").health()
+    assert error.value.status == 401
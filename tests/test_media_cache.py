@@ -0,0 +1,134 @@
+"""Reuse of uploaded media across subreddits and runs, against a local mock Reddit server"""
+import pytest
+from PIL import Image
+
+from conftest import IMAGE_PATH
+from media_cache import MediaCache, is_asset_rejection, submit_image
+
+def requests(mock, endpoint):
+    return mock.stats['endpoints'].get(endpoint, 0)
+
+def post(engine, subreddits, executor="sync", **media):
+    (successful, failed, _), _ = engine.post_and_comment(
+        title="media test", content="", subreddit_list=list(subreddits), executor=executor, **media)
+    return successful, failed
+
+@pytest.fixture
+def images(tmp_path):
+    """Two distinct images for gallery posts"""
+    paths = []
+    with Image.open(IMAGE_PATH) as image:
+        for angle in (90, 180):
+            path = str(tmp_path / f"image_{angle}.jpg")
+            image.rotate(angle).save(path)
+            paths.append(path)
+    return paths
+
+@pytest.mark.parametrize("executor", ["sync", "threaded", "async"])
+def test_image_is_uploaded_once_for_all_subreddits(mock, engine, executor):
+    successful, failed = post(engine, ["a", "b", "c"], executor, post_type="image", image_path=IMAGE_PATH)
+
+    assert (sorted(successful), failed) == (["a", "b", "c"], [])
+    assert requests(mock, 'media_asset') == 1
+    assert requests(mock, 'upload') == 1
+    assert len(mock.submissions) == 3
+
+def test_image_upload_is_reused_by_later_runs(mock, engine):
+    post(engine, ["a"], post_type="image", image_path=IMAGE_PATH)
+    mock.reset_stats()
+    # A new cache instance loads the uploads saved by the first run
+    engine.media_cache = MediaCache(engine.media_cache.path)
+
+    successful, failed = post(engine, ["b"], post_type="image", image_path=IMAGE_PATH)
+
+    assert (successful, failed) == (["b"], [])
+    assert requests(mock, 'media_asset') == 0
+    assert requests(mock, 'upload') == 0
+
+def test_expired_upload_is_not_reused(mock, engine, tmp_path):
+    now = [1000.0]
+    engine.media_cache = MediaCache(str(tmp_path / 'expiring.json'), ttl=60, clock=lambda: now[0])
+    post(engine, ["a"], post_type="image", image_path=IMAGE_PATH)
+    now[0] += 61
+
+    post(engine, ["b"], post_type="image", image_path=IMAGE_PATH)
+
+    assert requests(mock, 'upload') == 2
+
+@pytest.mark.parametrize("executor", ["sync", "async"])
+def test_gallery_images_are_uploaded_once_for_all_subreddits(mock, engine, images, executor):
+    successful, failed = post(engine, ["a", "b"], executor, post_type="gallery", image_paths=images)
+
+    assert (sorted(successful), failed) == (["a", "b"], [])
+    assert requests(mock, 'media_asset') == len(images)
+    assert requests(mock, 'upload') == len(images)
+
+def test_failed_upload_is_not_cached(mock, engine):
+    cache = engine.media_cache
+    subreddit = engine.get_reddit().subreddit("a")
+    mock.inject('upload', 500)
+
+    with pytest.raises(Exception):
+        cache.upload(subreddit, IMAGE_PATH)
+
+    assert cache.get(cache.digest(IMAGE_PATH)) is None
+    asset, cached = cache.upload(subreddit, IMAGE_PATH)
+    assert asset and not cached
+    assert requests(mock, 'upload') == 2
+
+class MediaPostFailed(Exception):
+    """Stands in for praw's exception when the server refuses an uploaded asset"""
+
+class RejectingSubreddit:
+    """Wraps a praw Subreddit and refuses the first `rejections` media submits"""
+
+    def __init__(self, subreddit, rejections):
+        self._subreddit = subreddit
+        self._reddit = subreddit._reddit
+        self.rejections = rejections
+        self.urls = []
+
+    def __str__(self):
+        return str(self._subreddit)
+
+    def __getattr__(self, name):
+        return getattr(self._subreddit, name)
+
+    def _submit_media(self, data, **kwargs):
+        self.urls.append(data["url"])
+        if len(self.urls) <= self.rejections:
+            raise MediaPostFailed()
+        return self._subreddit._submit_media(data=data, **kwargs)
+
+def test_rejected_cached_asset_is_uploaded_again(mock, engine):
+    cache = engine.media_cache
+    reddit = engine.get_reddit()
+    cache.upload(reddit.subreddit("a"), IMAGE_PATH)
+    subreddit = RejectingSubreddit(reddit.subreddit("b"), rejections=1)
+
+    submission = submit_image(subreddit, "media test", IMAGE_PATH, cache)
+
+    assert submission.id in mock.submissions
+    assert requests(mock, 'upload') == 2
+    assert len(set(subreddit.urls)) == 2
+    # The new upload replaces the rejected one for later posts
+    assert cache.get(cache.digest(IMAGE_PATH)) == subreddit.urls[-1]
+
+def test_rejected_fresh_asset_is_not_uploaded_again(mock, engine):
+    subreddit = RejectingSubreddit(engine.get_reddit().subreddit("a"), rejections=1)
+
+    with pytest.raises(MediaPostFailed):
+        submit_image(subreddit, "media test", IMAGE_PATH, engine.media_cache)
+
+    assert requests(mock, 'upload') == 1
+    assert len(subreddit.urls) == 1
+
+def test_is_asset_rejection():
+    class RedditAPIException(Exception):
+        def __init__(self, *error_types):
+            self.items = [type("Item", (), {"error_type": error_type})() for error_type in error_types]
+
+    assert is_asset_rejection(MediaPostFailed())
+    assert is_asset_rejection(RedditAPIException("BAD_URL"))
+    assert not is_asset_rejection(RedditAPIException("RATELIMIT"))
+    assert not is_asset_rejection(ValueError())
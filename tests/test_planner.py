@@ -0,0 +1,147 @@
+"""Run plans: the requests, uploads and duration of a run, estimated without sending anything"""
+import os
+
+import pytest
+
+from conftest import IMAGE_PATH
+from planner import LatencyHistory, RunPlanner, format_plan, single_post
+from scheduler import FakeClock, RateLimitScheduler
+from subreddit_rules import INFO_BATCH
+
+ABOUT = {'submission_type': 'any', 'allow_images': True, 'allow_galleries': True, 'allow_videos': True,
+         'subreddit_type': 'public'}
+
+# Fixed latencies, so durations don't depend on earlier runs
+HISTORY = LatencyHistory({("submit", "text"): [2.0], ("submit", "image"): [3.0], ("comment", "text"): [1.0]})
+
+def plan(engine, post, executor="sync", scheduler=None):
+    return RunPlanner(engine, HISTORY).plan([post], scheduler=scheduler, executor=executor)
+
+def known_rules(engine, names, **requirements):
+    for name in names:
+        engine.subreddit_rules.put(name, ABOUT, requirements)
+
+def test_plan_sends_nothing(mock, engine):
+    result = plan(engine, single_post("plan test", "body", ["a", "b", "c"], comment_text="hi"))
+
+    assert (result["posts"], result["comments"]) == (3, 3)
+    assert result["api_calls"] == {"rules": 1 + 3, "upload": 0, "submit": 3, "comment": 3}
+    assert result["unchecked"] == ["a", "b", "c"]
+    assert mock.stats['endpoints'] == {}
+    assert mock.submissions == {}
+
+def test_rules_are_fetched_in_batches(engine):
+    names = [f"s{i}" for i in range(INFO_BATCH + 1)]
+
+    result = plan(engine, single_post("plan test", "", names))
+
+    assert result["api_calls"]["rules"] == 2 + len(names)
+
+def test_plan_matches_the_run(mock, engine):
+    args = ("plan test", "", ["a", "b", "c"])
+    options = dict(comment_text="hi", post_type="image", image_path=IMAGE_PATH)
+    result = plan(engine, single_post(*args, **options))
+
+    engine.post_and_comment(*args, executor="sync", **options)
+
+    assert result["api_calls"]["submit"] == mock.stats['endpoints']['submit']
+    assert result["api_calls"]["comment"] == mock.stats['endpoints']['comment']
+    assert result["api_calls"]["upload"] == mock.stats['endpoints']['media_asset']
+    assert result["uploads"] == mock.stats['endpoints']['upload']
+
+def test_uploads_are_counted_once(engine):
+    result = plan(engine, single_post("plan test", "", ["a", "b"], post_type="image", image_path=IMAGE_PATH))
+
+    assert (result["uploads"], result["cached_uploads"]) == (1, 0)
+    assert result["upload_bytes"] == os.path.getsize(IMAGE_PATH)
+
+def test_cached_uploads_are_not_counted(engine):
+    cache = engine.media_cache
+    cache.put(cache.digest(IMAGE_PATH), "https://mock/asset.jpg")
+
+    result = plan(engine, single_post("plan test", "", ["a"], post_type="image", image_path=IMAGE_PATH))
+
+    assert (result["uploads"], result["cached_uploads"], result["upload_bytes"]) == (0, 1, 0)
+    assert result["api_calls"]["upload"] == 0
+
+def test_posts_breaking_cached_rules_are_rejected(engine):
+    known_rules(engine, ["a"])
+    known_rules(engine, ["b"], title_text_min_length=50)
+
+    result = plan(engine, single_post("plan test", "", ["a", "b"], comment_text="hi"))
+
+    assert result["rejected"] == [(None, "b", "Title is shorter than 50 characters")]
+    assert (result["posts"], result["comments"]) == (1, 1)
+    assert result["api_calls"]["rules"] == 0
+    assert result["unchecked"] == []
+
+def test_invalid_post_is_rejected(engine, tmp_path):
+    missing = str(tmp_path / "missing.jpg")
+
+    result = plan(engine, single_post("plan test", "", ["a", "b"], post_type="image", image_path=missing))
+
+    assert [name for _, name, _ in result["rejected"]] == ["a", "b"]
+    assert result["posts"] == 0
+    assert sum(result["api_calls"].values()) == 0
+
+def test_duplicates_are_rejected(engine):
+    engine.post_index.add("a", "plan test", "text", "abc")
+
+    result = plan(engine, single_post("plan test", "", ["a", "b"]))
+
+    assert [(name, reason.split(" on ")[0]) for _, name, reason in result["rejected"]] == [
+        ("a", "already posted as abc")]
+    assert result["posts"] == 1
+
+def test_duration_follows_the_latencies(engine):
+    known_rules(engine, ["a", "b"])
+
+    result = plan(engine, single_post("plan test", "", ["a", "b"], comment_text="hi"))
+
+    # Two submits of 2s and two comments of 1s, one at a time
+    assert result["duration"] == pytest.approx(6.0)
+    assert [kind for _, kind, _ in result["schedule"]].count("comment") == 2
+    first_submit = next(seconds for seconds, kind, name in result["schedule"] if (kind, name) == ("submit", "a"))
+    first_comment = next(seconds for seconds, kind, name in result["schedule"] if (kind, name) == ("comment", "a"))
+    assert first_comment > first_submit
+
+def test_concurrent_executors_plan_shorter_runs(engine):
+    names = [f"s{i}" for i in range(8)]
+    known_rules(engine, names)
+    post = single_post("plan test", "", names, comment_text="hi")
+
+    assert plan(engine, post, "async")["duration"] < plan(engine, post, "sync")["duration"]
+
+def test_delay_spaces_out_submits(engine):
+    known_rules(engine, ["a", "b", "c"])
+
+    result = plan(engine, single_post("plan test", "", ["a", "b", "c"], delay=60))
+
+    assert result["duration"] >= 120
+
+def test_exhausted_budget_waits_for_the_window(engine):
+    known_rules(engine, ["a", "b", "c"])
+    clock = FakeClock(1000.0)
+    scheduler = RateLimitScheduler(clock=clock)
+    scheduler.update(1, 999, 300)
+
+    result = plan(engine, single_post("plan test", "", ["a", "b", "c"]), scheduler=scheduler)
+
+    assert result["budget_known"]
+    assert result["budget"] == 1
+    assert result["waits"] > 0
+    assert result["duration"] >= 300
+
+def test_unknown_budget_assumes_a_fresh_window(engine):
+    result = plan(engine, single_post("plan test", "", ["a"]))
+
+    assert not result["budget_known"]
+    assert "unknown, assuming a fresh window" in format_plan(result)
+
+def test_format_plan(engine):
+    known_rules(engine, ["b"], title_text_min_length=50)
+
+    text = format_plan(plan(engine, single_post("plan test", "", ["a", "b"], comment_text="hi")))
+
+    assert text.startswith("Plan for 1 posts and 1 comments on the sync executor (nothing was sent):")
+    assert "Title is shorter than 50 characters" in text
@@ -0,0 +1,86 @@
+"""The repost index: lookups, persistence and backfill from the mock server"""
+import os
+
+import pytest
+from PIL import Image
+
+from conftest import IMAGE_PATH
+from post_index import PostIndex
+
+DAY = 24 * 60 * 60
+
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+def index(tmp_path, clock, **options):
+    return PostIndex(str(tmp_path / 'posts.json'), clock=clock, **options)
+
+def test_find_within_the_window(tmp_path, clock):
+    posts = index(tmp_path, clock, window=7 * DAY, windows={'Pics': DAY})
+    posts.add("test", "My Post", "text", "abc")
+    posts.add("pics", "My Post", "text", "def")
+
+    assert posts.find("TEST", "my post", "text")["id"] == "abc"
+    assert posts.find("test", "my post", "url:https://example.com/") is None
+    assert posts.find("other", "my post", "text") is None
+    clock.now += 2 * DAY
+    assert posts.find("test", "My Post", "text")["id"] == "abc"
+    assert posts.find("pics", "My Post", "text") is None
+    clock.now += 6 * DAY
+    assert posts.find("test", "My Post", "text") is None
+
+def test_find_similar_image(tmp_path, clock):
+    copy = str(tmp_path / 'copy.jpg')
+    with Image.open(IMAGE_PATH) as image:
+        image.resize((image.width // 2, image.height // 2)).save(copy, quality=70)
+    posts = index(tmp_path, clock)
+    original = posts.media_key("image", image_path=IMAGE_PATH)
+    posts.add("test", "title", original, "abc")
+
+    assert posts.find("test", "title", posts.media_key("image", image_path=copy))["id"] == "abc"
+    bits = int(original[6:], 16)
+    assert posts.find("test", "title", f"image:{bits ^ 0b101:016x}")["id"] == "abc"
+    assert posts.find("test", "title", f"image:{bits ^ 0xffff:016x}") is None
+
+def test_saved_entries_are_pruned_by_window_on_load(tmp_path, clock):
+    posts = index(tmp_path, clock, window=DAY)
+    posts.add("test", "old", "text", "abc", created=clock.now - 2 * DAY)
+    posts.add("test", "new", "text", "def")
+    posts.save()
+
+    loaded = index(tmp_path, clock, window=DAY)
+    assert loaded.find("test", "new", "text")["id"] == "def"
+    assert loaded.find("test", "old", "text") is None
+
+def test_zero_window_keeps_the_saved_index(tmp_path, clock):
+    posts = index(tmp_path, clock, window=DAY)
+    posts.add("test", "title", "text", "abc")
+    posts.save()
+
+    disabled = index(tmp_path, clock, window=0)
+    assert disabled.find("test", "title", "text") is None
+    disabled.save()
+
+    assert index(tmp_path, clock, window=DAY).find("test", "title", "text")["id"] == "abc"
+
+def test_backfill_reads_only_new_submissions(mock, engine, tmp_path):
+    engine.post_and_comment("first post", "body", ["a", "b"])
+    posts = PostIndex(str(tmp_path / 'backfilled.json'))
+
+    assert posts.backfill(engine.get_reddit(), fetch_images=False) == 2
+    assert posts.find("a", "first post", "text") is not None
+    assert os.path.exists(posts.path)
+
+    engine.post_and_comment("second post", "body", ["a"])
+    mock.reset_stats()
+    assert posts.backfill(engine.get_reddit(), fetch_images=False) == 1
+    assert posts.find("a", "second post", "text") is not None
+    assert mock.stats['endpoints']['user_submitted'] == 1
@@ -0,0 +1,98 @@
+"""Resuming a run from the journal after the process died or jobs failed"""
+import time
+
+import pytest
+
+from journal import DUPLICATE, FAILED, IN_FLIGHT, PLANNED, REJECTED, SUCCEEDED, Journal, pending_work
+from retry import AUTH, PERMANENT, RATELIMIT, TRANSIENT
+
+PARAMS = {"title": "resumed post", "content": "body", "subreddits": [], "comment_text": "hi", "post_type": "text",
+          "url": None, "image_path": None, "image_paths": None, "video_path": None, "delay": None,
+          "comment_delay": None}
+
+def crashed_run(path, jobs):
+    """Write the journal of a run that stopped with its jobs in the given states"""
+    journal = Journal(path)
+    run_id = journal.start_run({**PARAMS, "subreddits": [name for kind, name, _, _ in jobs if kind == "submit"]})
+    for kind, name, state, fields in jobs:
+        journal.record(run_id, kind, name, state, **fields)
+    journal.close()
+    return run_id
+
+@pytest.mark.parametrize("error_class, pending", [
+    (RATELIMIT, True), (TRANSIENT, True), (AUTH, True), (None, True),
+    (PERMANENT, False), (REJECTED, False), (DUPLICATE, False),
+])
+def test_which_failed_posts_are_pending(error_class, pending):
+    fields = {'error_class': error_class} if error_class else {}
+    jobs = {("submit", "a"): {'state': FAILED, 'ts': 100.0, **fields}}
+
+    posts, _, _ = pending_work({**PARAMS, "subreddits": ["a"]}, jobs)
+
+    assert posts == (["a"] if pending else [])
+
+def test_pending_work():
+    jobs = {
+        ("submit", "planned"): {'state': PLANNED, 'ts': 100.0},
+        ("submit", "in_flight"): {'state': IN_FLIGHT, 'ts': 101.0},
+        ("submit", "timed_out"): {'state': FAILED, 'ts': 300.0, 'error_class': TRANSIENT, 'first_attempt': 102.0},
+        ("submit", "limited"): {'state': FAILED, 'ts': 103.0, 'error_class': RATELIMIT},
+        ("submit", "posted"): {'state': SUCCEEDED, 'ts': 104.0, 'id': 'abc'},
+        ("submit", "commented"): {'state': SUCCEEDED, 'ts': 105.0, 'id': 'def'},
+        ("comment", "commented"): {'state': SUCCEEDED, 'ts': 106.0},
+    }
+    subreddits = ["planned", "in_flight", "timed_out", "limited", "posted", "commented", "never_journaled"]
+
+    posts, comments, unconfirmed = pending_work({**PARAMS, "subreddits": subreddits}, jobs)
+
+    assert posts == ["planned", "in_flight", "timed_out", "limited", "never_journaled"]
+    assert comments == [("posted", "abc")]
+    # Posts that may exist already, with the time of their first attempt
+    assert unconfirmed == {"in_flight": 101.0, "timed_out": 102.0}
+
+def test_resume_checks_unconfirmed_posts_instead_of_posting_again(mock, engine, tmp_path):
+    started = time.time()
+    # The post to r/made went through before the process died, the one to r/lost did not
+    made = engine.get_reddit().subreddit("made").submit(PARAMS["title"], selftext=PARAMS["content"])
+    path = str(tmp_path / 'crashed.jsonl')
+    crashed_run(path, [
+        ("submit", "made", IN_FLIGHT, {}),
+        ("submit", "lost", FAILED, {'error_class': TRANSIENT, 'first_attempt': started}),
+    ])
+    mock.reset_stats()
+
+    journal = Journal(path)
+    (successful, failed, submissions), (comments, _) = engine.resume_run(journal=journal)
+    journal.close()
+    journal = Journal(path)
+    unfinished = journal.unfinished_run()
+    journal.close()
+
+    assert sorted(successful) == ["lost", "made"]
+    assert made.id in [submission.id for submission in submissions]
+    assert mock.stats['endpoints']['user_submitted'] == 2
+    assert mock.stats['endpoints']['submit'] == 1
+    assert len(mock.submissions) == 2
+    assert sorted(comments) == ["lost", "made"]
+    assert unfinished is None
+
+def test_resume_requeues_only_retryable_failures(mock, engine, tmp_path):
+    path = str(tmp_path / 'crashed.jsonl')
+    crashed_run(path, [
+        ("submit", "limited", FAILED, {'error_class': RATELIMIT}),
+        ("submit", "logged_out", FAILED, {'error_class': AUTH}),
+        ("submit", "forbidden", FAILED, {'error_class': PERMANENT}),
+        ("submit", "rejected", FAILED, {'error_class': REJECTED}),
+        ("submit", "repost", FAILED, {'error_class': DUPLICATE}),
+        ("submit", "posted", SUCCEEDED, {'id': 'abc123'}),
+    ])
+    mock.reset_stats()
+
+    journal = Journal(path)
+    (successful, failed, _), _ = engine.resume_run(journal=journal)
+    journal.close()
+
+    assert (sorted(successful), failed) == (["limited", "logged_out"], [])
+    # Nothing to check for: these never reached Reddit
+    assert mock.stats['endpoints'].get('user_submitted', 0) == 0
+    assert mock.stats['endpoints']['submit'] == 2
@@ -0,0 +1,101 @@
+"""Retries of failed jobs, against a local mock Reddit server that fails requests on demand"""
+import functools
+
+import prawcore
+import pytest
+
+import pipeline
+from retry import PERMANENT, RATELIMIT, TRANSIENT, RetryPolicy, classify, request_sent
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    # Retry right away instead of after seconds of backoff
+    monkeypatch.setattr(pipeline, 'RetryPolicy', functools.partial(RetryPolicy, base_delay=0.01))
+
+def post(engine, executor="sync", subreddits=("a",), comment_text=None):
+    (successful, failed, _), (comments, failed_comments) = engine.post_and_comment(
+        title="retry test", content="body", subreddit_list=list(subreddits), comment_text=comment_text,
+        executor=executor)
+    return successful, failed, comments, failed_comments
+
+def requests(mock, endpoint):
+    return mock.stats['endpoints'].get(endpoint, 0)
+
+@pytest.mark.parametrize("executor", ["sync", "threaded", "async"])
+def test_submit_lost_before_reddit_is_checked_then_retried(mock, engine, executor):
+    mock.inject('submit', 503)
+
+    successful, failed, _, _ = post(engine, executor)
+
+    assert (successful, failed) == (["a"], [])
+    assert requests(mock, 'submit') == 2
+    assert requests(mock, 'user_submitted') == 1
+    assert len(mock.submissions) == 1
+
+@pytest.mark.parametrize("executor", ["sync", "threaded", "async"])
+def test_submit_made_despite_error_is_not_sent_again(mock, engine, executor):
+    mock.inject('submit', 504, after=True)
+
+    successful, failed, _, _ = post(engine, executor, comment_text="hi")
+
+    assert (successful, failed) == (["a"], [])
+    assert requests(mock, 'submit') == 1
+    assert len(mock.submissions) == 1
+    assert requests(mock, 'comment') == 1
+
+@pytest.mark.parametrize("error", ["RATELIMIT", 429])
+def test_rate_limited_submit_is_retried_without_checking(mock, engine, error):
+    mock.inject('submit', error)
+
+    successful, failed, _, _ = post(engine)
+
+    assert (successful, failed) == (["a"], [])
+    assert requests(mock, 'submit') == 2
+    assert requests(mock, 'user_submitted') == 0
+
+def test_permanent_error_is_not_retried(mock, engine):
+    mock.inject('submit', 403)
+
+    successful, failed, _, _ = post(engine)
+
+    assert (successful, failed) == ([], ["a"])
+    assert requests(mock, 'submit') == 1
+
+def test_gives_up_after_max_attempts(mock, engine):
+    attempts = RetryPolicy().max_attempts
+    mock.inject('submit', 503, times=attempts)
+
+    successful, failed, _, _ = post(engine)
+
+    assert (successful, failed) == ([], ["a"])
+    # One request per attempt: prawcore does not retry a submit on its own
+    assert requests(mock, 'submit') == attempts
+    assert requests(mock, 'user_submitted') == attempts - 1
+    assert len(mock.submissions) == 0
+
+def test_classify():
+    assert classify(prawcore.ServerError(FakeResponse(503))) == TRANSIENT
+    assert classify(prawcore.TooManyRequests(FakeResponse(429))) == RATELIMIT
+    assert classify(prawcore.Forbidden(FakeResponse(403))) == PERMANENT
+
+def test_request_sent():
+    refused = ConnectionRefusedError(111, "Connection refused")
+    try:
+        try:
+            raise refused
+        except ConnectionRefusedError as e:
+            raise OSError("connection failed") from e
+    except OSError as e:
+        wrapped = e
+    assert not request_sent(prawcore.RequestException(wrapped, (), {}))
+    assert request_sent(prawcore.RequestException(TimeoutError("read timed out"), (), {}))
+    assert request_sent(prawcore.ServerError(FakeResponse(503)))
+
+class FakeResponse:
+    """Just enough of a requests.Response for prawcore's exceptions"""
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = ""
+        self.reason = ""
@@ -0,0 +1,158 @@
+"""RateLimitScheduler on a FakeClock: waits, RATELIMIT blocks and the budget window, without network"""
+import time
+from types import SimpleNamespace
+
+import praw.exceptions
+import pytest
+
+from scheduler import RESET_MARGIN, FakeClock, RateLimitScheduler, parse_ratelimit_error
+
+def fake_reddit(remaining, used, reset_in):
+    """Just enough of a praw Reddit for observe(): the headers prawcore saw last"""
+    limiter = SimpleNamespace(remaining=remaining, used=used, reset_timestamp=time.time() + reset_in)
+    return SimpleNamespace(_core=SimpleNamespace(_rate_limiter=limiter))
+
+def ratelimit_error(message):
+    return praw.exceptions.RedditAPIException([["RATELIMIT", message, "ratelimit"]])
+
+@pytest.fixture
+def clock():
+    return FakeClock(start=1000.0)
+
+@pytest.fixture
+def scheduler(clock):
+    return RateLimitScheduler(clock=clock)
+
+def test_no_delay_without_a_known_budget(scheduler):
+    assert scheduler.delay_for("submit") == 0
+    assert scheduler.wait("submit") == 0
+
+def test_min_interval_between_jobs_of_a_kind(scheduler, clock):
+    scheduler.min_intervals["submit"] = 10
+    scheduler.dispatched("submit")
+
+    assert scheduler.delay_for("submit") == 10
+    assert scheduler.delay_for("comment") == 0
+    clock.advance(4)
+    assert scheduler.delay_for("submit") == 6
+
+    waits = []
+    assert scheduler.wait("submit", on_wait=waits.append) == 6
+    assert waits == [6]
+    assert clock.sleeps == [6]
+    assert scheduler.delay_for("submit") == 0
+
+@pytest.mark.parametrize("message, seconds", [
+    ("Looks like you've been doing that a lot. Take a break for 9 minutes before trying again.", 540),
+    ("Take a break for 30 seconds before trying again.", 30),
+    ("Take a break for 1 hour before trying again.", 3600),
+    ("Take a break for 500 milliseconds before trying again.", 0.5),
+    ("You are doing that too much.", 60),
+])
+def test_parse_ratelimit_error(message, seconds):
+    assert parse_ratelimit_error(ratelimit_error(message)) == seconds
+    assert parse_ratelimit_error(Exception(f"RATELIMIT: '{message}'")) == seconds
+
+def test_parse_other_errors():
+    assert parse_ratelimit_error(Exception("received 503 HTTP response")) is None
+    assert parse_ratelimit_error(praw.exceptions.RedditAPIException(
+        [["SUBREDDIT_NOEXIST", "that subreddit doesn't exist", "sr"]])) is None
+
+def test_penalize_blocks_only_that_kind(scheduler, clock):
+    assert scheduler.penalize("submit", ratelimit_error("Take a break for 2 minutes before trying again.")) == 120
+
+    assert scheduler.delay_for("submit") == 120
+    assert scheduler.delay_for("comment") == 0
+    clock.advance(120)
+    assert scheduler.delay_for("submit") == 0
+
+def test_penalize_keeps_the_longer_block(scheduler):
+    scheduler.penalize("submit", ratelimit_error("Take a break for 5 minutes before trying again."))
+    scheduler.penalize("submit", ratelimit_error("Take a break for 1 minute before trying again."))
+
+    assert scheduler.delay_for("submit") == 300
+
+def test_penalize_ignores_other_errors(scheduler):
+    assert scheduler.penalize("submit", Exception("received 503 HTTP response")) is None
+    assert scheduler.delay_for("submit") == 0
+
+def test_budget_spent_down_to_the_reserve_waits_for_the_reset(scheduler, clock):
+    scheduler.update(remaining=3, used=597, reset_in=60)
+
+    scheduler.dispatched("submit")
+    assert scheduler.delay_for("submit") == 0
+    scheduler.dispatched("submit")
+    assert scheduler.remaining == 1
+    # The last request is kept in reserve
+    assert scheduler.delay_for("submit") == 60
+    clock.advance(20)
+    assert scheduler.delay_for("submit") == 40
+
+def test_cost_counts_against_the_budget(scheduler):
+    scheduler.update(remaining=3, reset_in=60)
+
+    assert scheduler.delay_for("submit", cost=2) == 0
+    assert scheduler.delay_for("submit", cost=3) == 60
+
+def test_reserve(clock):
+    scheduler = RateLimitScheduler(clock=clock, reserve=5)
+    scheduler.update(remaining=6, reset_in=30)
+
+    assert scheduler.delay_for("comment") == 0
+    assert scheduler.delay_for("comment", cost=2) == 30
+
+def test_window_reset_forgets_the_budget(scheduler, clock):
+    scheduler.update(remaining=0, used=600, reset_in=60)
+    assert scheduler.wait("submit") == 60
+    assert clock.sleeps == [60]
+
+    # The window rolled over: nothing is known until the next response
+    assert scheduler.delay_for("submit") == 0
+    assert (scheduler.remaining, scheduler.used, scheduler.reset_at) == (None, None, None)
+
+def test_budget_without_reset_time_does_not_block(scheduler):
+    scheduler.update(remaining=0)
+
+    assert scheduler.delay_for("submit") == 0
+
+def test_concurrent_jobs_past_the_budget_are_delayed(clock):
+    # The headers still show the budget before any of the jobs ran
+    scheduler = RateLimitScheduler(fake_reddit(remaining=5, used=595, reset_in=60), clock=clock)
+    scheduler.observe()
+
+    started = 0
+    for _ in range(4):
+        scheduler.observe()
+        if scheduler.delay_for("submit", cost=2) > 0:
+            break
+        scheduler.acquire("submit", cost=2)
+        started += 1
+
+    # 5 requests left, 1 in reserve: room for two jobs of 2 requests
+    assert started == 2
+    assert scheduler.in_flight == 4
+    assert scheduler.delay_for("submit", cost=2) == pytest.approx(60 + RESET_MARGIN, abs=0.1)
+
+def test_released_jobs_free_the_reservation(scheduler):
+    scheduler.update(remaining=10, reset_in=60)
+    scheduler.acquire("comment", cost=4)
+    scheduler.acquire("comment", cost=4)
+    assert scheduler.delay_for("comment", cost=2) == 60
+
+    scheduler.release("comment", cost=4)
+    assert (scheduler.remaining, scheduler.in_flight) == (6, 4)
+    assert scheduler.delay_for("comment") == 0
+    scheduler.release("comment", cost=4)
+    assert (scheduler.remaining, scheduler.in_flight) == (2, 0)
+
+def test_run_intervals_are_restored(scheduler):
+    scheduler.min_intervals["comment"] = 5
+
+    with scheduler.intervals(submit=30, comment=None):
+        assert scheduler.min_intervals == {"submit": 30, "comment": 5}
+    assert scheduler.min_intervals == {"comment": 5}
+
+    with pytest.raises(RuntimeError):
+        with scheduler.intervals(comment=60):
+            raise RuntimeError("run failed")
+    assert scheduler.min_intervals == {"comment": 5}
@@ -0,0 +1,16 @@
+"""Importing the posting modules must not touch the state directory or start threads"""
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+def test_import_main_has_no_side_effects(tmp_path):
+    state_dir = tmp_path / "state"
+    code = "import threading, main; print(threading.active_count())"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                            env={**os.environ, 'RED_POST_STATE_DIR': str(state_dir)})
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split()[-1] == "1"
+    assert not state_dir.exists()
@@ -0,0 +1,81 @@
+"""Subreddit rule checks, on cached entries and against the mock server"""
+import pytest
+
+import subreddit_rules
+from subreddit_rules import check_post
+
+ABOUT = {'submission_type': 'any', 'allow_images': True, 'allow_galleries': True, 'allow_videos': True,
+         'subreddit_type': 'public'}
+
+def entry(about=ABOUT, flair=None, **requirements):
+    return {'about': about and {**ABOUT, **about}, 'requirements': requirements, 'flair': flair}
+
+@pytest.mark.parametrize("rules, post_type, error", [
+    (entry(about=None), "text", "Subreddit does not exist, is banned or is private"),
+    (entry(about={'submission_type': 'link'}), "text", "Subreddit only allows link posts"),
+    (entry(about={'submission_type': 'self'}), "image", "Subreddit only allows text posts"),
+    (entry(about={'allow_images': False}), "gallery", "Subreddit does not allow image posts"),
+    (entry(about={'allow_galleries': False}), "gallery", "Subreddit does not allow gallery posts"),
+    (entry(about={'allow_galleries': False}), "image", None),
+    (entry(about={'allow_videos': False}), "video", "Subreddit does not allow video posts"),
+    (entry(title_text_min_length=20), "text", "Title is shorter than 20 characters"),
+    (entry(title_blacklisted_strings=["POST"]), "text", "Title contains a word the subreddit does not allow"),
+    (entry(title_required_strings=["[OC]"]), "text", "Title is missing a word the subreddit requires"),
+    (entry(title_regexes=[r"^\[\w+\]"]), "text", "Title does not match the subreddit's title format"),
+    (entry(body_restriction_policy="required"), "link", None),
+    (entry(domain_blacklist=["example.com"]), "link", "Link domain is not allowed in the subreddit"),
+    (entry(domain_whitelist=["imgur.com"]), "link", "Link domain is not on the subreddit's allowed list"),
+])
+def test_check_post(rules, post_type, error):
+    _, _, reason = check_post(rules, post_type, "a test post", "", "https://www.example.com/page")
+
+    assert reason == error
+
+@pytest.mark.parametrize("rules, content, error", [
+    (entry(title_text_max_length=5), "", "Title is longer than 5 characters"),
+    (entry(body_restriction_policy="notAllowed"), "body", "Subreddit does not allow a post body"),
+    (entry(is_flair_required=True, flair={'id': 'f1', 'text': 'OC'}), "", "Subreddit requires flair"),
+])
+def test_post_is_not_changed_without_auto_fix(rules, content, error):
+    fields, fixes, reason = check_post(rules, "text", "a test post", content, None, auto_fix=False)
+
+    assert reason == error
+    assert fixes == []
+
+def test_auto_fix_changes_the_post():
+    rules = entry(title_text_max_length=6, body_restriction_policy="notAllowed", is_flair_required=True,
+                  flair={'id': 'f1', 'text': 'OC'})
+
+    fields, fixes, reason = check_post(rules, "text", "a test post", "body", None, auto_fix=True)
+
+    assert reason is None
+    assert fields == {"title": "a test", "content": "", "flair_id": "f1", "flair_text": "OC"}
+    assert len(fixes) == 3
+
+def test_auto_fix_needs_a_flair_to_pick():
+    _, _, reason = check_post(entry(is_flair_required=True), "text", "title", "", None, auto_fix=True)
+
+    assert reason == "Subreddit requires flair and has none users can pick"
+
+def test_flair_required_subreddit_is_rejected_before_anything_is_sent(mock, engine):
+    mock.subreddits['flaired'] = {'requirements': {'is_flair_required': True},
+                                  'flair_choices': [{'flair_template_id': 'f1', 'flair_text': 'OC'}]}
+    mock.subreddits['missing'] = {'about': None}
+
+    (successful, failed, _), _ = engine.post_and_comment("a test post", "body", ["ok", "flaired", "missing"])
+
+    assert successful == ["ok"]
+    assert sorted(failed) == ["flaired", "missing"]
+    assert mock.stats['endpoints']['submit'] == 1
+
+def test_auto_fix_is_logged(mock, engine, monkeypatch, caplog):
+    monkeypatch.setattr(subreddit_rules, 'AUTO_FIX', True)
+    mock.subreddits['flaired'] = {'requirements': {'is_flair_required': True, 'title_text_max_length': 6},
+                                  'flair_choices': [{'flair_template_id': 'f1', 'flair_text': 'OC'}]}
+
+    (successful, _, submissions), _ = engine.post_and_comment("a test post", "body", ["flaired"])
+
+    assert successful == ["flaired"]
+    submitted = mock.submissions[submissions[0].id]
+    assert (submitted['title'], submitted.get('link_flair_template_id')) == ("a test", "f1")
+    assert any(record.levelname == "WARNING" and "r/flaired" in record.message for record in caplog.records)